@@ -0,0 +1,64 @@
+# Compare the throughput and the memory allocated by the chunkers
+# on the example PDFs, from the root of the repo:
+# python -m examples.benchmark_chunkers
+import asyncio
+import glob
+import time
+import tracemalloc
+from io import BytesIO
+from typing import List, Tuple
+from src.chunkers.chunker import (
+    ApproximateChunkerWithOverlap, BaseChunker, SentenceChunker
+)
+from src.models import Metadata
+from src.parsers.parser import AdvancedPDFParser
+
+REPEATS = 20
+
+
+async def benchmark(
+    chunker: BaseChunker,
+    documents: List[Tuple[str, Metadata]]
+) -> Tuple[float, float, int]:
+    """
+    Return the throughput in MB of text per second, the peak memory
+    allocated while chunking in MB and the number of chunks
+    """
+    size = sum(len(text) for text, _ in documents)
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for text, metadata in documents:
+            await chunker.chunk_text(text, metadata)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    num_chunks = 0
+    for text, metadata in documents:
+        num_chunks += len(await chunker.chunk_text(text, metadata))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return REPEATS * size / elapsed / 1e6, peak / 1e6, num_chunks
+
+
+async def main() -> None:
+    parser = AdvancedPDFParser()
+    documents = []
+    for path in sorted(glob.glob("examples/pdfs/*.pdf")):
+        with open(path, "rb") as file:
+            documents.append(await parser.parse(BytesIO(file.read())))
+    size = sum(len(text) for text, _ in documents)
+    print(f"{len(documents)} documents, {size / 1e6:.2f} MB of text")
+
+    chunkers = {
+        "approximate": ApproximateChunkerWithOverlap(
+            chunk_size=512, chunk_overlap=128),
+        "sentence": SentenceChunker(chunk_size=512, chunk_overlap=128),
+    }
+    for name, chunker in chunkers.items():
+        throughput, peak, num_chunks = await benchmark(chunker, documents)
+        print(f"{name:>12}: {throughput:6.1f} MB/s, "
+              f"peak {peak:6.2f} MB, {num_chunks} chunks")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import asyncio
 from typeguard import typechecked
 import os
 from mistralai import Mistral
@@ -7,10 +8,15 @@ from mistralai.models import (
     ChatCompletionResponse
 )
 from src.retrievers.retriever_pipeline import BaseRetrieverPipeline
-from typing import List, Any, Tuple, Union, Optional
+from typing import (
+    AsyncIterator, Dict, List, Any, Set, Tuple, Union, Optional
+)
 import json
+from src.agents.context import AgentContext
 from src.agents.tools import get_default_tools
-from src.models import Query, GenerateResponse, Vector
+from src.models import (
+    Query, GenerateEvent, GenerateResponse, SearchFilter, Vector
+)
 import logging
 
 
@@ -51,12 +57,14 @@ class SimpleAgent(Agent):
     def __init__(
         self,
         mistral_api_key: str = "",
-        model: str = "mistral-large-latest"
+        model: str = "mistral-large-latest",
+        client: Optional[Mistral] = None
     ):
         self.mistral_api_key = mistral_api_key or os.getenv("MISTRAL_API_KEY")
         if not self.mistral_api_key:
             raise ValueError("Mistral API key must be provided")
-        self.client = Mistral(api_key=self.mistral_api_key)
+        # a client shared by the agents reuses its connections
+        self.client = client or Mistral(api_key=self.mistral_api_key)
         self.model = model
 
     async def chat(self, query: str) -> str:
@@ -92,15 +100,26 @@ class RAGAgent(Agent):
         self,
         retriever_pipeline: BaseRetrieverPipeline,
         mistral_api_key: str = "",
-        model: str = "mistral-large-latest"
+        model: str = "mistral-large-latest",
+        search_filter: Optional[SearchFilter] = None,
+        client: Optional[Mistral] = None,
+        max_concurrent_tool_calls: int = 4,
+        max_context_tokens: Optional[int] = None
     ):
         self.mistral_api_key = mistral_api_key or os.getenv("MISTRAL_API_KEY")
         if not self.mistral_api_key:
             raise ValueError("Mistral API key must be provided")
-        self.client = Mistral(api_key=self.mistral_api_key)
+        # a client shared by the agents reuses its connections
+        self.client = client or Mistral(api_key=self.mistral_api_key)
         self.model = model
         self.retriever_pipeline = retriever_pipeline
+        # restricts every query to the knowledge base
+        self.search_filter = search_filter
         self.tools = get_default_tools()
+        # tool calls of one turn run at the same time, up to this number
+        self.max_concurrent_tool_calls = max_concurrent_tool_calls
+        # tokens of retrieved chunks sent to the model, None for no limit
+        self.max_context_tokens = max_context_tokens
         logger.info(f"Initialized RAGAgent with model: {model}")
 
     async def _call_tool(self, tool_name: str, **kwargs: Any) -> Any:
@@ -112,9 +131,49 @@ class RAGAgent(Agent):
             return result
         raise ValueError(f"Unknown tool: {tool_name}")
 
+    async def _call_tools(
+        self,
+        tool_calls: List[Any],
+        calls: Dict[str, "asyncio.Task[Any]"]
+    ) -> List[Tuple[str, Dict[str, Any], Any]]:
+        """
+        Run the tool calls of a turn concurrently, and return the key,
+        arguments and output of each distinct call in the order of the
+        calls. Calls already made in this chat, kept in calls by key, are
+        not made again.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_tool_calls)
+
+        async def call_tool(tool_name: str, args: Dict[str, Any]) -> Any:
+            async with semaphore:
+                return await self._call_tool(tool_name, **args)
+
+        turn: Dict[str, Dict[str, Any]] = {}
+        for tool_call in tool_calls:
+            logger.info(f"Executing tool call: {tool_call}")
+            args = json.loads(tool_call.function.arguments)
+            key = json.dumps(
+                [tool_call.function.name, args], sort_keys=True)
+            if key not in calls:
+                calls[key] = asyncio.create_task(
+                    call_tool(tool_call.function.name, args))
+            turn.setdefault(key, args)
+        tasks = [calls[key] for key in turn]
+        try:
+            outputs = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return [
+            (key, args, output)
+            for (key, args), output in zip(turn.items(), outputs)
+        ]
+
     async def _query_knowledge_base(self, query: str) -> List[Vector]:
         logger.info(f"Querying knowledge base with: {query}")
-        docs: List[Vector] = await self.retriever_pipeline.retrieve(query)
+        docs: List[Vector] = await self.retriever_pipeline.retrieve(
+            query, search_filter=self.search_filter)
         logger.info(f"Retrieved {len(docs)} documents")
         return docs
 
@@ -122,7 +181,11 @@ class RAGAgent(Agent):
         self,
         messages: List[MessageType],
         use_tools: bool = True
-    ) -> Tuple[str, List[Any]]:
+    ) -> Tuple[str, List[Any], int]:
+        """
+        Content, tool calls and number of prompt tokens of the response of
+        the LLM
+        """
         logger.info("Getting LLM response")
         logger.info(f"Messages: {messages}")
         try:
@@ -157,13 +220,78 @@ class RAGAgent(Agent):
             if tool_calls:
                 logger.info(f"Tool calls requested: {tool_calls}")
 
-            return content, tool_calls
+            prompt_tokens = response.usage.prompt_tokens \
+                if response.usage else 0
+            return content, tool_calls, prompt_tokens or 0
+
+        except Exception as e:
+            logger.error(f"Error in LLM call: {str(e)}", exc_info=True)
+            raise LLMError(f"Error in LLM call: {str(e)}") from e
 
+    async def _stream_llm_response(
+        self,
+        messages: List[MessageType]
+    ) -> AsyncIterator[Tuple[str, List[Any], int]]:
+        """
+        Stream the pieces of content and the tool calls of the response of
+        the LLM as they are generated, and the number of prompt tokens with
+        the last piece
+        """
+        logger.info("Streaming LLM response")
+        try:
+            stream = await self.client.chat.stream_async(
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=1000,
+                tools=self.tools,
+                tool_choice="auto",
+                response_format=None,
+            )
+            if not stream:
+                logger.error("No response received from LLM")
+                raise NoResponseError("Failed to get response from the model")
+            async with stream:
+                async for event in stream:
+                    prompt_tokens = event.data.usage.prompt_tokens \
+                        if event.data.usage else 0
+                    if prompt_tokens:
+                        yield "", [], prompt_tokens
+                    if not event.data.choices:
+                        continue
+                    delta = event.data.choices[0].delta
+                    content = delta.content
+                    if not isinstance(content, str):
+                        # chunks of text, or nothing
+                        content = "".join(
+                            getattr(chunk, "text", "")
+                            for chunk in content or [])
+                    tool_calls = delta.tool_calls or []
+                    if content or tool_calls:
+                        yield content, tool_calls, 0
         except Exception as e:
             logger.error(f"Error in LLM call: {str(e)}", exc_info=True)
             raise LLMError(f"Error in LLM call: {str(e)}") from e
 
     async def chat(self, query: str) -> GenerateResponse:
+        async for event in self._run(query, stream=False):
+            if event.response is not None:
+                return event.response
+        raise EmptyResponseError("No response generated by the agent")
+
+    def chat_stream(self, query: str) -> AsyncIterator[GenerateEvent]:
+        """
+        Events of the chat as they happen: the queries to the knowledge
+        base and the ids they retrieved, then the answer token by token,
+        and finally the whole response
+        """
+        return self._run(query, stream=True)
+
+    async def _run(
+        self,
+        query: str,
+        stream: bool
+    ) -> AsyncIterator[GenerateEvent]:
         logger.info(f"Starting chat with query: {query}")
         system_prompt = (
             "You are an intelligent, agentic assistant designed to help the user with their questions. "  # noqa: E501
@@ -173,17 +301,42 @@ class RAGAgent(Agent):
             "You should not query the knowledge base for simple questions you can answer directly."  # noqa: E501
         )
 
-        messages: List[MessageType] = [
-            SystemMessage(content=system_prompt),
-            UserMessage(content=query)
-        ]
         queries: List[Query] = []
+        # chunks retrieved in this chat, each shown once, and the responses
+        # of the model in the turns that retrieved them
+        context = AgentContext(max_tokens=self.max_context_tokens)
+        turn_responses: List[str] = []
+        prompt_tokens = 0
+        # tool calls of this chat by their name and arguments
+        calls: Dict[str, "asyncio.Task[Any]"] = {}
+        recorded: Set[str] = set()
 
         counter = 0
         while counter < 5:
             logger.info(f"Processing iteration {counter + 1}")
+            messages = self._build_messages(
+                system_prompt, query, turn_responses, context)
             # Get LLM response and potential tool calls
-            response_text, tool_calls = await self._get_llm_response(messages)
+            if stream:
+                response_text = ""
+                tool_calls: List[Any] = []
+                # the content of a turn is sent as it arrives, until the
+                # turn calls a tool: then it is not part of the answer, and
+                # the client discards the tokens of the turn already sent
+                async for content, new_tool_calls, tokens in \
+                        self._stream_llm_response(messages):
+                    if new_tool_calls and not tool_calls and response_text:
+                        yield GenerateEvent(event="discard")
+                    tool_calls.extend(new_tool_calls)
+                    if content:
+                        response_text += content
+                        if not tool_calls:
+                            yield GenerateEvent(event="token", token=content)
+                    prompt_tokens += tokens
+            else:
+                response_text, tool_calls, tokens = \
+                    await self._get_llm_response(messages)
+                prompt_tokens += tokens
             # If no tool calls, we're done
             if not tool_calls:
                 logger.info(
@@ -191,16 +344,27 @@ class RAGAgent(Agent):
                 )
                 break
 
-            # Execute all tool calls
-            results = []
+            # Execute the tool calls of the turn concurrently, the
+            # queries already made in this chat are not made again
             for tool_call in tool_calls:
-                logger.info(f"Executing tool call: {tool_call}")
-                args = json.loads(tool_call.function.arguments)
-                tool_output = await self._call_tool(
-                    tool_call.function.name, **args)
-                text_results = [result.text for result in tool_output]
-                results.extend(text_results)
-                logger.info(f"Tool call results: {text_results}")
+                yield GenerateEvent(
+                    event="tool_call",
+                    query=json.loads(tool_call.function.arguments).get(
+                        "rewritten_query")
+                )
+            results: List[List[Vector]] = []
+            for key, args, tool_output in await self._call_tools(
+                    tool_calls, calls):
+                yield GenerateEvent(
+                    event="retrieved",
+                    query=args.get("rewritten_query"),
+                    retrieved_ids=[result.vector_id for result in tool_output]
+                )
+                results.append(tool_output)
+                logger.info(f"Tool call results: {tool_output}")
+                if key in recorded:
+                    continue
+                recorded.add(key)
                 # append the query to the queries list
                 queries.append(
                     Query(
@@ -210,17 +374,47 @@ class RAGAgent(Agent):
                     )
                 )
 
-            # Add assistant's response and tool results to messages
+            # Add assistant's response and the new chunks to the context
+            new_chunks = context.add_turn(results)
+            turn_responses.append(response_text)
+            logger.info(
+                f"Added {new_chunks} new chunks to the context, "
+                f"{context.num_tokens()} tokens in total")
+
+            counter += 1
+
+        logger.info("Reached maximum iterations, returning final response")
+        logger.info(f"Prompt tokens of the chat: {prompt_tokens}")
+        yield GenerateEvent(
+            event="done",
+            response=GenerateResponse(
+                response=response_text,
+                queries=queries,
+                prompt_tokens=prompt_tokens
+            )
+        )
+
+    def _build_messages(
+        self,
+        system_prompt: str,
+        query: str,
+        turn_responses: List[str],
+        context: AgentContext
+    ) -> List[MessageType]:
+        """
+        Messages of the chat, with the chunks kept in the context after the
+        response of the model in the turn that retrieved them
+        """
+        messages: List[MessageType] = [
+            SystemMessage(content=system_prompt),
+            UserMessage(content=query)
+        ]
+        for response_text, chunks in zip(turn_responses, context.render()):
             messages.extend([
                 SystemMessage(content=response_text),
                 UserMessage(
-                    content=f"Tool call results: {' '.join(results)}. "
+                    content=f"Tool call results: {chunks or 'no new results'}. "  # noqa: E501
                     "Please continue with your analysis or provide a final answer."  # noqa: E501
                 )
             ])
-            logger.info("Added tool results to conversation")
-
-            counter += 1
-
-        logger.info("Reached maximum iterations, returning final response")
-        return GenerateResponse(response=response_text, queries=queries)
+        return messages
@@ -0,0 +1,137 @@
+# knowledge base context given to the agent across the turns of a chat
+from typing import Callable, Dict, List, Optional
+from typeguard import typechecked
+from src.chunkers.chunker import chunk_header
+from src.embedders.batching_embedder import estimate_tokens
+from src.models import Vector
+
+
+class _Chunk:
+    def __init__(self, vector: Vector, header: str, body: str, score: float):
+        self.vector = vector
+        self.header = header
+        self.body = body
+        self.score = score
+        self.kept = True
+
+
+@typechecked
+class AgentContext:
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        count_tokens: Callable[[str], int] = estimate_tokens
+    ):
+        """
+        Chunks retrieved by the tool calls of a chat, grouped by the turn
+        that first retrieved them. A chunk retrieved again in a later turn
+        is not repeated, the header of a document is given once before its
+        first chunk, and when the chunks exceed max_tokens the lowest
+        scored ones are dropped, from any turn, until they fit.
+        A chunk scores 1 / (1 + rank) for its rank in the reranked results
+        of its query, since the retrieval scores of the dense, sparse and
+        hybrid retrievers are not on the same scale.
+
+        Args:
+            max_tokens (Optional[int]): Maximum number of tokens of the
+                chunks and headers, or None for no limit.
+            count_tokens (Callable[[str], int]): Counts the tokens of a
+                text.
+        """
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self._turns: List[List[_Chunk]] = []
+        self._chunks: Dict[str, _Chunk] = {}
+        self._tokens: Dict[str, int] = {}
+
+    def add_turn(self, results: List[List[Vector]]) -> int:
+        """
+        Add the results of the queries of a turn, each sorted from the most
+        relevant, and return the number of chunks not seen before
+        """
+        turn: List[_Chunk] = []
+        for vectors in results:
+            for rank, vector in enumerate(vectors):
+                score = 1 / (1 + rank)
+                seen = self._chunks.get(vector.vector_id)
+                if seen is not None:
+                    seen.score = max(seen.score, score)
+                    continue
+                header = chunk_header(vector.metadata)
+                body = vector.text[len(header):] \
+                    if vector.text.startswith(header) else vector.text
+                chunk = _Chunk(vector, header, body, score)
+                self._chunks[vector.vector_id] = chunk
+                turn.append(chunk)
+        self._turns.append(turn)
+        self._fit()
+        return len(turn)
+
+    def render(self) -> List[str]:
+        """
+        Text of the chunks kept in each turn, with the header of each
+        document before its first kept chunk
+        """
+        shown_parents = set()
+        texts = []
+        for turn in self._turns:
+            parts = []
+            for chunk in turn:
+                if not chunk.kept:
+                    continue
+                if chunk.vector.parent_id not in shown_parents:
+                    shown_parents.add(chunk.vector.parent_id)
+                    parts.append(chunk.header + chunk.body)
+                else:
+                    parts.append(chunk.body)
+            texts.append("\n\n".join(parts))
+        return texts
+
+    def num_tokens(self) -> int:
+        parents: Dict[str, str] = {}
+        tokens = 0
+        for turn in self._turns:
+            for chunk in turn:
+                if chunk.kept:
+                    parents.setdefault(chunk.vector.parent_id, chunk.header)
+                    tokens += self._count(chunk.body)
+        return tokens + sum(
+            self._count(header) for header in parents.values())
+
+    def kept_ids(self) -> List[str]:
+        return [
+            chunk.vector.vector_id
+            for turn in self._turns for chunk in turn if chunk.kept
+        ]
+
+    def _count(self, text: str) -> int:
+        if text not in self._tokens:
+            self._tokens[text] = self.count_tokens(text)
+        return self._tokens[text]
+
+    def _fit(self) -> None:
+        if self.max_tokens is None:
+            return
+        tokens = self.num_tokens()
+        if tokens <= self.max_tokens:
+            return
+        kept = [
+            chunk for turn in self._turns for chunk in turn if chunk.kept
+        ]
+        # the header of a document counts while any of its chunks is kept
+        headers: Dict[str, str] = {}
+        num_kept: Dict[str, int] = {}
+        for chunk in kept:
+            parent_id = chunk.vector.parent_id
+            headers.setdefault(parent_id, chunk.header)
+            num_kept[parent_id] = num_kept.get(parent_id, 0) + 1
+        # the latest of the lowest scored chunks is dropped first
+        for chunk in sorted(reversed(kept), key=lambda chunk: chunk.score):
+            if tokens <= self.max_tokens:
+                return
+            chunk.kept = False
+            tokens -= self._count(chunk.body)
+            parent_id = chunk.vector.parent_id
+            num_kept[parent_id] -= 1
+            if num_kept[parent_id] == 0:
+                tokens -= self._count(headers[parent_id])
@@ -0,0 +1,232 @@
+# cache of the answers of the agent, looked up by the meaning of the query
+from collections import OrderedDict
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from typeguard import typechecked
+from src.embedders.dense_embedder import BaseDenseEmbedder
+from src.models import GenerateResponse
+
+
+class _Entry:
+    def __init__(
+        self,
+        embedding: np.ndarray,
+        scope: str,
+        response: GenerateResponse,
+        parent_ids: Set[str],
+        expires_at: float
+    ):
+        self.embedding = embedding
+        self.scope = scope
+        self.response = response
+        self.parent_ids = parent_ids
+        self.expires_at = expires_at
+        self.size = embedding.nbytes + len(response.model_dump_json()) + \
+            sum(len(parent_id) for parent_id in parent_ids)
+
+
+@typechecked
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        embedder: BaseDenseEmbedder,
+        similarity_threshold: float = 0.95,
+        max_size: int = 1024,
+        ttl_seconds: Optional[float] = 3600,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Answers of the agent for one tenant, looked up by the embedding of
+        their query: a query whose cosine similarity with an answered query
+        is at least similarity_threshold gets the stored answer, so that
+        near-identical questions skip the agent. Entries are evicted least
+        recently used first when there are more than max_size of them or
+        they take more than max_memory_bytes, expire after ttl_seconds, and
+        are invalidated when a document they cite is deleted or
+        re-indexed, by this worker or, after sync, by any worker.
+
+        Args:
+            embedder (BaseDenseEmbedder): Embedder of the queries.
+            similarity_threshold (float): Minimum cosine similarity of a
+                query with a cached query to return its answer.
+            max_size (int): Maximum number of entries.
+            ttl_seconds (Optional[float]): Time after which an entry
+                expires, or None if entries never expire.
+            max_memory_bytes (int): Approximate maximum size of the
+                entries.
+            clock (Callable[[], float]): Clock used to expire entries.
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.clock = clock
+        # entry id -> entry, least recently used first
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        # parent_id -> ids of the entries citing the document
+        self._by_parent: Dict[str, Set[int]] = {}
+        self._next_id = 0
+        self._memory_bytes = 0
+        # stacked embeddings of the entries, rebuilt after a change
+        self._matrix: Optional[Tuple[List[int], np.ndarray]] = None
+        # incremented by every invalidation, so that an answer computed
+        # from documents deleted in the meantime is not stored
+        self.version = 0
+        # number of changes of the documents of the tenant at the last sync
+        self.changes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def embed_query(self, query: str) -> np.ndarray:
+        embedding = np.asarray(
+            await self.embedder.embed_text(query, input_type="search_query"),
+            dtype=np.float32)
+        norm = float(np.linalg.norm(embedding))
+        return embedding / norm if norm > 0 else embedding
+
+    async def lookup(
+        self,
+        query: str,
+        scope: str = ""
+    ) -> Optional[GenerateResponse]:
+        """
+        Answer of the most similar cached query asked in the same scope
+        (the search filter of the request), if it is similar enough
+        """
+        if not self._entries:
+            self.misses += 1
+            return None
+        embedding = await self.embed_query(query)
+        now = self.clock()
+        ids, matrix = self._stacked()
+        similarities = matrix @ embedding
+        for i in np.argsort(-similarities):
+            if similarities[i] < self.similarity_threshold:
+                break
+            entry = self._entries.get(ids[i])
+            if entry is None or entry.scope != scope:
+                continue
+            if entry.expires_at <= now:
+                self._remove(ids[i])
+                continue
+            self._entries.move_to_end(ids[i])
+            self.hits += 1
+            return entry.response
+        self.misses += 1
+        return None
+
+    async def store(
+        self,
+        query: str,
+        response: GenerateResponse,
+        parent_ids: Iterable[str],
+        scope: str = "",
+        version: Optional[int] = None
+    ) -> bool:
+        """
+        Cache the answer to a query, unless the cache was invalidated since
+        version, taken before the answer was computed
+        """
+        if version is not None and version != self.version:
+            return False
+        embedding = await self.embed_query(query)
+        if version is not None and version != self.version:
+            return False
+        expires_at = float("inf") if self.ttl_seconds is None \
+            else self.clock() + self.ttl_seconds
+        entry = _Entry(
+            embedding, scope, response, set(parent_ids), expires_at)
+        if entry.size > self.max_memory_bytes:
+            return False
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._memory_bytes += entry.size
+        for parent_id in entry.parent_ids:
+            self._by_parent.setdefault(parent_id, set()).add(entry_id)
+        self._matrix = None
+        while len(self._entries) > self.max_size or \
+                self._memory_bytes > self.max_memory_bytes:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    def invalidate(self, parent_ids: Iterable[str]) -> int:
+        """
+        Remove the answers citing any of the documents, and return their
+        number
+        """
+        self.version += 1
+        entry_ids: Set[int] = set()
+        for parent_id in parent_ids:
+            entry_ids |= self._by_parent.get(parent_id, set())
+        for entry_id in entry_ids:
+            self._remove(entry_id)
+        self.invalidations += len(entry_ids)
+        return len(entry_ids)
+
+    def sync(self, changes: int, latest: List[Optional[List[str]]]) -> None:
+        """
+        Invalidate the answers citing the documents changed by any worker
+        since the last sync, given the number of changes of the documents
+        of the tenant and the ids of the documents of the latest changes,
+        see BaseDatabaseHandler.get_changes. The cache is cleared when
+        the ids of some of these changes are not known.
+        """
+        if changes == self.changes:
+            return
+        missed = None if self.changes is None else changes - self.changes
+        if missed is None or not 0 < missed <= len(latest) or \
+                any(change is None for change in latest[-missed:]):
+            self.clear()
+        else:
+            self.invalidate(
+                parent_id
+                for change in latest[-missed:] for parent_id in change or []
+            )
+        self.changes = changes
+
+    def clear(self) -> None:
+        self.version += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._by_parent.clear()
+        self._memory_bytes = 0
+        self._matrix = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "memory_bytes": self._memory_bytes,
+        }
+
+    def _stacked(self) -> Tuple[List[int], np.ndarray]:
+        if self._matrix is None:
+            ids = list(self._entries)
+            self._matrix = (ids, np.stack(
+                [self._entries[entry_id].embedding for entry_id in ids]))
+        return self._matrix
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self._memory_bytes -= entry.size
+        for parent_id in entry.parent_ids:
+            citing = self._by_parent.get(parent_id)
+            if citing is not None:
+                citing.discard(entry_id)
+                if not citing:
+                    del self._by_parent[parent_id]
+        self._matrix = None
@@ -0,0 +1,228 @@
+# caches shared by the embedders, rerankers and agents
+from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReplaceOne
+from pymongo.errors import PyMongoError
+from typeguard import typechecked
+
+
+logger = logging.getLogger(__name__)
+
+
+@typechecked
+class LRUCache:
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        In-process least recently used cache with an optional time to live.
+        None values cannot be cached, since get returns None on a miss.
+
+        Args:
+            max_size (int): Maximum number of entries.
+            ttl_seconds (Optional[float]): Time after which an entry expires,
+                or None if entries never expire.
+            clock (Callable[[], float]): Clock used to expire entries.
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        # key -> (expiration time, value), least recently used first
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= self.clock():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = float("inf") if self.ttl_seconds is None \
+            else self.clock() + self.ttl_seconds
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
+@typechecked
+class BaseCacheBackend(ABC):
+    """
+    Cache shared by the replicas of the app
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Any) -> None:
+        pass
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Return the values of the keys that are in the cache. Backends
+        without a bulk read path look the keys up one by one.
+        """
+        values: Dict[str, Any] = {}
+        for key in keys:
+            value = await self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    async def set_many(self, items: Dict[str, Any]) -> None:
+        for key, value in items.items():
+            await self.set(key, value)
+
+
+@typechecked
+class MongoDBCacheBackend(BaseCacheBackend):
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        ttl_seconds: Optional[int] = None
+    ):
+        """
+        Cache stored in a MongoDB collection. Entries are expired by a TTL
+        index on their creation date. The cache is an optimization, so
+        database errors are logged and treated as misses.
+        """
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self._index_created = False
+
+    async def _ensure_index(self) -> None:
+        if self._index_created or self.ttl_seconds is None:
+            return
+        await self.collection.create_index(
+            "created_at", expireAfterSeconds=self.ttl_seconds)
+        self._index_created = True
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            doc = await self.collection.find_one({"_id": key})
+        except PyMongoError:
+            logger.warning("Cache lookup failed", exc_info=True)
+            return None
+        return doc["value"] if doc is not None else None
+
+    async def set(self, key: str, value: Any) -> None:
+        await self.set_many({key: value})
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        values: Dict[str, Any] = {}
+        try:
+            async for doc in self.collection.find({"_id": {"$in": keys}}):
+                values[doc["_id"]] = doc["value"]
+        except PyMongoError:
+            logger.warning("Cache lookup failed", exc_info=True)
+        return values
+
+    async def set_many(self, items: Dict[str, Any]) -> None:
+        if not items:
+            return
+        created_at = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            await self._ensure_index()
+            await self.collection.bulk_write(
+                [
+                    ReplaceOne(
+                        {"_id": key},
+                        {"_id": key, "value": value, "created_at": created_at},
+                        upsert=True
+                    )
+                    for key, value in items.items()
+                ],
+                ordered=False
+            )
+        except PyMongoError:
+            logger.warning("Cache update failed", exc_info=True)
+
+
+@typechecked
+class SQLiteCacheBackend(BaseCacheBackend):
+    def __init__(self, path: str):
+        """
+        Cache stored in a local SQLite file, for deployments without a
+        shared database. Values are stored as JSON and never expire.
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._connection.commit()
+        # the connection is shared by the threads of asyncio.to_thread
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self.get_many([key])).get(key)
+
+    async def set(self, key: str, value: Any) -> None:
+        await self.set_many({key: value})
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._get_many, keys)
+
+    async def set_many(self, items: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._set_many, items)
+
+    def _get_many(self, keys: List[str]) -> Dict[str, Any]:
+        values: Dict[str, Any] = {}
+        # SQLite limits the number of parameters of a statement
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT key, value FROM cache WHERE key IN "
+                    f"({', '.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+            values.update((key, json.loads(value)) for key, value in rows)
+        return values
+
+    def _set_many(self, items: Dict[str, Any]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in items.items()]
+            )
+
+    def close(self) -> None:
+        self._connection.close()
@@ -1,10 +1,60 @@
 # 2. Chunker
 from abc import ABC, abstractmethod
-from typing import List
+import math
+import re
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 from typeguard import typechecked
 from src.models import Metadata
 
 
+WORD = re.compile(r"\S+")
+# end of a sentence, with its closing quotes or brackets, or a blank line.
+# Both alternatives start with one character class, so that the regex only
+# tries to match at the few positions where a boundary can start.
+SENTENCE_BOUNDARY = re.compile(
+    r"[.!?\n](?:(?<=[.!?])[.!?]*[\"')\]]*\s|(?<=\n)[ \t]*\n)\s*")
+
+
+@typechecked
+def chunk_header(metadata: Metadata) -> str:
+    """
+    Header of the metadata added to the chunks that are embedded
+    """
+    return (
+        f"Title: {metadata.title}\n"
+        f"Author: {metadata.author}\n"
+        f"Description: {metadata.description}\n\n"
+    )
+
+
+@typechecked
+def chunks_from_spans(
+    text: str,
+    metadata: Metadata,
+    spans: List[Tuple[int, int]]
+) -> List[str]:
+    """
+    Chunks embedded for (start, end) spans of the text, with their header
+    """
+    header = chunk_header(metadata)
+    return [header + text[start:end] for start, end in spans]
+
+
+@typechecked
+def load_token_counter(tokenizer_path: str) -> Callable[[str], int]:
+    """
+    Count tokens with a tokenizer saved in the format of the Hugging Face
+    tokenizers library (tokenizer.json)
+    """
+    from tokenizers import Tokenizer  # type: ignore
+
+    tokenizer = Tokenizer.from_file(tokenizer_path)
+
+    def count_tokens(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return count_tokens
+
+
 # Abstract class for chunking text
 @typechecked
 class BaseChunker(ABC):
@@ -13,6 +63,28 @@ class BaseChunker(ABC):
     async def chunk_text(self, text: str, metadata: Metadata) -> List[str]:
         pass
 
+    def chunk_spans(self, text: str) -> List[Tuple[int, int]]:
+        """
+        (start, end) character spans of the chunks of the text, whose
+        chunks are chunks_from_spans, used to store vectors without a copy
+        of their text
+        """
+        raise NotImplementedError("This chunker cannot return spans")
+
+    async def chunk_stream(
+        self,
+        pages: AsyncIterator[str],
+        metadata: Metadata
+    ) -> AsyncIterator[str]:
+        """
+        Chunk the text of a document given page by page, yielding the same
+        chunks as chunk_text on the concatenated text. Chunkers that cannot
+        chunk incrementally read all the pages first.
+        """
+        text = "".join([page async for page in pages])
+        for chunk in await self.chunk_text(text, metadata):
+            yield chunk
+
 
 @typechecked
 class SimpleChunker(BaseChunker):
@@ -39,30 +111,40 @@ class ApproximateChunkerWithOverlap(BaseChunker):
         # to avoid using more expensive tokenization
         self.word_to_token_conversion_rate = 0.75
 
-    async def _approximate_split_text(self, text: str) -> List[str]:
+    @typechecked
+    def chunk_spans(self, text: str) -> List[Tuple[int, int]]:
         """
         Splits the text into chunks where each chunk contains
         an approximate number of words.
         chunk_size = 512 -- words_per_chunk = 512*0.75 = 384
         chunk_overlap = 128 -- word_overlap = 128*0.75 = 96
+        The chunks keep the whitespace of the text between their words.
         """
         words_per_chunk = round(
             self.chunk_size * self.word_to_token_conversion_rate)
         words_overlap = round(
             self.chunk_overlap * self.word_to_token_conversion_rate)
-        words = text.split()
+        step = words_per_chunk - words_overlap
+        # chunks start and end at the boundaries of groups of words, which
+        # are found by the regex without a match per word
+        group_size = max(1, math.gcd(step, words_overlap))
+        groups = [
+            match.span() for match in re.finditer(
+                r"\S+(?:\s+\S+){0,%d}" % (group_size - 1), text)
+        ]
         # split the text into chunks of words_per_chunk with
         # overlap of words_overlap
-        chunks: List[str] = []
-        for i in range(0, len(words), words_per_chunk - words_overlap):
-            chunk = " ".join(words[i:i + words_per_chunk])
-            chunks.append(chunk)
-        return chunks
+        groups_per_chunk = words_per_chunk // group_size
+        return [
+            (groups[i][0],
+             groups[min(i + groups_per_chunk, len(groups)) - 1][1])
+            for i in range(0, len(groups), step // group_size)
+        ]
 
     @typechecked
     async def chunk_text(self, text: str, metadata: Metadata) -> List[str]:
         """
-         Uses Cohere tokenizer to chunk text in chunks of chunk_size
+         Chunk text in chunks of approximately chunk_size tokens
          with overlap of chunk_overlap
          Aso enhance chunk text with the metadata following the pattern:
             Title: ...
@@ -70,16 +152,211 @@ class ApproximateChunkerWithOverlap(BaseChunker):
             Description: ...
             ...
             {chunk}
+         The chunks are the same for both vector layouts, since they are
+         built from chunk_spans.
          """
-        chunks = await self._approximate_split_text(text=text)
-        enhanced_chunks = []
-        for chunk in chunks:
-            enhanced_chunk = (
-                f"Title: {metadata.title}\n"
-                f"Author: {metadata.author}\n"
-                f"Description: {metadata.description}\n\n"
-                f"{''.join(chunk)}"
-            )
-            enhanced_chunks.append(enhanced_chunk)
-
-        return enhanced_chunks
+        return chunks_from_spans(text, metadata, self.chunk_spans(text))
+
+    async def chunk_stream(
+        self,
+        pages: AsyncIterator[str],
+        metadata: Metadata
+    ) -> AsyncIterator[str]:
+        """
+        Chunk the pages as they arrive, keeping in memory only the text
+        that is not yet part of a complete chunk
+        """
+        words_per_chunk = round(
+            self.chunk_size * self.word_to_token_conversion_rate)
+        words_overlap = round(
+            self.chunk_overlap * self.word_to_token_conversion_rate)
+        step = words_per_chunk - words_overlap
+        header = chunk_header(metadata)
+        text = ""
+        # spans in text of the words found so far, and the end of the last
+        # one. A word at the end of a page can continue on the next page.
+        words: List[Tuple[int, int]] = []
+        scanned = 0
+        async for page in pages:
+            text += page
+            for match in WORD.finditer(text, scanned):
+                if match.end() == len(text):
+                    break
+                words.append(match.span())
+                scanned = match.end()
+            start = 0
+            while start + words_per_chunk <= len(words):
+                yield header + text[
+                    words[start][0]:words[start + words_per_chunk - 1][1]]
+                start += step
+            if start == 0:
+                continue
+            del words[:start]
+            offset = words[0][0] if words else scanned
+            text = text[offset:]
+            words = [(s - offset, e - offset) for s, e in words]
+            scanned -= offset
+        words.extend(match.span() for match in WORD.finditer(text, scanned))
+        for start in range(0, len(words), step):
+            end = words[min(start + words_per_chunk, len(words)) - 1][1]
+            yield header + text[words[start][0]:end]
+
+
+@typechecked
+class SentenceChunker(BaseChunker):
+    def __init__(
+        self,
+        chunk_size: int = 512,
+        chunk_overlap: int = 0,
+        count_tokens: Optional[Callable[[str], int]] = None
+    ):
+        """
+        Chunker that scans the text once and packs whole sentences into
+        chunks of at most chunk_size tokens, ending a chunk early at a
+        paragraph break once it is three quarters full. Consecutive chunks
+        share whole sentences of at most chunk_overlap tokens. Sentences
+        longer than a chunk are split between words.
+        Chunks are (start, end) character spans of the text, which is only
+        sliced once per chunk, when the chunks are built with their header.
+
+        Args:
+            chunk_size (int): Maximum number of tokens of a chunk.
+            chunk_overlap (int): Maximum number of tokens shared by two
+                consecutive chunks.
+            count_tokens (Optional[Callable[[str], int]]): Exact token
+                counter of the embedding model, see load_token_counter.
+                Tokens are approximated from the number of words if None.
+        """
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.count_tokens = count_tokens
+        # same approximation as ApproximateChunkerWithOverlap
+        self.word_to_token_conversion_rate = 0.75
+
+    def _sentences(self, text: str) -> List[Tuple[int, int, int, bool]]:
+        """
+        (start, end, tokens, ends_paragraph) of the sentences of the text
+        """
+        spans: List[Tuple[int, int, bool]] = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(text):
+            boundary = match.group()
+            end = match.start() + len(boundary.rstrip())
+            if end > start:
+                spans.append((start, end, boundary.count("\n") >= 2))
+            start = match.end()
+        end = len(text.rstrip())
+        if end > start:
+            spans.append((start, end, True))
+        if self.count_tokens is not None:
+            count_tokens = self.count_tokens
+            return [
+                (start, end, count_tokens(text[start:end]), ends_paragraph)
+                for start, end, ends_paragraph in spans
+            ]
+        rate = self.word_to_token_conversion_rate
+        return [
+            (start, end, round(len(text[start:end].split()) / rate),
+             ends_paragraph)
+            for start, end, ends_paragraph in spans
+        ]
+
+    def _split_sentence(
+        self,
+        text: str,
+        start: int,
+        end: int
+    ) -> List[Tuple[int, int]]:
+        if self.count_tokens is not None:
+            return self._split_sentence_by_tokens(text, start, end)
+        words_per_chunk = max(1, round(
+            self.chunk_size * self.word_to_token_conversion_rate))
+        words_overlap = round(
+            self.chunk_overlap * self.word_to_token_conversion_rate)
+        step = max(1, words_per_chunk - words_overlap)
+        words = [match.span() for match in WORD.finditer(text, start, end)]
+        return [
+            (words[i][0], words[min(i + words_per_chunk, len(words)) - 1][1])
+            for i in range(0, len(words), step)
+            if i == 0 or i + words_overlap < len(words)
+        ]
+
+    def _split_sentence_by_tokens(
+        self,
+        text: str,
+        start: int,
+        end: int
+    ) -> List[Tuple[int, int]]:
+        """
+        Pack the words of a long sentence into chunks of at most chunk_size
+        tokens counted by count_tokens, sharing at most chunk_overlap tokens
+        """
+        assert self.count_tokens is not None
+        words = [match.span() for match in WORD.finditer(text, start, end)]
+        tokens = [self.count_tokens(text[s:e]) for s, e in words]
+        spans: List[Tuple[int, int]] = []
+        first = 0
+        while first < len(words):
+            last = first
+            total = 0
+            while last < len(words) and (
+                last == first or total + tokens[last] <= self.chunk_size
+            ):
+                total += tokens[last]
+                last += 1
+            spans.append((words[first][0], words[last - 1][1]))
+            if last == len(words):
+                break
+            overlap = 0
+            next_first = last
+            while next_first - 1 > first and \
+                    overlap + tokens[next_first - 1] <= self.chunk_overlap:
+                overlap += tokens[next_first - 1]
+                next_first -= 1
+            first = next_first
+        return spans
+
+    @typechecked
+    def chunk_spans(self, text: str) -> List[Tuple[int, int]]:
+        """
+        (start, end) character spans of the chunks of the text
+        """
+        sentences = self._sentences(text)
+        spans: List[Tuple[int, int]] = []
+        first = 0
+        while first < len(sentences):
+            last = first
+            tokens = 0
+            while last < len(sentences) and (
+                last == first
+                or tokens + sentences[last][2] <= self.chunk_size
+            ):
+                tokens += sentences[last][2]
+                last += 1
+                if sentences[last - 1][3] \
+                        and 4 * tokens >= 3 * self.chunk_size:
+                    break
+            if last == first + 1 and tokens > self.chunk_size:
+                spans.extend(self._split_sentence(
+                    text, sentences[first][0], sentences[first][1]))
+                first = last
+                continue
+            spans.append((sentences[first][0], sentences[last - 1][1]))
+            if last == len(sentences):
+                break
+            # the next chunk starts with the last sentences of this one,
+            # unless it is a sentence split between words
+            overlap = 0
+            next_first = last
+            while next_first - 1 > first and \
+                    sentences[last][2] <= self.chunk_size and \
+                    overlap + sentences[next_first - 1][2] \
+                    <= self.chunk_overlap:
+                overlap += sentences[next_first - 1][2]
+                next_first -= 1
+            first = next_first
+        return spans
+
+    @typechecked
+    async def chunk_text(self, text: str, metadata: Metadata) -> List[str]:
+        return chunks_from_spans(text, metadata, self.chunk_spans(text))
@@ -0,0 +1,95 @@
+# resolution of the chunks of vectors stored as spans of their document
+from typing import Any, Dict, List, Mapping, Tuple
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from typeguard import typechecked
+from src.caches.cache import LRUCache
+from src.chunkers.chunker import chunk_header
+from src.models import Metadata
+
+
+# "embedded" vectors store the text of their chunk and the metadata of
+# their document, "normalized" vectors only the span of their chunk in
+# the text of their document
+VECTOR_LAYOUTS = ("embedded", "normalized")
+
+
+@typechecked
+def is_normalized_vector(doc: Mapping[str, Any]) -> bool:
+    return "text" not in doc
+
+
+@typechecked
+class ChunkResolver:
+    def __init__(
+        self,
+        doc_collection: AsyncIOMotorCollection,
+        cache_size: int = 64
+    ):
+        """
+        Resolves the text and metadata of normalized vectors from their
+        parent documents, which are fetched with a single $in query per
+        call and kept in a small LRU cache, since the hits of a query
+        often come from the same few documents.
+
+        Args:
+            doc_collection (AsyncIOMotorCollection): Collection of the
+                documents.
+            cache_size (int): Number of parent documents kept in memory.
+        """
+        self.doc_collection = doc_collection
+        # parent_id -> (chunk header, text, metadata)
+        self.cache = LRUCache(max_size=cache_size)
+
+    async def resolve(
+        self,
+        docs: List[Mapping[str, Any]]
+    ) -> List[Mapping[str, Any]]:
+        """
+        Add the text and metadata of the normalized documents of the
+        vector collection, in the same order. Embedded documents are
+        returned as they are, and normalized ones whose parent document
+        was deleted are skipped.
+        """
+        parents: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+        missing: List[ObjectId] = []
+        for doc in docs:
+            parent_id = doc["parent_id"]
+            if not is_normalized_vector(doc) or parent_id in parents:
+                continue
+            parent = self.cache.get(parent_id)
+            if parent is not None:
+                parents[parent_id] = parent
+            elif ObjectId.is_valid(parent_id):
+                missing.append(ObjectId(parent_id))
+        if missing:
+            cursor = self.doc_collection.find(
+                {"_id": {"$in": missing}}, {"text": 1, "metadata": 1})
+            async for parent_doc in cursor:
+                parent = (
+                    chunk_header(Metadata(**parent_doc["metadata"])),
+                    parent_doc["text"],
+                    parent_doc["metadata"]
+                )
+                parents[str(parent_doc["_id"])] = parent
+                self.cache.set(str(parent_doc["_id"]), parent)
+
+        resolved: List[Mapping[str, Any]] = []
+        for doc in docs:
+            if not is_normalized_vector(doc):
+                resolved.append(doc)
+                continue
+            if doc["parent_id"] not in parents:
+                continue
+            header, text, metadata = parents[doc["parent_id"]]
+            start, end = doc["span"]
+            resolved.append({
+                **doc, "text": header + text[start:end], "metadata": metadata
+            })
+        return resolved
+
+    def evict(self, parent_id: str) -> None:
+        self.cache.delete(parent_id)
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
@@ -1,13 +1,35 @@
 # abstract class for database handler
 from abc import ABC, abstractmethod
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 import motor.motor_asyncio
+from motor.motor_asyncio import AsyncIOMotorClientSession
 from typeguard import typechecked  # type: ignore
+from pymongo import IndexModel, UpdateOne
 from pymongo.results import InsertOneResult
 from src.models import Document, Vector
+from src.database_handlers.chunk_resolver import (
+    VECTOR_LAYOUTS, ChunkResolver
+)
+from src.database_handlers.embedding_codec import (
+    EMBEDDING_FORMATS, encode_embedding, vector_from_document
+)
+from src.vector_indexes.vector_index import BaseIndex
 from bson import ObjectId
 
 
+# number of the latest changes of the documents whose ids are recorded,
+# and maximum number of ids of a change, beyond which it is recorded as a
+# change of all the documents
+RECORDED_CHANGES = 100
+MAX_CHANGED_IDS = 1000
+
+
 class BaseDatabaseHandler(ABC):
+    # storage layout of the vectors, see VECTOR_LAYOUTS. The indexers set
+    # the span of the vectors they upload to a "normalized" handler.
+    vector_layout: str = "embedded"
+
     @abstractmethod
     async def upload_document(
         self,
@@ -29,6 +51,27 @@ class BaseDatabaseHandler(ABC):
     ) -> ObjectId:
         pass
 
+    async def delete_documents(
+        self,
+        document_ids: List[ObjectId]
+    ) -> int:
+        """
+        Delete many documents and their vectors. Handlers without a bulk
+        delete path delete them one by one. Returns the number of
+        documents given.
+        """
+        for document_id in document_ids:
+            await self.delete_document(document_id)
+        return len(document_ids)
+
+    @abstractmethod
+    async def delete_all_documents(self) -> int:
+        """
+        Delete all the documents and vectors of the database.
+        Returns the number of deleted documents.
+        """
+        pass
+
     @abstractmethod
     async def delete_vector(
         self,
@@ -36,6 +79,100 @@ class BaseDatabaseHandler(ABC):
     ) -> None:
         pass
 
+    async def upload_vectors(
+        self,
+        vectors: List[Vector]
+    ) -> None:
+        """
+        Upload many vectors. Handlers without a bulk write path upload
+        them one by one.
+        """
+        for vector in vectors:
+            await self.upload_vector(vector)
+
+    async def upload_document_with_vectors(
+        self,
+        document: Document,
+        vectors: List[Vector],
+        document_id: Optional[ObjectId] = None
+    ) -> ObjectId:
+        """
+        Upload a document together with the vectors of its chunks, whose
+        parent_id must be the id of the document. Handlers that cannot
+        write both atomically upload the document first.
+        """
+        inserted_id = await self.upload_document(document)
+        await self.upload_vectors(vectors)
+        return inserted_id
+
+    async def flush(self) -> None:
+        """
+        Persist state derived from the database, such as in-process
+        indexes. Handlers without derived state do nothing.
+        """
+        return None
+
+    async def find_document_by_file_hash(
+        self,
+        file_hash: str
+    ) -> Optional[ObjectId]:
+        """
+        Return the id of a document uploaded from a file with this sha256,
+        if any. Handlers that do not store file hashes find nothing.
+        """
+        return None
+
+    @abstractmethod
+    async def find_parent_ids(self, vector_ids: List[str]) -> List[str]:
+        """
+        Return the ids of the documents of the vectors, such as the
+        documents cited by an answer
+        """
+        pass
+
+    async def get_changes(self) -> Tuple[int, List[Optional[List[str]]]]:
+        """
+        Return the number of deletes and re-indexings of documents, which
+        make the answers citing them stale, with the ids of the documents
+        of the latest ones, oldest first. A change of all the documents
+        has None instead of ids. Handlers that do not record their changes
+        return no change.
+        """
+        return 0, []
+
+    @abstractmethod
+    def iter_documents(
+        self,
+        document_ids: Optional[List[ObjectId]] = None
+    ) -> AsyncIterator[Tuple[ObjectId, Document]]:
+        """
+        Iterate over the stored documents, or the given ones, to re-index
+        them
+        """
+        pass
+
+    @abstractmethod
+    async def get_document_vectors(
+        self,
+        document_id: ObjectId
+    ) -> List[Vector]:
+        """
+        Return the vectors of a document, with their embeddings
+        """
+        pass
+
+    @abstractmethod
+    async def replace_document_vectors(
+        self,
+        document_id: ObjectId,
+        added: List[Vector],
+        removed_vector_ids: List[str]
+    ) -> None:
+        """
+        Add and remove vectors of a document in a single step
+        """
+        pass
+
 
 @typechecked
 class MongoDBHandler(BaseDatabaseHandler):
@@ -45,8 +182,42 @@ class MongoDBHandler(BaseDatabaseHandler):
         client: motor.motor_asyncio.AsyncIOMotorClient,
         db_name: str,
         doc_collection_name: str,
-        vector_collection_name: str
+        vector_collection_name: str,
+        indexes: Optional[List[BaseIndex]] = None,
+        embedding_format: str = "array",
+        vector_batch_size: int = 500,
+        delete_batch_size: int = 500,
+        use_transactions: Optional[bool] = None,
+        vector_layout: str = "embedded",
+        chunk_resolver: Optional[ChunkResolver] = None,
+        change_collection_name: str = "changes"
     ):
+        """
+        Args:
+            client: MongoDB client.
+            db_name (str): Database of the tenant.
+            doc_collection_name (str): Collection of the documents.
+            vector_collection_name (str): Collection of the vectors.
+            indexes (Optional[List[BaseIndex]]): In-process indexes kept
+                in sync with the vector collection.
+            embedding_format (str): Storage format of the embeddings,
+                "array" or "binary".
+            vector_batch_size (int): Number of vectors per insert_many.
+            delete_batch_size (int): Number of documents per delete_many
+                of the bulk deletes.
+            use_transactions (Optional[bool]): Whether a document and its
+                vectors are written in a transaction. Detected from the
+                deployment if None, since standalone servers do not
+                support transactions.
+            vector_layout (str): Storage layout of the vectors written,
+                "embedded" or "normalized". Vectors of both layouts can
+                be read.
+            chunk_resolver (Optional[ChunkResolver]): Resolver of the
+                chunks of normalized vectors, shared to cache the parent
+                documents across requests.
+            change_collection_name (str): Collection of the record of
+                the changes of the documents, see get_changes.
+        """
         self.client: motor.motor_asyncio.AsyncIOMotorClient = client
         self.db: motor.motor_asyncio.AsyncIOMotorDatabase = \
             self.client[db_name]
@@ -54,6 +225,22 @@ class MongoDBHandler(BaseDatabaseHandler):
             self.db[doc_collection_name]
         self.vector_collection: motor.motor_asyncio.AsyncIOMotorCollection = \
             self.db[vector_collection_name]
+        self.change_collection: motor.motor_asyncio.AsyncIOMotorCollection = \
+            self.db[change_collection_name]
+        # in-process indexes kept in sync with the vector collection
+        self.indexes: List[BaseIndex] = indexes or []
+        if embedding_format not in EMBEDDING_FORMATS:
+            raise ValueError(
+                f"Unknown embedding format: {embedding_format}")
+        self.embedding_format = embedding_format
+        self.vector_batch_size = vector_batch_size
+        self.delete_batch_size = delete_batch_size
+        self.use_transactions = use_transactions
+        if vector_layout not in VECTOR_LAYOUTS:
+            raise ValueError(f"Unknown vector layout: {vector_layout}")
+        self.vector_layout = vector_layout
+        self.chunk_resolver = chunk_resolver or ChunkResolver(
+            self.doc_collection)
 
     @typechecked
     async def upload_document(
@@ -77,10 +264,108 @@ class MongoDBHandler(BaseDatabaseHandler):
         Upload a vector embedding to the database
         """
         created_vector: InsertOneResult = await self.vector_collection.insert_one( # noqa E501
-            vector.model_dump())
+            self._vector_document(vector))
         inserted_id: ObjectId = created_vector.inserted_id
+        for index in self.indexes:
+            index.add([vector])
         return inserted_id
 
+    @typechecked
+    async def upload_vectors(
+        self,
+        vectors: List[Vector]
+    ) -> None:
+        """
+        Upload vectors with unordered insert_many calls of
+        vector_batch_size vectors
+        """
+        await self._insert_vectors(vectors)
+        for index in self.indexes:
+            index.add(vectors)
+
+    @typechecked
+    async def upload_document_with_vectors(
+        self,
+        document: Document,
+        vectors: List[Vector],
+        document_id: Optional[ObjectId] = None
+    ) -> ObjectId:
+        """
+        Upload a document and its vectors in a single transaction when the
+        deployment supports them. Otherwise, the document and the vectors
+        already written are deleted if a write fails, so that a failed
+        upload does not leave orphaned vectors.
+        The in-process indexes are only updated once everything is written.
+        """
+        document_id = document_id or ObjectId()
+        document_dict = {"_id": document_id, **document.model_dump()}
+
+        if await self._supports_transactions():
+            async def write(session: AsyncIOMotorClientSession) -> None:
+                await self.doc_collection.insert_one(
+                    document_dict, session=session)
+                await self._insert_vectors(vectors, session=session)
+
+            async with await self.client.start_session() as session:
+                await session.with_transaction(write)
+        else:
+            await self.doc_collection.insert_one(document_dict)
+            try:
+                await self._insert_vectors(vectors)
+            except BaseException:
+                await self.vector_collection.delete_many(
+                    {"parent_id": str(document_id)})
+                await self.doc_collection.delete_one({"_id": document_id})
+                raise
+
+        for index in self.indexes:
+            index.add(vectors)
+        return document_id
+
+    def _vector_document(self, vector: Vector) -> Dict[str, Any]:
+        if vector.vector_embedding is None:
+            raise ValueError("Vector has no embedding to upload")
+        if self.vector_layout == "normalized":
+            if vector.span is None:
+                raise ValueError("Normalized vectors need a span")
+            vector_document: Dict[str, Any] = {
+                "vector_id": vector.vector_id,
+                "parent_id": vector.parent_id,
+                "span": list(vector.span),
+                "vector_embedding": vector.vector_embedding,
+            }
+        else:
+            vector_document = vector.model_dump(exclude={"score", "span"})
+        if self.embedding_format == "binary":
+            vector_document["vector_embedding"] = encode_embedding(
+                vector.vector_embedding)
+        return vector_document
+
+    async def _insert_vectors(
+        self,
+        vectors: List[Vector],
+        session: Optional[AsyncIOMotorClientSession] = None
+    ) -> None:
+        for start in range(0, len(vectors), self.vector_batch_size):
+            await self.vector_collection.insert_many(
+                [
+                    self._vector_document(vector) for vector
+                    in vectors[start:start + self.vector_batch_size]
+                ],
+                ordered=False,
+                session=session
+            )
+
+    async def _supports_transactions(self) -> bool:
+        """
+        Transactions need a replica set or a sharded cluster
+        """
+        if self.use_transactions is None:
+            hello = await self.client.admin.command("hello")
+            self.use_transactions = \
+                "setName" in hello or hello.get("msg") == "isdbgrid"
+        return self.use_transactions
+
     @typechecked
     async def delete_document(
         self,
@@ -93,6 +378,66 @@ class MongoDBHandler(BaseDatabaseHandler):
         # delete all vectors associated with the document
         await self.vector_collection.delete_many(
             {"parent_id": str(document_id)})
+        for index in self.indexes:
+            index.remove_document(str(document_id))
+        self.chunk_resolver.evict(str(document_id))
+        await self._record_change([str(document_id)])
+        await self.flush()
+
+    @typechecked
+    async def delete_documents(
+        self,
+        document_ids: List[ObjectId]
+    ) -> int:
+        """
+        Delete documents and their vectors with one delete_many per
+        collection for each batch of delete_batch_size documents, using
+        the index on parent_id. The in-process indexes only mask the
+        removed vectors, and are saved once at the end.
+        Returns the number of deleted documents.
+        """
+        deleted = 0
+        for start in range(0, len(document_ids), self.delete_batch_size):
+            deleted += await self._delete_batch(
+                document_ids[start:start + self.delete_batch_size])
+        if document_ids:
+            await self._record_change(
+                [str(document_id) for document_id in document_ids])
+        await self.flush()
+        return deleted
+
+    async def _delete_batch(self, document_ids: List[ObjectId]) -> int:
+        parent_ids = [str(document_id) for document_id in document_ids]
+        result = await self.doc_collection.delete_many(
+            {"_id": {"$in": document_ids}})
+        await self.vector_collection.delete_many(
+            {"parent_id": {"$in": parent_ids}})
+        for index in self.indexes:
+            index.remove_documents(parent_ids)
+        for parent_id in parent_ids:
+            self.chunk_resolver.evict(parent_id)
+        deleted: int = result.deleted_count
+        return deleted
+
+    @typechecked
+    async def delete_all_documents(self) -> int:
+        """
+        Delete the documents in batches, then the vectors left by failed
+        uploads, and empty the in-process indexes
+        """
+        deleted = 0
+        while document_ids := [
+            doc["_id"] async for doc in self.doc_collection.find(
+                {}, {"_id": 1}).limit(self.delete_batch_size)
+        ]:
+            deleted += await self._delete_batch(document_ids)
+        await self.vector_collection.delete_many({})
+        for index in self.indexes:
+            index.clear()
+        self.chunk_resolver.cache.clear()
+        await self._record_change(None)
+        await self.flush()
+        return deleted
 
     @typechecked
     async def delete_vector(
@@ -104,6 +449,172 @@ class MongoDBHandler(BaseDatabaseHandler):
         """
         await self.vector_collection.delete_one({"_id": document_id})
 
+    @typechecked
+    async def migrate_embeddings_to_binary(self, batch_size: int = 500) -> int:
+        """
+        Convert the embeddings stored as BSON arrays to normalized float32
+        binary. Returns the number of migrated vectors.
+        """
+        migrated = 0
+        updates: List[UpdateOne] = []
+        cursor = self.vector_collection.find(
+            {"vector_embedding": {"$type": "array"}},
+            {"vector_embedding": 1}
+        )
+        async for doc in cursor:
+            updates.append(UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {
+                    "vector_embedding": encode_embedding(
+                        doc["vector_embedding"])
+                }}
+            ))
+            if len(updates) >= batch_size:
+                await self.vector_collection.bulk_write(
+                    updates, ordered=False)
+                migrated += len(updates)
+                updates = []
+        if updates:
+            await self.vector_collection.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+        return migrated
+
+    @typechecked
+    async def flush(self) -> None:
+        """
+        Persist the in-process indexes
+        """
+        for index in self.indexes:
+            await asyncio.to_thread(index.save)
+
+    @typechecked
+    async def find_document_by_file_hash(
+        self,
+        file_hash: str
+    ) -> Optional[ObjectId]:
+        doc = await self.doc_collection.find_one(
+            {"file_hash": file_hash}, {"_id": 1})
+        return doc["_id"] if doc is not None else None
+
+    @typechecked
+    async def find_parent_ids(self, vector_ids: List[str]) -> List[str]:
+        return await self.vector_collection.distinct(
+            "parent_id", {"vector_id": {"$in": vector_ids}})
+
+    async def iter_documents(
+        self,
+        document_ids: Optional[List[ObjectId]] = None
+    ) -> AsyncIterator[Tuple[ObjectId, Document]]:
+        query: Dict[str, Any] = {}
+        if document_ids is not None:
+            query = {"_id": {"$in": document_ids}}
+        async for doc in self.doc_collection.find(query):
+            document_id = doc.pop("_id")
+            yield document_id, Document(**doc)
+
+    @typechecked
+    async def get_document_vectors(
+        self,
+        document_id: ObjectId
+    ) -> List[Vector]:
+        docs = [
+            doc async for doc in self.vector_collection.find(
+                {"parent_id": str(document_id)}, {"_id": 0})
+        ]
+        return [
+            vector_from_document(doc)
+            for doc in await self.chunk_resolver.resolve(docs)
+        ]
+
+    @typechecked
+    async def replace_document_vectors(
+        self,
+        document_id: ObjectId,
+        added: List[Vector],
+        removed_vector_ids: List[str]
+    ) -> None:
+        """
+        Insert the added vectors and delete the removed ones in a single
+        transaction when the deployment supports them. Otherwise the added
+        vectors are inserted before the removed ones are deleted, so that
+        the document stays searchable, and are deleted again if the
+        insertion fails.
+        The in-process indexes are then rebuilt for this document.
+        """
+        removed = {"vector_id": {"$in": removed_vector_ids}}
+        if await self._supports_transactions():
+            async def write(session: AsyncIOMotorClientSession) -> None:
+                await self._insert_vectors(added, session=session)
+                await self.vector_collection.delete_many(
+                    removed, session=session)
+
+            async with await self.client.start_session() as session:
+                await session.with_transaction(write)
+        else:
+            try:
+                await self._insert_vectors(added)
+            except BaseException:
+                await self.vector_collection.delete_many({"vector_id": {
+                    "$in": [vector.vector_id for vector in added]}})
+                raise
+            await self.vector_collection.delete_many(removed)
+        await self._record_change([str(document_id)])
+
+        if self.indexes:
+            vectors = await self.get_document_vectors(document_id)
+            for index in self.indexes:
+                index.remove_document(str(document_id))
+                index.add(vectors)
+
+    async def _record_change(self, parent_ids: Optional[List[str]]) -> None:
+        """
+        Count a change of the documents, or of all of them if parent_ids
+        is None, and record it among the latest ones in a single update,
+        so that the count and the record stay consistent
+        """
+        if parent_ids is not None and len(parent_ids) > MAX_CHANGED_IDS:
+            parent_ids = None
+        await self.change_collection.update_one(
+            {"_id": "documents"},
+            {
+                "$inc": {"count": 1},
+                "$push": {"latest": {
+                    "$each": [parent_ids],
+                    "$slice": -RECORDED_CHANGES
+                }}
+            },
+            upsert=True
+        )
+
+    @typechecked
+    async def get_changes(self) -> Tuple[int, List[Optional[List[str]]]]:
+        changes = await self.change_collection.find_one({"_id": "documents"})
+        if changes is None:
+            return 0, []
+        return changes["count"], changes["latest"]
+
+    @typechecked
+    async def ensure_indexes(self) -> None:
+        """
+        Create the secondary indexes used to filter the vectors before
+        scoring them, on the metadata of the vectors or, for normalized
+        vectors, of their documents, and the index of the documents by file
+        hash used to detect identical uploads
+        """
+        await self.vector_collection.create_indexes([
+            IndexModel("parent_id"),
+            IndexModel("vector_id"),
+            IndexModel("metadata.author"),
+            IndexModel("metadata.keywords"),
+            IndexModel("metadata.created_at"),
+        ])
+        await self.doc_collection.create_indexes([
+            IndexModel("file_hash"),
+            IndexModel("metadata.author"),
+            IndexModel("metadata.keywords"),
+            IndexModel("metadata.created_at"),
+        ])
+
     @typechecked
     async def get_number_of_documents(self) -> int:
         """
@@ -0,0 +1,64 @@
+# encoding of vector embeddings stored in MongoDB
+from typing import Any, List, Mapping, Optional, Union
+import numpy as np
+from bson import Binary
+from typeguard import typechecked
+from src.models import Vector
+
+
+# embeddings are stored either as a BSON array of doubles ("array") or as
+# packed little-endian float32 L2-normalized bytes ("binary")
+EMBEDDING_FORMATS = ("array", "binary")
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+@typechecked
+def encode_embedding(embedding: List[float]) -> Binary:
+    """
+    Pack an embedding as L2-normalized little-endian float32 bytes,
+    so that cosine similarity becomes a dot product on read
+    """
+    array = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+    norm = np.linalg.norm(array)
+    if norm > 0:
+        array = array / norm
+    return Binary(array.astype(EMBEDDING_DTYPE).tobytes())
+
+
+@typechecked
+def decode_embedding(value: Union[bytes, List[float]]) -> np.ndarray:
+    """
+    Decode a stored embedding. Binary embeddings are decoded without
+    copying with numpy.frombuffer and are read-only.
+    """
+    if isinstance(value, bytes):
+        return np.frombuffer(value, dtype=EMBEDDING_DTYPE)
+    return np.asarray(value, dtype=np.float32)
+
+
+@typechecked
+def is_binary_embedding(value: Any) -> bool:
+    return isinstance(value, bytes)
+
+
+@typechecked
+def vector_from_document(
+    doc: Mapping[str, Any],
+    score: Optional[float] = None
+) -> Vector:
+    """
+    Build a Vector from a document of the vector collection,
+    decoding its embedding whatever the storage format.
+    The embedding is left empty if it was not fetched.
+    """
+    embedding = doc.get("vector_embedding")
+    return Vector(
+        vector_embedding=decode_embedding(embedding).tolist()
+        if embedding is not None else None,
+        vector_id=doc["vector_id"],
+        text=doc["text"],
+        metadata=doc["metadata"],
+        parent_id=doc["parent_id"],
+        span=doc.get("span"),
+        score=score
+    )
@@ -0,0 +1,42 @@
+# migrate the embeddings of existing vector collections to binary storage
+# usage: python -m src.database_handlers.migrate_embeddings tenant1 tenant2
+import argparse
+import asyncio
+import logging
+import os
+from typing import List
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from src.database_handlers.database_handler import MongoDBHandler
+
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def migrate(db_names: List[str], batch_size: int) -> None:
+    client: AsyncIOMotorClient = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+    try:
+        for db_name in db_names:
+            handler = MongoDBHandler(
+                client,
+                db_name=db_name,
+                vector_collection_name="vectors",
+                doc_collection_name="documents",
+                embedding_format="binary"
+            )
+            migrated = await handler.migrate_embeddings_to_binary(
+                batch_size=batch_size)
+            logging.info("Migrated %d vectors of %s", migrated, db_name)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Store vector embeddings as normalized float32 binary")
+    parser.add_argument("db_names", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.db_names, args.batch_size))
@@ -0,0 +1,182 @@
+# batching wrapper around a dense embedder
+import asyncio
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Union
+from typeguard import typechecked
+from src.embedders.dense_embedder import BaseDenseEmbedder
+from src.utils.retry import retry_async
+
+
+logger = logging.getLogger(__name__)
+
+# same approximation of the number of tokens as the chunkers
+WORD_TO_TOKEN_CONVERSION_RATE = 0.75
+
+
+@typechecked
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the number of tokens of a text from its number of words,
+    to avoid running the tokenizer of the provider
+    """
+    return math.ceil(len(text.split()) / WORD_TO_TOKEN_CONVERSION_RATE)
+
+
+@typechecked
+def split_batches(
+    texts: List[str],
+    max_batch_size: int,
+    max_batch_tokens: Optional[int] = None
+) -> List[List[str]]:
+    """
+    Split texts into consecutive batches of at most max_batch_size texts
+    and, unless a single text exceeds it, max_batch_tokens estimated tokens
+    """
+    batches: List[List[str]] = []
+    batch: List[str] = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if batch and (
+            len(batch) >= max_batch_size
+            or (max_batch_tokens is not None
+                and batch_tokens + tokens > max_batch_tokens)
+        ):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+@typechecked
+class BatchingDenseEmbedder(BaseDenseEmbedder):
+    def __init__(
+        self,
+        embedder: BaseDenseEmbedder,
+        max_batch_size: int = 96,
+        max_batch_tokens: Optional[int] = None,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        base_delay: float = 0.5
+    ):
+        """
+        Splits the texts of embed_batch into sub-batches within the limits
+        of the provider, embeds them concurrently, retries each of them on
+        transient errors and returns the embeddings in the order of the
+        texts.
+
+        Args:
+            embedder (BaseDenseEmbedder): Embedder of the sub-batches.
+            max_batch_size (int): Maximum number of texts per call, lowered
+                to the limit of the embedder if it has one.
+            max_batch_tokens (Optional[int]): Maximum number of estimated
+                tokens per call.
+            max_concurrency (int): Maximum number of sub-batches of a
+                call to embed_batch embedded at the same time.
+            max_retries (int): Maximum number of retries of a sub-batch.
+            base_delay (float): Upper bound of the first retry delay in
+                seconds.
+        """
+        self.embedder = embedder
+        self.model = embedder.model
+        if embedder.max_batch_size is not None:
+            max_batch_size = min(max_batch_size, embedder.max_batch_size)
+        self.max_batch_size: int = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.batches = 0
+        self.texts = 0
+        self.tokens = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency_seconds = 0.0
+        self.max_latency_seconds = 0.0
+
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        return await retry_async(
+            lambda: self.embedder.embed_text(text, input_type),
+            max_retries=self.max_retries,
+            base_delay=self.base_delay
+        )
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._embed_with_retries(batch)
+
+        batches = split_batches(
+            texts, self.max_batch_size, self.max_batch_tokens)
+        results = await asyncio.gather(*(embed(batch) for batch in batches))
+        return [embedding for result in results for embedding in result]
+
+    async def _embed_with_retries(
+        self,
+        batch: List[str]
+    ) -> List[List[float]]:
+        attempts = 0
+
+        async def call() -> List[List[float]]:
+            nonlocal attempts
+            attempts += 1
+            return await self.embedder.embed_batch(batch)
+
+        tokens = sum(estimate_tokens(text) for text in batch)
+        start = time.perf_counter()
+        try:
+            embeddings = await retry_async(
+                call, max_retries=self.max_retries, base_delay=self.base_delay)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.retries += attempts - 1
+        latency = time.perf_counter() - start
+        if len(embeddings) != len(batch):
+            raise ValueError(
+                f"Got {len(embeddings)} embeddings for {len(batch)} texts")
+
+        self.batches += 1
+        self.texts += len(batch)
+        self.tokens += tokens
+        self.latency_seconds += latency
+        self.max_latency_seconds = max(self.max_latency_seconds, latency)
+        logger.info(
+            "Embedded %d texts (~%d tokens) in %.0f ms, %.0f texts/s",
+            len(batch), tokens, 1000 * latency,
+            len(batch) / latency if latency > 0 else 0.0
+        )
+        return embeddings
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Counters of the sub-batches sent to the provider. The throughput is
+        measured over the time spent in calls, excluding the time spent
+        waiting for a free slot.
+        """
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "tokens": self.tokens,
+            "retries": self.retries,
+            "failures": self.failures,
+            "mean_batch_latency_ms":
+                1000 * self.latency_seconds / self.batches
+                if self.batches else 0.0,
+            "max_batch_latency_ms": 1000 * self.max_latency_seconds,
+            "texts_per_second":
+                self.texts / self.latency_seconds
+                if self.latency_seconds else 0.0,
+        }
@@ -0,0 +1,177 @@
+# caching wrapper around a dense embedder
+import asyncio
+import hashlib
+import json
+import re
+import unicodedata
+from typing import Dict, List, Optional
+from typeguard import typechecked
+from src.caches.cache import BaseCacheBackend, LRUCache
+from src.embedders.dense_embedder import BaseDenseEmbedder
+
+
+WHITESPACE = re.compile(r"\s+")
+
+
+@typechecked
+def normalize_text(text: str) -> str:
+    """
+    Normalize unicode and whitespace, so that trivially different
+    spellings of a query share a cache entry
+    """
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+@typechecked
+class CachedDenseEmbedder(BaseDenseEmbedder):
+    def __init__(
+        self,
+        embedder: BaseDenseEmbedder,
+        max_size: int = 4096,
+        ttl_seconds: Optional[float] = 3600,
+        backend: Optional[BaseCacheBackend] = None
+    ):
+        """
+        Caches the embeddings of single texts, keyed by the model, the input
+        type and the normalized text. Entries are looked up in an in-process
+        LRU cache, then in the optional shared backend, and only then
+        embedded. Concurrent requests for the same text share one call.
+
+        Args:
+            embedder (BaseDenseEmbedder): Embedder whose results are cached.
+            max_size (int): Maximum number of entries in process.
+            ttl_seconds (Optional[float]): Time to live of the entries
+                in process.
+            backend (Optional[BaseCacheBackend]): Cache shared by replicas.
+        """
+        self.embedder = embedder
+        self.model = embedder.model
+        self.cache = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.backend = backend
+        self.backend_hits = 0
+        self._in_flight: Dict[str, asyncio.Future[List[float]]] = {}
+
+    def cache_key(self, text: str, input_type: str) -> str:
+        return hashlib.sha256(json.dumps(
+            [self.model, input_type, normalize_text(text)]
+        ).encode()).hexdigest()
+
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        key = self.cache_key(text, input_type)
+        embedding: Optional[List[float]] = self.cache.get(key)
+        if embedding is not None:
+            return embedding
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        future: asyncio.Future[List[float]] = \
+            asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            embedding = await self._embed_uncached(key, text, input_type)
+            self.cache.set(key, embedding)
+            future.set_result(embedding)
+            return embedding
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # retrieve the error, so that it is not logged if nobody waits
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def _embed_uncached(
+        self,
+        key: str,
+        text: str,
+        input_type: str
+    ) -> List[float]:
+        if self.backend is not None:
+            embedding = await self.backend.get(key)
+            if embedding is not None:
+                self.backend_hits += 1
+                return list(embedding)
+        embedding = await self.embedder.embed_text(text, input_type)
+        if self.backend is not None:
+            await self.backend.set(key, embedding)
+        return embedding
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Batches of documents are embedded once at indexing time,
+        so they are not cached
+        """
+        return await self.embedder.embed_batch(texts)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.cache.stats(), "backend_hits": self.backend_hits}
+
+
+@typechecked
+class ContentCachedDenseEmbedder(BaseDenseEmbedder):
+    def __init__(
+        self,
+        embedder: BaseDenseEmbedder,
+        backend: BaseCacheBackend
+    ):
+        """
+        Persistent cache of the embeddings of chunks, keyed by the model
+        and the sha256 of the exact chunk text, so that re-uploading
+        unchanged content does not call the provider again. Only the
+        chunks missing from the backend are passed to embed_batch, once
+        each.
+
+        Args:
+            embedder (BaseDenseEmbedder): Embedder of the missing chunks.
+            backend (BaseCacheBackend): Persistent store of the embeddings.
+        """
+        self.embedder = embedder
+        self.model = embedder.model
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # number of distinct chunks sent to the embedder
+        self.embedded = 0
+
+    def cache_key(self, text: str) -> str:
+        return f"{self.model}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        return await self.embedder.embed_text(text, input_type)
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache_key(text) for text in texts]
+        cached = await self.backend.get_many(list(set(keys)))
+        missing: Dict[str, str] = {
+            key: text for key, text in zip(keys, texts) if key not in cached
+        }
+        hits = sum(key in cached for key in keys)
+        self.hits += hits
+        self.misses += len(texts) - hits
+        self.embedded += len(missing)
+        if missing:
+            embeddings = await self.embedder.embed_batch(
+                list(missing.values()))
+            embedded = dict(zip(missing, embeddings))
+            await self.backend.set_many(embedded)
+            cached.update(embedded)
+        return [list(cached[key]) for key in keys]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "embedded": self.embedded
+        }
@@ -1,15 +1,29 @@
 from abc import ABC, abstractmethod
-from typing import List
+import asyncio
+from typing import Any, List, Optional
 import cohere  # type: ignore
+import httpx
 from typeguard import typechecked
 import os
+from src.utils.retry import retry_async
 
 
 @typechecked
 class BaseDenseEmbedder(ABC):
+    model: str
+    # maximum number of texts per call of the provider, if any
+    max_batch_size: Optional[int] = None
+
     @abstractmethod
-    async def embed_text(self, text: str) -> List[float]:
-        """Embed a single text string"""
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        """
+        Embed a single text string. Queries are embedded with
+        input_type="search_query" and chunks with "search_document".
+        """
         pass
 
     @abstractmethod
@@ -20,7 +34,31 @@ class BaseDenseEmbedder(ABC):
 
 @typechecked
 class CohereDenseEmbedder(BaseDenseEmbedder):
-    def __init__(self, api_key: str, model: str = "embed-english-v3.0"):
+    max_batch_size = 96
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "embed-english-v3.0",
+        max_concurrency: int = 8,
+        max_retries: int = 3,
+        timeout: float = 30.0,
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
+        """
+        Embedder using Cohere's async API, so that embedding calls do not
+        block the event loop.
+
+        Args:
+            api_key (str): Cohere API key.
+            model (str): Embedding model.
+            max_concurrency (int): Maximum number of concurrent API calls.
+            max_retries (int): Maximum number of retries of rate limited
+                or failed calls, with jittered exponential backoff.
+            timeout (float): Timeout of an API call in seconds.
+            http_client (Optional[httpx.AsyncClient]): HTTP client whose
+                keep-alive connections are reused across calls and embedders.
+        """
         self.api_key = api_key or os.getenv("COHERE_API_KEY")
         if not self.api_key:
             raise ValueError(
@@ -28,33 +66,49 @@ class CohereDenseEmbedder(BaseDenseEmbedder):
                 "environment variable"
             )
 
-        self.client = cohere.Client(self.api_key)
+        # retries are handled by retry_async, with jitter
+        self.client = cohere.AsyncClient(
+            self.api_key,
+            timeout=timeout,
+            max_retries=0,
+            httpx_client=http_client
+        )
         self.model = model
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _embed(
+        self,
+        texts: List[str],
+        input_type: str
+    ) -> List[List[float]]:
+        async def call() -> Any:
+            async with self.semaphore:
+                return await self.client.embed(
+                    texts=texts,
+                    model=self.model,
+                    input_type=input_type
+                )
+
+        response = await retry_async(call, max_retries=self.max_retries)
+        if isinstance(response.embeddings, list):
+            return response.embeddings
+        else:
+            raise ValueError("Embedding is not a list of lists")
 
-    async def embed_text(self, text: str) -> List[float]:
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
         """
         Embed a single text string using Cohere's API
         """
-        response = self.client.embed(
-            texts=[text],
-            model=self.model,
-            input_type="search_document"
-        )
-        if isinstance(response.embeddings, list):
-            return response.embeddings[0]
-        else:
-            raise ValueError("Embedding is not a list")
+        embeddings = await self._embed([text], input_type)
+        return embeddings[0]
 
     async def embed_batch(self, texts: List[str]) -> List[List[float]]:
         """
         Embed multiple texts in a single API call
         """
-        response = self.client.embed(
-            texts=texts,
-            model=self.model,
-            input_type="search_document"
-        )
-        if isinstance(response.embeddings, list):
-            return response.embeddings
-        else:
-            raise ValueError("Embedding is not a list of lists")
+        return await self._embed(texts, "search_document")
@@ -1 +1,57 @@
 # sparse embedder using BM25
+from abc import ABC, abstractmethod
+from collections import Counter
+import re
+from typing import Dict, List
+from typeguard import typechecked
+
+
+# words, numbers and codes such as "pol-2024.17" or "acme_x200"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+CODE_SEPARATORS = re.compile(r"[-_./]")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in is it its of on or that
+the their there these this to was were will with what which who how when
+""".split())
+
+
+@typechecked
+class BaseSparseEmbedder(ABC):
+    @abstractmethod
+    def embed_document(self, text: str) -> Dict[str, int]:
+        """Term frequencies of a document"""
+        pass
+
+    @abstractmethod
+    def embed_query(self, text: str) -> List[str]:
+        """Distinct terms of a query"""
+        pass
+
+
+@typechecked
+class BM25SparseEmbedder(BaseSparseEmbedder):
+    """
+    Tokenizer for BM25: lowercased words without stopwords. Codes such as
+    policy numbers are kept whole and also split into their parts, so that
+    "POL-2024" matches both "POL-2024" and "2024".
+    """
+
+    def tokenize(self, text: str) -> List[str]:
+        tokens: List[str] = []
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            if token in STOPWORDS:
+                continue
+            tokens.append(token)
+            if CODE_SEPARATORS.search(token):
+                tokens.extend(
+                    part for part in CODE_SEPARATORS.split(token)
+                    if part and part not in STOPWORDS
+                )
+        return tokens
+
+    def embed_document(self, text: str) -> Dict[str, int]:
+        return dict(Counter(self.tokenize(text)))
+
+    def embed_query(self, text: str) -> List[str]:
+        return list(dict.fromkeys(self.tokenize(text)))
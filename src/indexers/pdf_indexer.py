@@ -1,9 +1,12 @@
-from src.parsers.parser import BaseParser
+from src.parsers.parser import BaseParser, StreamingPDFParser
 from src.embedders.dense_embedder import BaseDenseEmbedder
 from src.database_handlers.database_handler import (
     BaseDatabaseHandler
 )
 from abc import ABC, abstractmethod
+import asyncio
+from collections import deque
+import hashlib
 from starlette.datastructures import UploadFile
 from typeguard import typechecked
 import logging
@@ -12,15 +15,21 @@ from src.models import (
     Document,
     Vector,
 )
-from src.chunkers.chunker import BaseChunker
+from src.chunkers.chunker import BaseChunker, chunks_from_spans
 from bson import ObjectId
-from typing import List
+from typing import (
+    AsyncIterator, Callable, Deque, List, Optional, Tuple
+)
 from io import BytesIO
 import uuid
 
 
 logging.basicConfig(level=logging.INFO)
 
+# called with the current stage of the indexing of a file ("parsing",
+# "chunking", "embedding" or "writing") and its number of chunks so far
+ProgressCallback = Callable[[str, int], None]
+
 
 class BaseIndexer(ABC):
     def __init__(
@@ -37,7 +46,11 @@ class BaseIndexer(ABC):
 
     @abstractmethod
     @typechecked
-    async def index_document(self, file: UploadFile) -> str:
+    async def index_document(
+        self,
+        file: UploadFile,
+        progress: Optional[ProgressCallback] = None
+    ) -> str:
         pass
 
 
@@ -57,38 +70,216 @@ class PDFIndexer(BaseIndexer):
         super().__init__(parser, chunker, embedder, database_handler)
 
     @typechecked
-    async def index_document(self, file: UploadFile) -> str:
+    async def index_document(
+        self,
+        file: UploadFile,
+        progress: Optional[ProgressCallback] = None
+    ) -> str:
+        report: ProgressCallback = progress or (lambda stage, chunks: None)
         logging.info("Parsing PDF")
         filebytes: BytesIO = await self.parser.convert_to_bytes(file)
+        file_hash = hashlib.sha256(filebytes.getbuffer()).hexdigest()
+        existing_id = await self.database_handler.find_document_by_file_hash(
+            file_hash)
+        if existing_id is not None:
+            logging.info("%s was already uploaded as %s",
+                         file.filename, existing_id)
+            return str(existing_id)
 
         logging.info("1. Extracting text from filebtyes object of type:"
                      f"{type(filebytes)}")
-        text: str = await self.parser.extract_text(filebytes)
-        metadata: Metadata = await self.parser.extract_metadata(filebytes)
+        report("parsing", 0)
+        text, metadata = await self.parser.parse(filebytes)
 
         logging.info("2. Chunking text")
-        chunks: List[str] = await self.chunker.chunk_text(text, metadata)
+        report("chunking", 0)
+        # normalized vectors only store the span of their chunk
+        spans: Optional[List[Tuple[int, int]]] = None
+        if self.database_handler.vector_layout == "normalized":
+            spans = self.chunker.chunk_spans(text)
+            chunks = chunks_from_spans(text, metadata, spans)
+        else:
+            chunks = await self.chunker.chunk_text(text, metadata)
         logging.info("3. Embedding chunks: %s", chunks)
+        report("embedding", len(chunks))
         embeddings: List[List[float]] = await self.embedder.embed_batch(
             chunks)
 
-        logging.info("3. Uploading document to database")
+        logging.info("4. Uploading document and vectors to database")
+        report("writing", len(chunks))
         document: Document = Document(
             text=text,
-            metadata=metadata
+            metadata=metadata,
+            file_hash=file_hash
         )
-        parent_document_id: ObjectId = \
-            await self.database_handler.upload_document(document=document)
+        # the id is generated here so that the document and its vectors
+        # are written in the same step
+        parent_document_id: ObjectId = ObjectId()
         parent_document_id_str: str = str(parent_document_id)
-
-        logging.info("4. Uploading vectors to database")
-        for i, embedding in enumerate(embeddings):
-            vector: Vector = Vector(
+        vectors: List[Vector] = [
+            Vector(
                 vector_embedding=embedding,
                 vector_id=str(uuid.uuid4()),
                 text=chunks[i],
                 metadata=metadata,
-                parent_id=parent_document_id_str
+                parent_id=parent_document_id_str,
+                span=spans[i] if spans is not None else None
+            )
+            for i, embedding in enumerate(embeddings)
+        ]
+        await self.database_handler.upload_document_with_vectors(
+            document, vectors, document_id=parent_document_id)
+        await self.database_handler.flush()
+        return parent_document_id_str
+
+
+@typechecked
+class StreamingPDFIndexer(BaseIndexer):
+    def __init__(
+        self,
+        parser: StreamingPDFParser,
+        chunker: BaseChunker,
+        embedder: BaseDenseEmbedder,
+        database_handler: BaseDatabaseHandler,
+        embed_batch_size: int = 96,
+        max_concurrent_batches: int = 2,
+        queue_size: int = 4
+    ) -> None:
+        """
+        Indexer for PDF files that overlaps parsing, chunking, embedding
+        and writing. The pages are read lazily from the spooled upload and
+        the stages are connected by bounded queues, so that memory does not
+        grow with the size of the document.
+        The chunks are streamed without their spans, so the vectors cannot
+        be stored normalized.
+
+        Args:
+            embed_batch_size (int): Number of chunks per embedding call.
+            max_concurrent_batches (int): Maximum number of embedding calls
+                in flight.
+            queue_size (int): Maximum number of batches waiting between
+                two stages.
+        """
+        if database_handler.vector_layout == "normalized":
+            raise ValueError(
+                "Streaming indexing does not support normalized vectors")
+        super().__init__(parser, chunker, embedder, database_handler)
+        self.parser: StreamingPDFParser = parser
+        self.embed_batch_size = embed_batch_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self.queue_size = queue_size
+
+    @typechecked
+    async def index_document(
+        self,
+        file: UploadFile,
+        progress: Optional[ProgressCallback] = None
+    ) -> str:
+        report: ProgressCallback = progress or (lambda stage, chunks: None)
+        written = 0
+        # the vectors are written as they are embedded, before the
+        # document, so a failed upload deletes the vectors already written
+        parent_document_id: ObjectId = ObjectId()
+        parent_document_id_str: str = str(parent_document_id)
+        batches: asyncio.Queue[Optional[List[str]]] = asyncio.Queue(
+            self.queue_size)
+        embedded: asyncio.Queue[
+            Optional[Tuple[List[str], List[List[float]]]]
+        ] = asyncio.Queue(self.queue_size)
+        page_texts: List[str] = []
+
+        async def read_pages(pages: AsyncIterator[str]) -> AsyncIterator[str]:
+            async for page in pages:
+                page_texts.append(page)
+                yield page
+
+        async def chunk_pages(
+            pages: AsyncIterator[str],
+            metadata: Metadata
+        ) -> None:
+            batch: List[str] = []
+            async for chunk in self.chunker.chunk_stream(
+                    read_pages(pages), metadata):
+                batch.append(chunk)
+                if len(batch) == self.embed_batch_size:
+                    await batches.put(batch)
+                    batch = []
+            if batch:
+                await batches.put(batch)
+            await batches.put(None)
+
+        async def embed_batches() -> None:
+            in_flight: Deque[
+                Tuple[List[str], asyncio.Task[List[List[float]]]]
+            ] = deque()
+            try:
+                while (batch := await batches.get()) is not None:
+                    in_flight.append((batch, asyncio.create_task(
+                        self.embedder.embed_batch(batch))))
+                    if len(in_flight) == self.max_concurrent_batches:
+                        chunks, task = in_flight.popleft()
+                        await embedded.put((chunks, await task))
+                while in_flight:
+                    chunks, task = in_flight.popleft()
+                    await embedded.put((chunks, await task))
+                await embedded.put(None)
+            finally:
+                for _, task in in_flight:
+                    task.cancel()
+
+        async def write_vectors(metadata: Metadata) -> None:
+            nonlocal written
+            while (item := await embedded.get()) is not None:
+                chunks, embeddings = item
+                await self.database_handler.upload_vectors([
+                    Vector(
+                        vector_embedding=embedding,
+                        vector_id=str(uuid.uuid4()),
+                        text=chunk,
+                        metadata=metadata,
+                        parent_id=parent_document_id_str
+                    )
+                    for chunk, embedding in zip(chunks, embeddings)
+                ])
+                written += len(chunks)
+                # the stages overlap, so only the writes are reported
+                report("writing", written)
+
+        logging.info("Streaming PDF %s", file.filename)
+        try:
+            async with self.parser.open_pages(file) as (
+                    file_hash, metadata, pages):
+                existing_id = \
+                    await self.database_handler.find_document_by_file_hash(
+                        file_hash)
+                if existing_id is not None:
+                    logging.info("%s was already uploaded as %s",
+                                 file.filename, existing_id)
+                    return str(existing_id)
+                report("parsing", 0)
+                tasks = [
+                    asyncio.create_task(chunk_pages(pages, metadata)),
+                    asyncio.create_task(embed_batches()),
+                    asyncio.create_task(write_vectors(metadata)),
+                ]
+                try:
+                    await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+            await self.database_handler.upload_document_with_vectors(
+                Document(
+                    text="".join(page_texts),
+                    metadata=metadata,
+                    file_hash=file_hash
+                ),
+                [],
+                document_id=parent_document_id
             )
-            _ = await self.database_handler.upload_vector(vector)
+        except BaseException:
+            await self.database_handler.delete_document(parent_document_id)
+            raise
+        await self.database_handler.flush()
         return parent_document_id_str
@@ -0,0 +1,113 @@
+# re-indexing of the stored documents
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+import uuid
+from bson import ObjectId
+from typeguard import typechecked
+from src.chunkers.chunker import BaseChunker, chunks_from_spans
+from src.database_handlers.database_handler import BaseDatabaseHandler
+from src.embedders.dense_embedder import BaseDenseEmbedder
+from src.models import Document, ReindexResponse, Vector
+
+
+logger = logging.getLogger(__name__)
+
+
+@typechecked
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@typechecked
+class Reindexer:
+    def __init__(
+        self,
+        chunker: BaseChunker,
+        embedder: BaseDenseEmbedder,
+        database_handler: BaseDatabaseHandler
+    ):
+        """
+        Re-chunks the stored text of documents, for instance after a change
+        of the chunking strategy. The new chunks are compared with the
+        stored vectors by content hash: only new or changed chunks are
+        embedded, and the vectors of the chunks that disappeared are
+        removed in the same step as the new ones are added.
+        """
+        self.chunker = chunker
+        self.embedder = embedder
+        self.database_handler = database_handler
+
+    async def reindex(
+        self,
+        document_ids: Optional[List[ObjectId]] = None
+    ) -> ReindexResponse:
+        """
+        Re-index the given documents, or all of them
+        """
+        response = ReindexResponse()
+        async for document_id, document in \
+                self.database_handler.iter_documents(document_ids):
+            await self.reindex_document(document_id, document, response)
+        await self.database_handler.flush()
+        return response
+
+    async def reindex_document(
+        self,
+        document_id: ObjectId,
+        document: Document,
+        response: ReindexResponse
+    ) -> None:
+        spans: Optional[List[Tuple[int, int]]] = None
+        if self.database_handler.vector_layout == "normalized":
+            spans = self.chunker.chunk_spans(document.text)
+            chunks = chunks_from_spans(
+                document.text, document.metadata, spans)
+        else:
+            chunks = await self.chunker.chunk_text(
+                document.text, document.metadata)
+        span_of: Dict[str, Tuple[int, int]] = {}
+        if spans is not None:
+            span_of = dict(zip(chunks, spans))
+        # stored vectors by content hash, a chunk can appear several times
+        stored: Dict[str, List[Vector]] = {}
+        for vector in await self.database_handler.get_document_vectors(
+                document_id):
+            stored.setdefault(content_hash(vector.text), []).append(vector)
+
+        new_chunks: List[str] = []
+        for chunk in chunks:
+            vectors = stored.get(content_hash(chunk))
+            if vectors:
+                vectors.pop()
+            else:
+                new_chunks.append(chunk)
+        removed_vector_ids = [
+            vector.vector_id
+            for vectors in stored.values() for vector in vectors
+        ]
+
+        response.documents += 1
+        response.unchanged_chunks += len(chunks) - len(new_chunks)
+        if not new_chunks and not removed_vector_ids:
+            return
+        embeddings = await self.embedder.embed_batch(new_chunks) \
+            if new_chunks else []
+        added = [
+            Vector(
+                vector_embedding=embedding,
+                vector_id=str(uuid.uuid4()),
+                text=chunk,
+                metadata=document.metadata,
+                parent_id=str(document_id),
+                span=span_of.get(chunk)
+            )
+            for chunk, embedding in zip(new_chunks, embeddings)
+        ]
+        await self.database_handler.replace_document_vectors(
+            document_id, added, removed_vector_ids)
+        logger.info("Re-indexed document %s: %d chunks added, %d removed",
+                    document_id, len(added), len(removed_vector_ids))
+        response.changed_documents += 1
+        response.added_chunks += len(added)
+        response.removed_chunks += len(removed_vector_ids)
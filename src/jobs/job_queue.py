@@ -0,0 +1,199 @@
+# background ingestion jobs with fair scheduling across tenants
+import asyncio
+from collections import OrderedDict, deque
+import datetime
+import logging
+from tempfile import SpooledTemporaryFile
+from typing import (
+    Any, Awaitable, BinaryIO, Callable, Deque, Dict, List, Optional,
+    cast
+)
+import uuid
+from starlette.datastructures import UploadFile
+from typeguard import typechecked
+from src.models import JobStatus
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are waiting to be processed"""
+    pass
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+@typechecked
+class Job:
+    def __init__(
+        self,
+        db_name: str,
+        filename: str,
+        file: SpooledTemporaryFile[bytes]
+    ):
+        """
+        Indexing of an uploaded file, whose content is spooled until a
+        worker processes it
+        """
+        now = _now()
+        self.file: Optional[SpooledTemporaryFile[bytes]] = file
+        self.status = JobStatus(
+            job_id=str(uuid.uuid4()),
+            db_name=db_name,
+            filename=filename,
+            stage="queued",
+            created_at=now,
+            updated_at=now
+        )
+
+    def report(self, stage: str, num_chunks: int) -> None:
+        """
+        Progress callback of the indexers
+        """
+        self.status.stage = stage
+        self.status.num_chunks = num_chunks
+        self.status.updated_at = _now()
+
+    def upload_file(self) -> UploadFile:
+        if self.file is None:
+            raise ValueError("The file of the job was already processed")
+        return UploadFile(
+            file=cast(BinaryIO, self.file), filename=self.status.filename)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# indexes the file of a job and returns the id of the document
+JobRunner = Callable[[Job], Awaitable[str]]
+
+
+@typechecked
+class FairJobQueue:
+    def __init__(
+        self,
+        runner: JobRunner,
+        num_workers: int = 4,
+        max_pending: int = 1000,
+        max_finished: int = 10000,
+        spool_max_memory: int = 1024 * 1024
+    ):
+        """
+        Queue of ingestion jobs processed by a fixed number of workers.
+        Each tenant (db_name) has its own queue, and the workers take the
+        next job from the tenants in turn, so that a tenant uploading many
+        files does not delay the uploads of the others.
+
+        Args:
+            runner (JobRunner): Indexes the file of a job.
+            num_workers (int): Number of files indexed at the same time.
+            max_pending (int): Maximum number of queued jobs, above which
+                new jobs are rejected.
+            max_finished (int): Number of finished jobs whose status is
+                kept.
+            spool_max_memory (int): Size above which the content of a
+                queued file is spooled to disk.
+        """
+        self.runner = runner
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.spool_max_memory = spool_max_memory
+        self._jobs: Dict[str, Job] = {}
+        self._pending: OrderedDict[str, Deque[Job]] = OrderedDict()
+        self._num_pending = 0
+        self._available = asyncio.Semaphore(0)
+        self._finished: Deque[str] = deque()
+        self._workers: List[asyncio.Task[Any]] = []
+
+    def start(self) -> None:
+        self._workers = [
+            asyncio.create_task(self._work())
+            for _ in range(self.num_workers)
+        ]
+
+    async def stop(self) -> None:
+        """
+        Cancel the workers and drop the queued jobs
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for jobs in self._pending.values():
+            for job in jobs:
+                job.close()
+        self._pending.clear()
+
+    async def submit(self, db_name: str, file: UploadFile) -> JobStatus:
+        """
+        Spool the content of an upload, which is closed once the request
+        is answered, and queue its indexing
+        """
+        if self._num_pending >= self.max_pending:
+            raise QueueFullError(
+                f"{self._num_pending} files are already waiting to be indexed")
+        spooled: SpooledTemporaryFile[bytes] = SpooledTemporaryFile(
+            max_size=self.spool_max_memory)
+        try:
+            while data := await file.read(1024 * 1024):
+                await asyncio.to_thread(spooled.write, data)
+            spooled.seek(0)
+        except BaseException:
+            spooled.close()
+            raise
+        job = Job(db_name, file.filename or "", spooled)
+        self._jobs[job.status.job_id] = job
+        self._pending.setdefault(db_name, deque()).append(job)
+        self._num_pending += 1
+        self._available.release()
+        return job.status
+
+    def get_status(self, job_id: str) -> Optional[JobStatus]:
+        job = self._jobs.get(job_id)
+        return job.status if job is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self._num_pending,
+            "tenants": len(self._pending),
+            "workers": len(self._workers),
+        }
+
+    def _next_job(self) -> Job:
+        # the tenant served is moved to the back of the line
+        db_name, jobs = next(iter(self._pending.items()))
+        job = jobs.popleft()
+        if jobs:
+            self._pending.move_to_end(db_name)
+        else:
+            del self._pending[db_name]
+        self._num_pending -= 1
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            await self._available.acquire()
+            job = self._next_job()
+            try:
+                job.status.document_id = await self.runner(job)
+                job.report("done", job.status.num_chunks)
+            except Exception as e:
+                logger.error("Job %s failed to index %s",
+                             job.status.job_id, job.status.filename,
+                             exc_info=True)
+                job.status.error = str(e)
+                job.report("failed", job.status.num_chunks)
+            finally:
+                job.close()
+                self._finish(job)
+
+    def _finish(self, job: Job) -> None:
+        self._finished.append(job.status.job_id)
+        while len(self._finished) > self.max_finished:
+            self._jobs.pop(self._finished.popleft(), None)
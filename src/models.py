@@ -1,5 +1,6 @@
+import datetime
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional, Tuple
 
 
 class Metadata(BaseModel):
@@ -13,14 +14,22 @@ class Metadata(BaseModel):
 class Document(BaseModel):
     text: str
     metadata: Metadata
+    # sha256 of the uploaded file, to detect identical uploads
+    file_hash: Optional[str] = None
 
 
 class Vector(BaseModel):
-    vector_embedding: List[float]
+    # not fetched on the query path unless explicitly requested
+    vector_embedding: Optional[List[float]] = None
     vector_id: str
     text: str
     metadata: Metadata
     parent_id: str
+    # (start, end) of the chunk in the text of the parent document,
+    # only set when vectors are stored normalized
+    span: Optional[Tuple[int, int]] = None
+    # similarity to the query, only set on retrieved vectors
+    score: Optional[float] = None
 
 
 class DeleteRequest(BaseModel):
@@ -28,15 +37,38 @@ class DeleteRequest(BaseModel):
     db_name: str
 
 
+class BulkDeleteRequest(BaseModel):
+    db_name: str
+    document_ids: Optional[List[str]] = None
+    # delete all the documents of the database instead
+    all_documents: bool = False
+
+
+class SearchFilter(BaseModel):
+    # all the conditions must hold, unset conditions are ignored
+    parent_ids: Optional[List[str]] = None
+    author: Optional[str] = None
+    keywords: Optional[List[str]] = None  # any of the keywords
+    # inclusive range of dates such as "2024-01-31"
+    created_from: Optional[str] = None
+    created_to: Optional[str] = None
+
+
 class GenerateRequest(BaseModel):
     query: str
     k: int = 10  # Number of similar documents to retrieve
     db_name: str
+    filter: Optional[SearchFilter] = None
 
 
 class UploadResponse(BaseModel):
     message: str
-    document_id: str
+    # set once the file is indexed
+    document_id: Optional[str] = None
+    # set when the file is indexed in the background
+    job_id: Optional[str] = None
+    # set when the file could not be indexed
+    error: Optional[str] = None
 
 
 class Query(BaseModel):
@@ -47,7 +79,56 @@ class Query(BaseModel):
 class GenerateResponse(BaseModel):
     response: str
     queries: List[Query]
+    # tokens of the prompts sent to the LLM to answer the query
+    prompt_tokens: int = 0
+
+
+class GenerateEvent(BaseModel):
+    # "tool_call" when the agent queries the knowledge base, "retrieved"
+    # with the ids found for a query, "token" for each piece of the answer,
+    # "discard" when the tokens of the current turn are not part of the
+    # answer, and "done" with the whole response, or "error" if the chat
+    # failed
+    event: str
+    query: Optional[str] = None
+    retrieved_ids: Optional[List[str]] = None
+    token: Optional[str] = None
+    response: Optional[GenerateResponse] = None
+    error: Optional[str] = None
 
 
 class DeleteResponse(BaseModel):
     message: str
+
+
+class BulkDeleteResponse(BaseModel):
+    message: str
+    deleted_documents: int
+
+
+class ReindexRequest(BaseModel):
+    db_name: str
+    # all the documents of the database if None
+    document_id: Optional[str] = None
+
+
+class ReindexResponse(BaseModel):
+    documents: int = 0
+    changed_documents: int = 0
+    unchanged_chunks: int = 0
+    added_chunks: int = 0
+    removed_chunks: int = 0
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    db_name: str
+    filename: str
+    # "queued", "parsing", "chunking", "embedding", "writing", "done"
+    # or "failed"
+    stage: str
+    num_chunks: int = 0
+    document_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
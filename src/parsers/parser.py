@@ -1,13 +1,40 @@
 # abstract class for parsing
 from abc import ABC, abstractmethod
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+import logging
+import multiprocessing
+import signal
+import tempfile
 from starlette.datastructures import UploadFile
 from io import BytesIO
-from typing import Any, Dict
+from types import FrameType
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 import fitz  # type: ignore
 from typeguard import typechecked
 from src.models import Metadata
 
 
+logger = logging.getLogger(__name__)
+
+
+class ParserError(Exception):
+    """Raised when a document cannot be parsed"""
+    pass
+
+
+class ParserTimeoutError(ParserError):
+    """Raised when parsing a document takes longer than allowed"""
+    pass
+
+
+# errors of MuPDF on a file that is not a valid PDF
+PDF_ERRORS = (RuntimeError, ValueError, fitz.mupdf.FzErrorBase)
+
+
 @typechecked
 class BaseParser(ABC):
     @abstractmethod
@@ -25,6 +52,14 @@ class BaseParser(ABC):
     async def extract_metadata(self, file: BytesIO) -> Metadata:
         pass
 
+    @typechecked
+    async def parse(self, file: BytesIO) -> Tuple[str, Metadata]:
+        """
+        Extract the text and the metadata of a document. Parsers that can
+        read both in a single pass override this method.
+        """
+        return await self.extract_text(file), await self.extract_metadata(file)
+
 
 @typechecked
 class AdvancedPDFParser(BaseParser):
@@ -37,23 +72,226 @@ class AdvancedPDFParser(BaseParser):
     @staticmethod
     @typechecked
     async def extract_text(filebytes: BytesIO) -> str:
-        doc = fitz.open(stream=filebytes.getvalue(), filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
+        return parse_pdf(filebytes.getvalue())[0]
 
     @staticmethod
     @typechecked
     async def extract_metadata(file: BytesIO) -> Metadata:
-        doc = fitz.open(stream=file.getvalue(), filetype="pdf")
-        metadata: Dict[str, Any] = doc.metadata
-        metadata_pyd = Metadata(
-            created_at=metadata.get("creationDate", ""),
-            keywords=metadata.get("keywords", "").split(),
-            title=metadata.get("title", ""),
-            author=metadata.get("author", ""),
-            description=metadata.get("subject", "")
+        with open_pdf(stream=file.getvalue()) as doc:
+            return metadata_from_pdf(doc.metadata)
+
+    @typechecked
+    async def parse(self, file: BytesIO) -> Tuple[str, Metadata]:
+        """
+        Open the PDF once and extract its text and metadata together
+        """
+        return await asyncio.to_thread(parse_pdf, file.getvalue())
+
+
+@typechecked
+def metadata_from_pdf(metadata: Dict[str, Any]) -> Metadata:
+    return Metadata(
+        created_at=metadata.get("creationDate", ""),
+        keywords=(metadata.get("keywords") or "").split(),
+        title=metadata.get("title") or "",
+        author=metadata.get("author") or "",
+        description=metadata.get("subject") or ""
+    )
+
+
+def open_pdf(
+    path: Optional[str] = None,
+    stream: Optional[bytes] = None
+) -> Any:
+    """
+    Open a PDF from a path or from its bytes, raising ParserError if it is
+    not a valid PDF
+    """
+    try:
+        return fitz.open(path, stream=stream, filetype="pdf")
+    except PDF_ERRORS as e:
+        raise ParserError(f"Invalid PDF: {e}") from e
+
+
+def parse_pdf(data: bytes) -> Tuple[str, Metadata]:
+    """
+    Extract the text and the metadata of a PDF in a single pass
+    """
+    with open_pdf(stream=data) as doc:
+        try:
+            text = "".join(page.get_text() for page in doc)
+        except PDF_ERRORS as e:
+            raise ParserError(f"Invalid PDF: {e}") from e
+        return text, metadata_from_pdf(doc.metadata)
+
+
+def _raise_timeout(signum: int, frame: Optional[FrameType]) -> None:
+    raise ParserTimeoutError("Parsing timed out")
+
+
+def _init_parser_worker(memory_limit_mb: Optional[int]) -> None:
+    """
+    Cap the address space of a worker process, so that a malicious or
+    huge PDF makes the parse fail with MemoryError instead of exhausting
+    the memory of the host
+    """
+    if memory_limit_mb is not None:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def _parse_pdf_in_worker(
+    data: bytes,
+    timeout: Optional[float]
+) -> Tuple[str, Metadata]:
+    if timeout is not None:
+        # interrupts the parse between two calls into MuPDF
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return parse_pdf(data)
+    finally:
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+@typechecked
+class ProcessPoolPDFParser(AdvancedPDFParser):
+    def __init__(
+        self,
+        max_workers: int = 2,
+        timeout: Optional[float] = 60.0,
+        memory_limit_mb: Optional[int] = 2048
+    ):
+        """
+        PDF parser that parses in a pool of worker processes, so that
+        CPU-bound MuPDF work does not block the event loop. The pool is
+        meant to be shared by all the requests of the app.
+
+        Args:
+            max_workers (int): Number of worker processes.
+            timeout (Optional[float]): Maximum parsing time of a file in
+                seconds.
+            memory_limit_mb (Optional[int]): Maximum address space of a
+                worker process in MiB.
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._executor = self._make_executor()
+
+    def _make_executor(self) -> ProcessPoolExecutor:
+        # workers are spawned rather than forked from the multithreaded
+        # server process
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parser_worker,
+            initargs=(self.memory_limit_mb,)
         )
-        return metadata_pyd
+
+    async def parse(self, file: BytesIO) -> Tuple[str, Metadata]:
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        future = loop.run_in_executor(
+            executor, _parse_pdf_in_worker, file.getvalue(), self.timeout)
+        try:
+            # the worker enforces the timeout itself, this is a backstop
+            # for a worker stuck inside MuPDF
+            return await asyncio.wait_for(
+                future,
+                None if self.timeout is None else 2 * self.timeout
+            )
+        except asyncio.TimeoutError as e:
+            # the worker is stuck, so it is killed with its pool
+            logger.error("Parser worker timed out, restarting the pool")
+            self._replace_executor(executor)
+            raise ParserTimeoutError("Parsing timed out") from e
+        except MemoryError as e:
+            raise ParserError(
+                f"Parsing exceeded {self.memory_limit_mb} MiB") from e
+        except BrokenProcessPool as e:
+            # a worker was killed, e.g. by the OOM killer
+            logger.error("Parser worker died, restarting the pool")
+            self._replace_executor(executor)
+            raise ParserError("Parser worker died") from e
+
+    def _replace_executor(self, executor: ProcessPoolExecutor) -> None:
+        """
+        Replace a pool with a stuck or dead worker by a new one, and
+        terminate the processes of the old pool. The other parses running
+        in the old pool fail with BrokenProcessPool.
+        """
+        if self._executor is not executor:
+            # already replaced by another request
+            return
+        self._executor = self._make_executor()
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@typechecked
+class StreamingPDFParser(AdvancedPDFParser):
+    def __init__(
+        self,
+        spool_dir: Optional[str] = None,
+        read_size: int = 1024 * 1024
+    ):
+        """
+        PDF parser that spools the upload to disk and reads its pages
+        lazily, so that neither the file nor its text is held in memory.
+
+        Args:
+            spool_dir (Optional[str]): Directory of the spooled uploads,
+                the system temporary directory if None.
+            read_size (int): Number of bytes copied at a time.
+        """
+        self.spool_dir = spool_dir
+        self.read_size = read_size
+
+    @asynccontextmanager
+    async def open_pages(
+        self,
+        file: UploadFile
+    ) -> AsyncIterator[Tuple[str, Metadata, AsyncIterator[str]]]:
+        """
+        Spool the upload to a temporary file and yield the sha256 of the
+        file and the metadata of the PDF with an async iterator over the
+        text of its pages. The file is deleted on exit.
+        """
+        file_hash = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(
+            dir=self.spool_dir, suffix=".pdf"
+        ) as spooled:
+            while data := await file.read(self.read_size):
+                file_hash.update(data)
+                await asyncio.to_thread(spooled.write, data)
+            await asyncio.to_thread(spooled.flush)
+            doc = await asyncio.to_thread(open_pdf, spooled.name)
+            try:
+                yield (
+                    file_hash.hexdigest(),
+                    metadata_from_pdf(doc.metadata),
+                    self._pages(doc)
+                )
+            finally:
+                doc.close()
+
+    @staticmethod
+    async def _pages(doc: Any) -> AsyncIterator[str]:
+        for page_number in range(doc.page_count):
+            yield await asyncio.to_thread(_page_text, doc, page_number)
+
+
+def _page_text(doc: Any, page_number: int) -> str:
+    try:
+        text: str = doc.load_page(page_number).get_text()
+    except PDF_ERRORS as e:
+        raise ParserError(f"Invalid PDF: {e}") from e
+    return text
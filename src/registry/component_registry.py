@@ -0,0 +1,110 @@
+# components shared by the requests for the lifetime of the app
+import asyncio
+import inspect
+import logging
+from typing import (
+    Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar, cast
+)
+from typeguard import typechecked
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@typechecked
+class ComponentRegistry:
+    def __init__(self) -> None:
+        """
+        Application-scoped registry of the components that outlive a
+        request: pooled provider clients, created once, and per-tenant
+        components such as database handlers and retrieval pipelines,
+        created when a tenant is first used and then reused.
+        Components are identified by their kind and, for per-tenant
+        components, by the db_name of the tenant.
+        """
+        self._components: Dict[Tuple[str, str], Any] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._closers: List[Callable[[], Any]] = []
+        self.created = 0
+        self.reused = 0
+
+    def get(self, kind: str, factory: Callable[[], T], key: str = "") -> T:
+        """
+        Component of a kind for a key, created by factory on first use
+        """
+        if (kind, key) in self._components:
+            self.reused += 1
+        else:
+            self._components[(kind, key)] = factory()
+            self.created += 1
+        return cast(T, self._components[(kind, key)])
+
+    async def get_async(
+        self,
+        kind: str,
+        factory: Callable[[], Awaitable[T]],
+        key: str = ""
+    ) -> T:
+        """
+        Component of a kind for a key, created by an async factory on
+        first use. Concurrent requests for a component that does not
+        exist yet wait for a single creation.
+        """
+        if (kind, key) in self._components:
+            self.reused += 1
+            return cast(T, self._components[(kind, key)])
+        lock = self._locks.setdefault((kind, key), asyncio.Lock())
+        async with lock:
+            if (kind, key) not in self._components:
+                self._components[(kind, key)] = await factory()
+                self.created += 1
+            else:
+                self.reused += 1
+        self._locks.pop((kind, key), None)
+        return cast(T, self._components[(kind, key)])
+
+    def find(self, kind: str, key: str = "") -> Optional[Any]:
+        """
+        Component of a kind for a key, if it was created
+        """
+        return self._components.get((kind, key))
+
+    def find_all(self, kind: str) -> Dict[str, Any]:
+        """
+        Components of a kind by key
+        """
+        return {
+            key: component
+            for (component_kind, key), component in self._components.items()
+            if component_kind == kind
+        }
+
+    def on_close(self, close: Callable[[], Any]) -> None:
+        """
+        Register a function, or a coroutine function, releasing a
+        component when the app shuts down
+        """
+        self._closers.append(close)
+
+    async def aclose(self) -> None:
+        """
+        Release the components in the reverse order of registration
+        """
+        while self._closers:
+            close = self._closers.pop()
+            try:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.error("Could not release a component", exc_info=True)
+        self._components.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "components": len(self._components),
+            "created": self.created,
+            "reused": self.reused,
+        }
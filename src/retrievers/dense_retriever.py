@@ -1,50 +1,154 @@
 # implement dense retriever
 from abc import ABC, abstractmethod
-from typing import List
+import asyncio
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 from typeguard import typechecked
 from motor.motor_asyncio import AsyncIOMotorCollection
-from src.models import Vector
-from typing import Sequence, Mapping, Any
+from src.models import SearchFilter, Vector
+from src.retrievers.search_filter import (
+    find_candidate_ids, to_mongo_filter, to_parent_filter
+)
+from src.database_handlers.chunk_resolver import ChunkResolver
+from src.database_handlers.embedding_codec import (
+    EMBEDDING_DTYPE, encode_embedding, is_binary_embedding,
+    vector_from_document
+)
+from src.vector_indexes.vector_index import (
+    BaseVectorIndex, normalize_rows, top_k_indices
+)
+from typing import Mapping, Any
+
+
+@typechecked
+async def fetch_vectors(
+    vector_collection: AsyncIOMotorCollection,
+    hits: List[Tuple[str, float]],
+    include_embedding: bool = False,
+    chunk_resolver: Optional[ChunkResolver] = None
+) -> List[Vector]:
+    """
+    Fetch the vectors of (vector_id, score) hits with a single $in
+    query, in the same order as the hits. The embeddings are only
+    fetched if requested. Missing vectors are skipped.
+    The chunks of normalized vectors are resolved by chunk_resolver.
+    """
+    if not hits:
+        return []
+    projection: Dict[str, int] = {"_id": 0}
+    if not include_embedding:
+        projection["vector_embedding"] = 0
+    cursor = vector_collection.find(
+        {"vector_id": {"$in": [vector_id for vector_id, _ in hits]}},
+        projection
+    )
+    found: List[Mapping[str, Any]] = [doc async for doc in cursor]
+    if chunk_resolver is not None:
+        found = await chunk_resolver.resolve(found)
+    docs: Dict[str, Mapping[str, Any]] = {
+        doc["vector_id"]: doc for doc in found}
+    return [
+        vector_from_document(docs[vector_id], score=score)
+        for vector_id, score in hits if vector_id in docs
+    ]
 
 
 @typechecked
 class BaseDenseRetriever(ABC):
     vector_collection: AsyncIOMotorCollection
+    # set when the vectors may be normalized, in which case the filters
+    # are matched on the documents and the chunks resolved from them
+    chunk_resolver: Optional[ChunkResolver] = None
 
     @abstractmethod
+    @typechecked
+    async def retrieve_ids(
+        self,
+        query_embedding: List[float],
+        k: int = 10,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Return (vector_id, cosine similarity) of the top k most similar
+        vectors matching the filter, without fetching their documents
+        """
+        pass
+
     @typechecked
     async def retrieve(
         self,
         query_embedding: List[float],
-        k: int = 10
+        k: int = 10,
+        include_embedding: bool = False,
+        search_filter: Optional[SearchFilter] = None
     ) -> List[Vector]:
-        pass
+        """
+        Retrieve the top k most similar vectors: first their ids and scores,
+        then their documents in a single query
+        """
+        hits = await self.retrieve_ids(query_embedding, k, search_filter)
+        return await self.fetch_vectors(hits, include_embedding)
+
+    @typechecked
+    async def fetch_vectors(
+        self,
+        hits: List[Tuple[str, float]],
+        include_embedding: bool = False
+    ) -> List[Vector]:
+        """
+        Fetch the vectors of (vector_id, score) hits from the vector
+        collection, in the same order as the hits
+        """
+        return await fetch_vectors(
+            self.vector_collection, hits, include_embedding,
+            self.chunk_resolver)
 
 
-@typechecked
 @typechecked
 class NNRetriever(BaseDenseRetriever):
-    def __init__(self, vector_collection: AsyncIOMotorCollection):
+    def __init__(
+        self,
+        vector_collection: AsyncIOMotorCollection,
+        embedding_format: str = "array",
+        batch_size: int = 1024,
+        chunk_resolver: Optional[ChunkResolver] = None
+    ):
+        """
+        Exact nearest neighbour retriever.
+        Embeddings stored as arrays are scored inside MongoDB with an
+        aggregation pipeline, embeddings stored as binary are streamed
+        and scored in batches with numpy.
+        """
         self.vector_collection = vector_collection
+        self.embedding_format = embedding_format
+        self.batch_size = batch_size
+        self.chunk_resolver = chunk_resolver
 
     @typechecked
-    async def retrieve(
+    async def retrieve_ids(
         self,
         query_embedding: List[float],
-        k: int = 10
-    ) -> List[Vector]:
+        k: int = 10,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, float]]:
         """
         Retrieve the IDs and cosine similarity of the top k
         most similar documents
         """
-        pipeline: Sequence[Mapping[str, Any]] = [
+        # the filter is matched first, using the secondary indexes,
+        # so that only the matching vectors are scored
+        if search_filter is not None and self.chunk_resolver is not None:
+            search_filter = await to_parent_filter(
+                self.chunk_resolver.doc_collection, search_filter)
+        match = to_mongo_filter(search_filter) \
+            if search_filter is not None else {}
+        if self.embedding_format == "binary":
+            return await self._retrieve_binary(query_embedding, k, match)
+
+        pipeline: List[Mapping[str, Any]] = [
             {
                 "$project": {
-                    "parent_id": 1,
-                    "vector_embedding": 1,
                     "vector_id": 1,
-                    "metadata": 1,
-                    "text": 1,
                     "cosineSimilarity": {
                         "$divide": [
                             {"$reduce": {
@@ -73,25 +177,108 @@ class NNRetriever(BaseDenseRetriever):
             {"$sort": {"cosineSimilarity": -1}},
             {"$limit": k},
             {"$project": {
-                "parent_id": 1,
-                "cosineSimilarity": 1,
-                "_id": 1,
-                "vector_embedding": 1,
+                "_id": 0,
                 "vector_id": 1,
-                "text": 1,
-                "metadata": 1
+                "cosineSimilarity": 1
             }}
         ]
 
+        if match:
+            pipeline.insert(0, {"$match": match})
+
         # Execute the aggregation pipeline
         results = []
         async for doc in self.vector_collection.aggregate(pipeline):
-            vector = Vector(
-                vector_embedding=doc["vector_embedding"],
-                vector_id=doc["vector_id"],
-                text=doc["text"],
-                metadata=doc["metadata"],
-                parent_id=doc["parent_id"]
-            )
-            results.append(vector)
+            results.append((doc["vector_id"], float(doc["cosineSimilarity"])))
         return results
+
+    async def _retrieve_binary(
+        self,
+        query_embedding: List[float],
+        k: int,
+        match: Mapping[str, Any]
+    ) -> List[Tuple[str, float]]:
+        """
+        Binary embeddings are normalized at index time, so they are decoded
+        with numpy.frombuffer and scored with a dot product.
+        Only the ids and embeddings are streamed.
+        """
+        query = normalize_rows(np.asarray(query_embedding))
+        best_ids: List[str] = []
+        best_scores = np.zeros(0, dtype=np.float32)
+        batch_ids: List[str] = []
+        batch_embeddings: List[bytes] = []
+
+        def merge_batch() -> Tuple[List[str], np.ndarray]:
+            matrix = np.frombuffer(
+                b"".join(batch_embeddings), dtype=EMBEDDING_DTYPE
+            ).reshape(len(batch_embeddings), -1)
+            scores = np.concatenate([best_scores, matrix @ query])
+            ids = best_ids + batch_ids
+            top = top_k_indices(scores, k)
+            return [ids[i] for i in top], scores[top]
+
+        cursor = self.vector_collection.find(
+            match, {"_id": 0, "vector_id": 1, "vector_embedding": 1},
+            batch_size=self.batch_size
+        )
+        async for doc in cursor:
+            embedding = doc["vector_embedding"]
+            # vectors not migrated yet are still stored as arrays
+            if not is_binary_embedding(embedding):
+                embedding = encode_embedding(embedding)
+            batch_ids.append(doc["vector_id"])
+            batch_embeddings.append(embedding)
+            if len(batch_ids) >= self.batch_size:
+                best_ids, best_scores = merge_batch()
+                batch_ids, batch_embeddings = [], []
+        if batch_ids:
+            best_ids, best_scores = merge_batch()
+
+        return [
+            (vector_id, float(score))
+            for vector_id, score in zip(best_ids, best_scores)
+        ]
+
+
+@typechecked
+class IndexRetriever(BaseDenseRetriever):
+    def __init__(
+        self,
+        vector_collection: AsyncIOMotorCollection,
+        vector_index: BaseVectorIndex,
+        chunk_resolver: Optional[ChunkResolver] = None
+    ):
+        """
+        Dense retriever backed by an in-process vector index.
+        The index returns the ids of the top k vectors, whose documents
+        are then fetched from the vector collection.
+        """
+        self.vector_collection = vector_collection
+        self.vector_index = vector_index
+        self.chunk_resolver = chunk_resolver
+
+    @typechecked
+    async def retrieve_ids(
+        self,
+        query_embedding: List[float],
+        k: int = 10,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Retrieve the top k most similar documents using the vector index.
+        A filter is resolved to the ids of the matching vectors, and only
+        those are scored by the index. Vectors deleted since the index was
+        last synchronized are skipped when their documents are fetched.
+        """
+        candidate_ids = None
+        if search_filter is not None:
+            if self.chunk_resolver is not None:
+                search_filter = await to_parent_filter(
+                    self.chunk_resolver.doc_collection, search_filter)
+            candidate_ids = await find_candidate_ids(
+                self.vector_collection, search_filter)
+            if candidate_ids is not None and not candidate_ids:
+                return []
+        return await asyncio.to_thread(
+            self.vector_index.search, query_embedding, k, candidate_ids)
@@ -0,0 +1,89 @@
+# hybrid retriever fusing dense and sparse results
+from abc import ABC, abstractmethod
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from typeguard import typechecked
+from src.models import SearchFilter, Vector
+from src.retrievers.dense_retriever import BaseDenseRetriever
+from src.retrievers.sparse_retriever import BaseSparseRetriever
+
+
+@typechecked
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[str, float]]],
+    k: int,
+    rrf_k: int = 60
+) -> List[Tuple[str, float]]:
+    """
+    Fuse rankings of (vector_id, score) with reciprocal rank fusion:
+    each vector scores the sum of 1 / (rrf_k + rank) over the rankings.
+    Only the ranks are used, so scores on different scales can be fused.
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (vector_id, _) in enumerate(ranking, start=1):
+            fused[vector_id] = fused.get(vector_id, 0.0) + 1 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+@typechecked
+class BaseHybridRetriever(ABC):
+    @abstractmethod
+    @typechecked
+    async def retrieve(
+        self,
+        query: str,
+        query_embedding: List[float],
+        k: int = 10,
+        include_embedding: bool = False,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Vector]:
+        pass
+
+
+@typechecked
+class HybridRetriever(BaseHybridRetriever):
+    def __init__(
+        self,
+        dense_retriever: BaseDenseRetriever,
+        sparse_retriever: BaseSparseRetriever,
+        rrf_k: int = 60
+    ):
+        """
+        Runs the dense and sparse searches concurrently and fuses their
+        rankings with reciprocal rank fusion. Only the fused top k
+        documents are fetched.
+        """
+        self.dense_retriever = dense_retriever
+        self.sparse_retriever = sparse_retriever
+        self.rrf_k = rrf_k
+
+    @typechecked
+    async def retrieve_ids(
+        self,
+        query: str,
+        query_embedding: List[float],
+        k: int = 10,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, float]]:
+        dense_hits, sparse_hits = await asyncio.gather(
+            self.dense_retriever.retrieve_ids(
+                query_embedding, k, search_filter),
+            self.sparse_retriever.retrieve_ids(query, k, search_filter)
+        )
+        return reciprocal_rank_fusion(
+            [dense_hits, sparse_hits], k, self.rrf_k)
+
+    @typechecked
+    async def retrieve(
+        self,
+        query: str,
+        query_embedding: List[float],
+        k: int = 10,
+        include_embedding: bool = False,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Vector]:
+        hits = await self.retrieve_ids(
+            query, query_embedding, k, search_filter)
+        return await self.dense_retriever.fetch_vectors(
+            hits, include_embedding)
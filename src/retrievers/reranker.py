@@ -1,12 +1,24 @@
-from typing import List
-from cohere import Client  # Make sure to install the cohere package
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional
+import cohere  # type: ignore
+import httpx
+from typeguard import typechecked
+from src.caches.cache import LRUCache
+from src.embedders.cached_embedder import normalize_text
 from src.models import Vector  # Assuming Vector is your data model for vectors
+from src.utils.retry import retry_async
 from abc import ABC, abstractmethod
 
 
+logger = logging.getLogger(__name__)
+
+
 class BaseReranker(ABC):
     @abstractmethod
-    def rerank_responses(
+    async def rerank_responses(
         self, query: str,
         responses: List[Vector],
         num_responses: int = 3
@@ -15,16 +27,36 @@ class BaseReranker(ABC):
 
 
 class Reranker(BaseReranker):
-    def __init__(self, cohere_api_key: str):
+    def __init__(
+        self,
+        cohere_api_key: str,
+        model: str = "rerank-english-v3.0",
+        max_retries: int = 3,
+        timeout: float = 30.0,
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
         """
-        Initialize the Reranker with the Cohere client.
+        Initialize the Reranker with the async Cohere client.
 
         Args:
             cohere_api_key (str): Your Cohere API key.
+            model (str): Rerank model.
+            max_retries (int): Maximum number of retries of rate limited
+                or failed calls.
+            timeout (float): Timeout of an API call in seconds.
+            http_client (Optional[httpx.AsyncClient]): HTTP client whose
+                keep-alive connections are reused across calls.
         """
-        self.co = Client(cohere_api_key)
+        self.co = cohere.AsyncClient(
+            cohere_api_key,
+            timeout=timeout,
+            max_retries=0,
+            httpx_client=http_client
+        )
+        self.model = model
+        self.max_retries = max_retries
 
-    def rerank_responses(
+    async def rerank_responses(
         self,
         query: str,
         responses: List[Vector],
@@ -35,18 +67,25 @@ class Reranker(BaseReranker):
 
         Args:
             query (str): The query to evaluate against.
-            responses (List[str]): The list of responses to rerank.
+            responses (List[Vector]): The list of responses to rerank.
             num_responses (int): The number of top responses to return.
 
         Returns:
-            List[str]: The reranked list of responses.
+            List[Vector]: The reranked list of responses.
         """
-        reranked_responses = self.co.rerank(
-            query=query,
-            documents=[response.text for response in responses],
-            top_n=num_responses,
-            model='rerank-english-v3.0',
-        )
+        if not responses:
+            return []
+
+        async def call() -> Any:
+            return await self.co.rerank(
+                query=query,
+                documents=[response.text for response in responses],
+                top_n=num_responses,
+                model=self.model,
+            )
+
+        reranked_responses = await retry_async(
+            call, max_retries=self.max_retries)
         vector_indices: List[int] = [
             doc.index for doc in reranked_responses.results
         ]
@@ -54,3 +93,76 @@ class Reranker(BaseReranker):
             responses[index] for index in vector_indices
         ]
         return vectors
+
+
+@typechecked
+class CachedReranker(BaseReranker):
+    def __init__(
+        self,
+        reranker: BaseReranker,
+        max_size: int = 1024,
+        ttl_seconds: Optional[float] = 600
+    ):
+        """
+        Caches the reranked order of the candidates of a query, keyed by
+        the query and the ids of the candidates, so that the iterations of
+        an agent that retrieve the same candidates again skip the call.
+        """
+        self.reranker = reranker
+        self.cache = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+
+    def cache_key(
+        self,
+        query: str,
+        responses: List[Vector],
+        num_responses: int
+    ) -> str:
+        return hashlib.sha256(json.dumps([
+            normalize_text(query),
+            [response.vector_id for response in responses],
+            num_responses
+        ]).encode()).hexdigest()
+
+    async def rerank_responses(
+        self,
+        query: str,
+        responses: List[Vector],
+        num_responses: int = 3
+    ) -> List[Vector]:
+        key = self.cache_key(query, responses, num_responses)
+        reranked_ids: Optional[List[str]] = self.cache.get(key)
+        if reranked_ids is None:
+            reranked = await self.reranker.rerank_responses(
+                query, responses, num_responses)
+            self.cache.set(key, [response.vector_id for response in reranked])
+            return reranked
+        by_id = {response.vector_id: response for response in responses}
+        return [by_id[vector_id] for vector_id in reranked_ids]
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
+
+
+@typechecked
+async def rerank_with_deadline(
+    reranker: BaseReranker,
+    query: str,
+    responses: List[Vector],
+    timeout: Optional[float] = None,
+    num_responses: int = 3
+) -> List[Vector]:
+    """
+    Rerank the responses, falling back to their retrieval order, which is
+    sorted by score, if the reranker does not answer within the timeout
+    """
+    try:
+        return await asyncio.wait_for(
+            reranker.rerank_responses(query, responses, num_responses),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        logger.warning(
+            "Reranking timed out after %ss, keeping the retrieval order",
+            timeout
+        )
+        return responses[:num_responses]
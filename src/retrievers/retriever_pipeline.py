@@ -5,16 +5,21 @@ from abc import ABC, abstractmethod
 from typeguard import typechecked
 from src.embedders.dense_embedder import BaseDenseEmbedder
 from src.retrievers.dense_retriever import BaseDenseRetriever
-from src.retrievers.reranker import BaseReranker
-from typing import List
-from src.models import Vector
+from src.retrievers.hybrid_retriever import BaseHybridRetriever
+from src.retrievers.reranker import BaseReranker, rerank_with_deadline
+from typing import List, Optional
+from src.models import SearchFilter, Vector
 
 
 @typechecked
 class BaseRetrieverPipeline(ABC):
     @abstractmethod
     @typechecked
-    async def retrieve(self, query: str) -> List[Vector]:
+    async def retrieve(
+        self,
+        query: str,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Vector]:
         pass
 
 
@@ -23,17 +28,60 @@ class RetrieverPipeline(BaseRetrieverPipeline):
     def __init__(
         self, embedder: BaseDenseEmbedder,
         retriever: BaseDenseRetriever,
-        reranker: BaseReranker
+        reranker: BaseReranker,
+        rerank_timeout: Optional[float] = None
     ):
         self.embedder = embedder
         self.retriever = retriever
         self.reranker = reranker
+        # seconds after which the retrieval order is kept
+        self.rerank_timeout = rerank_timeout
 
-    async def retrieve(self, query: str) -> List[Vector]:
-        query_embedding: List[float] = await self.embedder.embed_text(query)
-        results: List[Vector] = await self.retriever.retrieve(query_embedding)
-        reranked_results: List[Vector] = self.reranker.rerank_responses(
+    async def retrieve(
+        self,
+        query: str,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Vector]:
+        query_embedding: List[float] = await self.embedder.embed_text(
+            query, input_type="search_query")
+        results: List[Vector] = await self.retriever.retrieve(
+            query_embedding, search_filter=search_filter)
+        reranked_results: List[Vector] = await rerank_with_deadline(
+            self.reranker,
             query,
-            results
+            results,
+            timeout=self.rerank_timeout
+        )
+        return reranked_results
+
+
+@typechecked
+class HybridRetrieverPipeline(BaseRetrieverPipeline):
+    def __init__(
+        self, embedder: BaseDenseEmbedder,
+        retriever: BaseHybridRetriever,
+        reranker: BaseReranker,
+        rerank_timeout: Optional[float] = None
+    ):
+        self.embedder = embedder
+        self.retriever = retriever
+        self.reranker = reranker
+        # seconds after which the retrieval order is kept
+        self.rerank_timeout = rerank_timeout
+
+    async def retrieve(
+        self,
+        query: str,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Vector]:
+        query_embedding: List[float] = await self.embedder.embed_text(
+            query, input_type="search_query")
+        results: List[Vector] = await self.retriever.retrieve(
+            query, query_embedding, search_filter=search_filter)
+        reranked_results: List[Vector] = await rerank_with_deadline(
+            self.reranker,
+            query,
+            results,
+            timeout=self.rerank_timeout
         )
         return reranked_results
@@ -0,0 +1,102 @@
+# metadata filters applied before similarity scoring
+import re
+from typing import Any, Dict, List, Optional, Set
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from typeguard import typechecked
+from src.models import SearchFilter
+
+
+# upper bound of the strings starting with a prefix
+PREFIX_END = "\uffff"
+
+
+@typechecked
+def to_pdf_date(date: str) -> str:
+    """
+    Convert an ISO date such as "2024-01-31" to the prefix of the
+    PDF dates extracted by the parser, such as "D:20240131120000+01'00'"
+    """
+    return "D:" + re.sub(r"\D", "", date)
+
+
+@typechecked
+def to_mongo_filter(search_filter: SearchFilter) -> Dict[str, Any]:
+    """
+    MongoDB query on the vectors collection selecting the vectors that
+    match the filter. Dates are compared as prefixes, in both the ISO and
+    the PDF formats, so that the range is inclusive of the end date.
+    """
+    conditions: List[Dict[str, Any]] = []
+    if search_filter.parent_ids is not None:
+        conditions.append({"parent_id": {"$in": search_filter.parent_ids}})
+    if search_filter.author is not None:
+        conditions.append({"metadata.author": search_filter.author})
+    if search_filter.keywords is not None:
+        conditions.append(
+            {"metadata.keywords": {"$in": search_filter.keywords}})
+    if search_filter.created_from is not None or \
+            search_filter.created_to is not None:
+        date_ranges = []
+        for convert in (str, to_pdf_date):
+            date_range: Dict[str, str] = {}
+            if search_filter.created_from is not None:
+                date_range["$gte"] = convert(search_filter.created_from)
+            if search_filter.created_to is not None:
+                date_range["$lte"] = \
+                    convert(search_filter.created_to) + PREFIX_END
+            date_ranges.append({"metadata.created_at": date_range})
+        conditions.append({"$or": date_ranges})
+    if not conditions:
+        return {}
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+@typechecked
+async def find_candidate_ids(
+    vector_collection: AsyncIOMotorCollection,
+    search_filter: SearchFilter,
+    batch_size: int = 10000
+) -> Optional[Set[str]]:
+    """
+    Ids of the vectors matching the filter, or None if the filter has no
+    conditions. The query is answered from the secondary indexes of the
+    vectors collection, so its cost is proportional to the number of
+    matching vectors.
+    """
+    query = to_mongo_filter(search_filter)
+    if not query:
+        return None
+    cursor = vector_collection.find(
+        query,
+        {"_id": 0, "vector_id": 1},
+        batch_size=batch_size
+    )
+    return {doc["vector_id"] async for doc in cursor}
+
+
+@typechecked
+async def to_parent_filter(
+    doc_collection: AsyncIOMotorCollection,
+    search_filter: SearchFilter
+) -> SearchFilter:
+    """
+    Filter on the ids of the documents matching the metadata conditions,
+    for normalized vectors, which do not store the metadata of their
+    document. The conditions are matched on the documents collection,
+    which is much smaller than the vectors collection.
+    """
+    query = to_mongo_filter(
+        search_filter.model_copy(update={"parent_ids": None}))
+    if not query:
+        return search_filter
+    if search_filter.parent_ids is not None:
+        query = {"$and": [query, {"_id": {"$in": [
+            ObjectId(parent_id) for parent_id in search_filter.parent_ids
+            if ObjectId.is_valid(parent_id)
+        ]}}]}
+    cursor = doc_collection.find(query, {"_id": 1})
+    return SearchFilter(
+        parent_ids=[str(doc["_id"]) async for doc in cursor])
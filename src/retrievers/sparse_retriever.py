@@ -0,0 +1,82 @@
+# implement sparse (lexical) retriever
+from abc import ABC, abstractmethod
+import asyncio
+from typing import List, Optional, Tuple
+from typeguard import typechecked
+from motor.motor_asyncio import AsyncIOMotorCollection
+from src.models import SearchFilter, Vector
+from src.retrievers.dense_retriever import fetch_vectors
+from src.retrievers.search_filter import (
+    find_candidate_ids, to_parent_filter
+)
+from src.database_handlers.chunk_resolver import ChunkResolver
+from src.vector_indexes.bm25_index import BM25Index
+
+
+@typechecked
+class BaseSparseRetriever(ABC):
+    vector_collection: AsyncIOMotorCollection
+    # see BaseDenseRetriever.chunk_resolver
+    chunk_resolver: Optional[ChunkResolver] = None
+
+    @abstractmethod
+    @typechecked
+    async def retrieve_ids(
+        self,
+        query: str,
+        k: int = 10,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Return (vector_id, score) of the top k chunks matching the terms
+        of the query and the filter, without fetching their documents
+        """
+        pass
+
+    @typechecked
+    async def retrieve(
+        self,
+        query: str,
+        k: int = 10,
+        include_embedding: bool = False,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Vector]:
+        hits = await self.retrieve_ids(query, k, search_filter)
+        return await fetch_vectors(
+            self.vector_collection, hits, include_embedding,
+            self.chunk_resolver)
+
+
+@typechecked
+class BM25Retriever(BaseSparseRetriever):
+    def __init__(
+        self,
+        vector_collection: AsyncIOMotorCollection,
+        bm25_index: BM25Index,
+        chunk_resolver: Optional[ChunkResolver] = None
+    ):
+        """
+        Sparse retriever backed by an in-process BM25 index
+        """
+        self.vector_collection = vector_collection
+        self.bm25_index = bm25_index
+        self.chunk_resolver = chunk_resolver
+
+    @typechecked
+    async def retrieve_ids(
+        self,
+        query: str,
+        k: int = 10,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Tuple[str, float]]:
+        candidate_ids = None
+        if search_filter is not None:
+            if self.chunk_resolver is not None:
+                search_filter = await to_parent_filter(
+                    self.chunk_resolver.doc_collection, search_filter)
+            candidate_ids = await find_candidate_ids(
+                self.vector_collection, search_filter)
+            if candidate_ids is not None and not candidate_ids:
+                return []
+        return await asyncio.to_thread(
+            self.bm25_index.search, query, k, candidate_ids)
@@ -1,107 +1,800 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-from typing import AsyncGenerator
+from fastapi import Depends, FastAPI, HTTPException, Request
+from motor.motor_asyncio import AsyncIOMotorClient
+from typing import AsyncGenerator, AsyncIterator
 from fastapi.datastructures import State
+from fastapi.responses import StreamingResponse
+import functools
+import httpx
+import json
 import logging
 import os
 import uvicorn
 from src.database_handlers.database_handler import MongoDBHandler
-from src.parsers.parser import AdvancedPDFParser
+from src.database_handlers.chunk_resolver import ChunkResolver
+from src.parsers.parser import (
+    AdvancedPDFParser, BaseParser, ParserError, ProcessPoolPDFParser,
+    StreamingPDFParser
+)
 from typeguard import typechecked
-from src.indexers.pdf_indexer import PDFIndexer
-from src.chunkers.chunker import ApproximateChunkerWithOverlap
-from src.embedders.dense_embedder import CohereDenseEmbedder
+from src.indexers.pdf_indexer import (
+    BaseIndexer, PDFIndexer, StreamingPDFIndexer
+)
+from src.chunkers.chunker import (
+    ApproximateChunkerWithOverlap, BaseChunker, SentenceChunker,
+    load_token_counter
+)
+from src.embedders.dense_embedder import (
+    BaseDenseEmbedder, CohereDenseEmbedder
+)
+from src.embedders.batching_embedder import BatchingDenseEmbedder
+from src.embedders.cached_embedder import (
+    CachedDenseEmbedder, ContentCachedDenseEmbedder
+)
+from src.caches.answer_cache import SemanticAnswerCache
+from src.caches.cache import (
+    BaseCacheBackend, MongoDBCacheBackend, SQLiteCacheBackend
+)
 from dotenv import load_dotenv
 import traceback
 from bson import ObjectId
 from src.models import (
-    DeleteRequest, UploadResponse, GenerateRequest, GenerateResponse
+    DeleteRequest, UploadResponse, GenerateEvent, GenerateRequest,
+    GenerateResponse, JobStatus, ReindexRequest, ReindexResponse
 )
+from src.indexers.reindexer import Reindexer
+from src.jobs.job_queue import FairJobQueue, Job, QueueFullError
+from src.registry.component_registry import ComponentRegistry
 from fastapi import UploadFile
-from src.retrievers.dense_retriever import NNRetriever
-from src.retrievers.retriever_pipeline import RetrieverPipeline
+from src.retrievers.dense_retriever import (
+    BaseDenseRetriever, NNRetriever, IndexRetriever
+)
+from src.vector_indexes.vector_index import (
+    BaseIndex, BaseVectorIndex, FlatIndex, IVFIndex
+)
+from src.vector_indexes.quantized_index import QuantizedIndex
+from src.vector_indexes.compaction import IndexCompactor
+from src.vector_indexes.quantizers import get_quantizer
+from src.retrievers.sparse_retriever import BM25Retriever
+from src.retrievers.hybrid_retriever import HybridRetriever
+from src.vector_indexes.bm25_index import BM25Index
+from src.retrievers.retriever_pipeline import (
+    BaseRetrieverPipeline, HybridRetrieverPipeline, RetrieverPipeline
+)
 from src.agents.agent import RAGAgent
-from src.retrievers.reranker import Reranker
-from src.models import DeleteResponse
+from mistralai import Mistral
+from src.retrievers.reranker import CachedReranker, Reranker
+from src.models import (
+    BulkDeleteRequest, BulkDeleteResponse, DeleteResponse
+)
 import asyncio
-from typing import List
+from typing import Dict, List, Optional, Union
 
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 
+# "nn" searches with the MongoDB aggregation pipeline, "ivf" and "flat"
+# with an in-process approximate or exact index under VECTOR_INDEX_DIR
+DENSE_RETRIEVER = os.getenv("DENSE_RETRIEVER", "ivf")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "indexes")
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_EXACT_SEARCH_THRESHOLD = int(
+    os.getenv("IVF_EXACT_SEARCH_THRESHOLD", "5000"))
+# compression codec of the vector index ("none", "int8" or "pq"),
+# with per-database overrides given as JSON: {"tenant1": "pq"}
+VECTOR_CODEC = os.getenv("VECTOR_CODEC", "none")
+VECTOR_CODECS: Dict[str, str] = json.loads(os.getenv("VECTOR_CODECS", "{}"))
+# "array" stores embeddings as BSON arrays of doubles,
+# "binary" as normalized float32 bytes
+EMBEDDING_FORMAT = os.getenv("EMBEDDING_FORMAT", "array")
+# size and overlap in tokens of the chunks, applied to the stored
+# documents by /reindex/ when they change
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "128"))
+# "approximate" windows of words, or "sentence" to pack whole sentences,
+# counting tokens with the tokenizer.json file CHUNK_TOKENIZER if set
+CHUNKER = os.getenv("CHUNKER", "approximate")
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER")
+# "embedded" vectors store a copy of the text of their chunk and of the
+# metadata of their document, "normalized" vectors only the span of their
+# chunk, resolved from the PARENT_DOCUMENT_CACHE_SIZE most recently used
+# documents of each tenant (not supported by STREAMING_INGESTION)
+VECTOR_LAYOUT = os.getenv("VECTOR_LAYOUT", "embedded")
+PARENT_DOCUMENT_CACHE_SIZE = int(
+    os.getenv("PARENT_DOCUMENT_CACHE_SIZE", "64"))
+# number of vectors written per insert_many on upload
+VECTOR_BATCH_SIZE = int(os.getenv("VECTOR_BATCH_SIZE", "500"))
+# number of documents deleted per delete_many by /delete/bulk/
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "500"))
+# deleted vectors are masked in the in-process indexes, which are compacted
+# every INDEX_COMPACTION_INTERVAL seconds once INDEX_COMPACTION_THRESHOLD
+# of their vectors are deleted
+INDEX_COMPACTION_INTERVAL = float(
+    os.getenv("INDEX_COMPACTION_INTERVAL", "60"))
+INDEX_COMPACTION_THRESHOLD = float(
+    os.getenv("INDEX_COMPACTION_THRESHOLD", "0.1"))
+# fuse the dense results with BM25 results of an in-process sparse index
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+# cache of query embeddings, in process and optionally shared by the
+# replicas through the CACHE_DB_NAME database ("memory" or "mongodb")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", "3600"))
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "memory")
+CACHE_DB_NAME = os.getenv("CACHE_DB_NAME", "cache")
+# maximum number of concurrent calls of each embedder to Cohere
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+# seconds after which the retrieval order is kept instead of reranking
+RERANK_TIMEOUT = float(os.getenv("RERANK_TIMEOUT", "3"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "1024"))
+# answers of /generate/ are returned again for queries of the same tenant
+# and filter whose embedding has a cosine similarity of at least
+# ANSWER_CACHE_THRESHOLD, until a document they cite is deleted or
+# re-indexed by any worker. ANSWER_CACHE_SIZE=0 disables the cache
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_MEMORY_MB = int(
+    os.getenv("ANSWER_CACHE_MAX_MEMORY_MB", "64"))
+# seconds after which a call to the Mistral API is abandoned
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# knowledge base queries of one turn of the agent run at the same time,
+# at most AGENT_TOOL_CONCURRENCY at a time
+AGENT_TOOL_CONCURRENCY = int(os.getenv("AGENT_TOOL_CONCURRENCY", "4"))
+# estimated tokens of the retrieved chunks sent to the model in a chat,
+# above which the lowest ranked chunks are left out (0 for no limit)
+AGENT_CONTEXT_TOKENS = int(os.getenv("AGENT_CONTEXT_TOKENS", "6000"))
+# PDFs are parsed by PARSER_WORKERS worker processes, or in a thread of
+# the server if 0, within PARSER_TIMEOUT seconds and PARSER_MEMORY_LIMIT_MB
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", "2"))
+PARSER_TIMEOUT = float(os.getenv("PARSER_TIMEOUT", "60"))
+PARSER_MEMORY_LIMIT_MB = int(os.getenv("PARSER_MEMORY_LIMIT_MB", "2048"))
+# spool uploads to disk and overlap parsing, chunking, embedding and
+# writing page by page, with EMBED_BATCH_SIZE chunks per embedding call
+STREAMING_INGESTION = \
+    os.getenv("STREAMING_INGESTION", "false").lower() == "true"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "96"))
+# chunks are embedded in sub-batches of at most EMBED_BATCH_SIZE chunks
+# and EMBED_BATCH_TOKENS estimated tokens, EMBED_BATCH_CONCURRENCY at a
+# time per document
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "0")) or None
+EMBED_BATCH_CONCURRENCY = int(os.getenv("EMBED_BATCH_CONCURRENCY", "4"))
+# persistent store of the embeddings of chunks, keyed by model and content,
+# in the CACHE_DB_NAME database ("mongodb"), in the SQLite file
+# CHUNK_EMBEDDING_STORE_PATH ("disk") or disabled ("none")
+CHUNK_EMBEDDING_STORE = os.getenv("CHUNK_EMBEDDING_STORE", "mongodb")
+CHUNK_EMBEDDING_STORE_PATH = os.getenv(
+    "CHUNK_EMBEDDING_STORE_PATH", "chunk_embeddings.sqlite")
+# files uploaded with background=true are indexed by INGESTION_WORKERS
+# workers, and rejected when INGESTION_QUEUE_SIZE files are waiting
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "4"))
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", "1000"))
+# maximum number of files indexed at once by the uploads of a worker
+# that are not sent to the background
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+
 
 class AppState(State):
-    mongodb_client: AsyncIOMotorClient
-    database: AsyncIOMotorDatabase
+    registry: ComponentRegistry
+
+
+@typechecked
+def get_registry(request: Request) -> ComponentRegistry:
+    """
+    Dependency giving the endpoints the components shared by the requests
+    """
+    return request.app.state.registry
+
+
+@typechecked
+def get_mongodb_client(registry: ComponentRegistry) -> AsyncIOMotorClient:
+    return registry.get(
+        "mongodb_client",
+        lambda: AsyncIOMotorClient(os.getenv("MONGO_URI")))
+
+
+@typechecked
+def get_http_client(registry: ComponentRegistry) -> httpx.AsyncClient:
+    """
+    Keep-alive connections to the Cohere and Mistral APIs, shared by the
+    embedders, the reranker and the agents
+    """
+    return registry.get(
+        "http_client",
+        lambda: httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=4 * EMBEDDING_CONCURRENCY,
+                max_keepalive_connections=2 * EMBEDDING_CONCURRENCY,
+                keepalive_expiry=60
+            )
+        )
+    )
+
+
+@typechecked
+def make_parser() -> BaseParser:
+    if PARSER_WORKERS > 0:
+        return ProcessPoolPDFParser(
+            max_workers=PARSER_WORKERS,
+            timeout=PARSER_TIMEOUT,
+            memory_limit_mb=PARSER_MEMORY_LIMIT_MB
+        )
+    return AdvancedPDFParser()
+
+
+@typechecked
+def get_parser(registry: ComponentRegistry) -> BaseParser:
+    return registry.get("parser", make_parser)
+
+
+@typechecked
+def get_job_queue(registry: ComponentRegistry) -> FairJobQueue:
+    return registry.get(
+        "job_queue",
+        lambda: FairJobQueue(
+            functools.partial(run_ingestion_job, registry),
+            num_workers=INGESTION_WORKERS,
+            max_pending=INGESTION_QUEUE_SIZE
+        )
+    )
+
+
+@typechecked
+def get_upload_semaphore(registry: ComponentRegistry) -> asyncio.Semaphore:
+    return registry.get(
+        "upload_semaphore",
+        lambda: asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    )
+
+
+@typechecked
+def get_index_compactor(registry: ComponentRegistry) -> IndexCompactor:
+    return registry.get(
+        "index_compactor",
+        lambda: IndexCompactor(
+            lambda: [
+                *registry.find_all("vector_index").values(),
+                *registry.find_all("sparse_index").values()
+            ],
+            interval=INDEX_COMPACTION_INTERVAL,
+            min_deleted_fraction=INDEX_COMPACTION_THRESHOLD
+        )
+    )
 
 
 @typechecked
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    registry = ComponentRegistry()
+    app.state.registry = registry
     logging.info("Connecting to MongoDB")
-    app.state.mongodb_client = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+    registry.on_close(get_mongodb_client(registry).close)
+    registry.on_close(get_http_client(registry).aclose)
+    parser = get_parser(registry)
+    if isinstance(parser, ProcessPoolPDFParser):
+        registry.on_close(parser.shutdown)
+    job_queue = get_job_queue(registry)
+    job_queue.start()
+    index_compactor = get_index_compactor(registry)
+    index_compactor.start()
     yield
-    app.state.mongodb_client.close()
+    # the workers are stopped before the components they use are released
+    await index_compactor.stop()
+    await job_queue.stop()
+    await registry.aclose()
 
 
 app = FastAPI(lifespan=lifespan)
 app.state = AppState()
 
 
+@typechecked
+def make_cohere_embedder(
+    registry: ComponentRegistry,
+    max_retries: int = EMBEDDING_MAX_RETRIES
+) -> CohereDenseEmbedder:
+    return CohereDenseEmbedder(
+        api_key=os.getenv("COHERE_API_KEY", ""),
+        max_concurrency=EMBEDDING_CONCURRENCY,
+        max_retries=max_retries,
+        http_client=get_http_client(registry)
+    )
+
+
+@typechecked
+def get_document_embedder(registry: ComponentRegistry) -> BaseDenseEmbedder:
+    """
+    Return the app-wide embedder of chunks. Uploads share its concurrency
+    limit, and queries have their own embedder so that they do not wait
+    behind large uploads. Chunks found in the persistent store are not
+    embedded again.
+    """
+    # the sub-batches are retried by the batching embedder
+    document_embedder = registry.get(
+        "document_embedder",
+        lambda: BatchingDenseEmbedder(
+            make_cohere_embedder(registry, max_retries=0),
+            max_batch_size=EMBED_BATCH_SIZE,
+            max_batch_tokens=EMBED_BATCH_TOKENS,
+            max_concurrency=EMBED_BATCH_CONCURRENCY,
+            max_retries=EMBEDDING_MAX_RETRIES
+        )
+    )
+    if CHUNK_EMBEDDING_STORE == "none":
+        return document_embedder
+
+    def make_chunk_embedding_cache() -> ContentCachedDenseEmbedder:
+        backend: BaseCacheBackend
+        if CHUNK_EMBEDDING_STORE == "disk":
+            backend = SQLiteCacheBackend(CHUNK_EMBEDDING_STORE_PATH)
+            registry.on_close(backend.close)
+        else:
+            backend = MongoDBCacheBackend(
+                get_mongodb_client(registry)[CACHE_DB_NAME]
+                ["chunk_embeddings"])
+        return ContentCachedDenseEmbedder(document_embedder, backend)
+
+    return registry.get("chunk_embedding_cache", make_chunk_embedding_cache)
+
+
+@typechecked
+def get_query_embedder(registry: ComponentRegistry) -> CachedDenseEmbedder:
+    """
+    Return the app-wide embedder of queries, whose cache is shared
+    by all the requests
+    """
+    def make_query_embedder() -> CachedDenseEmbedder:
+        backend: Optional[BaseCacheBackend] = None
+        if EMBEDDING_CACHE_BACKEND == "mongodb":
+            backend = MongoDBCacheBackend(
+                get_mongodb_client(registry)[CACHE_DB_NAME]["embeddings"],
+                ttl_seconds=EMBEDDING_CACHE_TTL
+            )
+        return CachedDenseEmbedder(
+            make_cohere_embedder(registry),
+            max_size=EMBEDDING_CACHE_SIZE,
+            ttl_seconds=EMBEDDING_CACHE_TTL,
+            backend=backend
+        )
+
+    return registry.get("query_embedder", make_query_embedder)
+
+
+@typechecked
+def get_reranker(registry: ComponentRegistry) -> CachedReranker:
+    """
+    Return the app-wide reranker, whose cache is shared by all the requests
+    """
+    return registry.get(
+        "reranker",
+        lambda: CachedReranker(
+            Reranker(
+                cohere_api_key=os.getenv("COHERE_API_KEY", ""),
+                http_client=get_http_client(registry)
+            ),
+            max_size=RERANK_CACHE_SIZE
+        )
+    )
+
+
+@typechecked
+def get_answer_cache(
+    registry: ComponentRegistry,
+    db_name: str
+) -> Optional[SemanticAnswerCache]:
+    """
+    Return the cache of the answers of a tenant, if answers are cached
+    """
+    if ANSWER_CACHE_SIZE == 0:
+        return None
+    return registry.get(
+        "answer_cache",
+        lambda: SemanticAnswerCache(
+            get_query_embedder(registry),
+            similarity_threshold=ANSWER_CACHE_THRESHOLD,
+            max_size=ANSWER_CACHE_SIZE,
+            ttl_seconds=ANSWER_CACHE_TTL,
+            max_memory_bytes=ANSWER_CACHE_MAX_MEMORY_MB * 1024 * 1024
+        ),
+        key=db_name
+    )
+
+
+@typechecked
+async def get_synced_answer_cache(
+    registry: ComponentRegistry,
+    db_name: str
+) -> Optional[SemanticAnswerCache]:
+    """
+    Return the cache of the answers of a tenant, if answers are cached,
+    without the answers citing documents that any worker deleted or
+    re-indexed since
+    """
+    answer_cache = get_answer_cache(registry, db_name)
+    if answer_cache is not None:
+        database_handler = await get_database_handler(registry, db_name)
+        answer_cache.sync(*await database_handler.get_changes())
+    return answer_cache
+
+
+@typechecked
+def answer_scope(request: GenerateRequest) -> str:
+    # answers are only shared by requests with the same filter
+    return request.filter.model_dump_json() if request.filter else ""
+
+
+@typechecked
+async def cache_answer(
+    registry: ComponentRegistry,
+    request: GenerateRequest,
+    response: GenerateResponse,
+    version: int
+) -> None:
+    """
+    Cache an answer with the documents it cites, unless they changed
+    since version
+    """
+    answer_cache = await get_synced_answer_cache(registry, request.db_name)
+    if answer_cache is None:
+        return
+    database_handler = await get_database_handler(registry, request.db_name)
+    parent_ids = await database_handler.find_parent_ids([
+        vector_id
+        for query in response.queries
+        for vector_id in query.retrieved_ids
+    ])
+    await answer_cache.store(
+        request.query, response, parent_ids,
+        scope=answer_scope(request), version=version)
+
+
+@typechecked
+def get_mistral_client(registry: ComponentRegistry) -> Mistral:
+    """
+    Return the app-wide Mistral client, which reuses the connections of
+    the shared HTTP client
+    """
+    return registry.get(
+        "mistral_client",
+        lambda: Mistral(
+            api_key=os.getenv("MISTRAL_API_KEY", ""),
+            async_client=get_http_client(registry),
+            timeout_ms=int(LLM_TIMEOUT * 1000)
+        )
+    )
+
+
+@typechecked
+def get_chunk_resolver(
+    registry: ComponentRegistry,
+    db_name: str
+) -> ChunkResolver:
+    """
+    Resolver of the chunks of the normalized vectors of a tenant, whose
+    cache of parent documents is shared by the requests
+    """
+    return registry.get(
+        "chunk_resolver",
+        lambda: ChunkResolver(
+            get_mongodb_client(registry)[db_name]["documents"],
+            cache_size=PARENT_DOCUMENT_CACHE_SIZE
+        ),
+        key=db_name
+    )
+
+
+@typechecked
+async def get_vector_indexes(
+    registry: ComponentRegistry,
+    db_name: str
+) -> List[BaseVectorIndex]:
+    """
+    Return the in-process vector indexes of a tenant, loading them from disk
+    or building them from the vectors collection on first use
+    """
+    if DENSE_RETRIEVER == "nn":
+        return []
+
+    async def load_vector_index() -> BaseVectorIndex:
+        codec = VECTOR_CODECS.get(db_name, VECTOR_CODEC)
+        index_path = os.path.join(VECTOR_INDEX_DIR, db_name, DENSE_RETRIEVER)
+        vector_index: BaseVectorIndex = FlatIndex(path=index_path)
+        if codec != "none":
+            vector_index = QuantizedIndex(
+                path=os.path.join(
+                    VECTOR_INDEX_DIR, db_name, f"quantized-{codec}"),
+                quantizer=get_quantizer(codec)
+            )
+        elif DENSE_RETRIEVER == "ivf":
+            vector_index = IVFIndex(
+                path=index_path,
+                nprobe=IVF_NPROBE,
+                exact_search_threshold=IVF_EXACT_SEARCH_THRESHOLD
+            )
+        await vector_index.sync_with_collection(
+            get_mongodb_client(registry)[db_name]["vectors"],
+            chunk_resolver=get_chunk_resolver(registry, db_name))
+        return vector_index
+
+    return [
+        await registry.get_async("vector_index", load_vector_index, db_name)
+    ]
+
+
+@typechecked
+async def get_sparse_indexes(
+    registry: ComponentRegistry,
+    db_name: str
+) -> List[BM25Index]:
+    """
+    Return the in-process BM25 index of a tenant if hybrid search is enabled
+    """
+    if not HYBRID_SEARCH:
+        return []
+
+    async def load_sparse_index() -> BM25Index:
+        sparse_index = BM25Index(
+            path=os.path.join(VECTOR_INDEX_DIR, db_name, "bm25"))
+        await sparse_index.sync_with_collection(
+            get_mongodb_client(registry)[db_name]["vectors"],
+            chunk_resolver=get_chunk_resolver(registry, db_name))
+        return sparse_index
+
+    return [
+        await registry.get_async("sparse_index", load_sparse_index, db_name)
+    ]
+
+
+@typechecked
+async def get_indexes(
+    registry: ComponentRegistry,
+    db_name: str
+) -> List[BaseIndex]:
+    """
+    All the in-process indexes of a tenant, kept in sync on upload and delete
+    """
+    return [
+        *await get_vector_indexes(registry, db_name),
+        *await get_sparse_indexes(registry, db_name)
+    ]
+
+
+@typechecked
+async def get_database_handler(
+    registry: ComponentRegistry,
+    db_name: str
+) -> MongoDBHandler:
+    """
+    Return the handler of a tenant, shared by the requests, creating the
+    indexes of its collections and loading its in-process indexes on first
+    use
+    """
+    async def make_database_handler() -> MongoDBHandler:
+        database_handler = MongoDBHandler(
+            client=get_mongodb_client(registry),
+            db_name=db_name,
+            vector_collection_name="vectors",
+            doc_collection_name="documents",
+            indexes=await get_indexes(registry, db_name),
+            embedding_format=EMBEDDING_FORMAT,
+            vector_batch_size=VECTOR_BATCH_SIZE,
+            delete_batch_size=DELETE_BATCH_SIZE,
+            vector_layout=VECTOR_LAYOUT,
+            chunk_resolver=get_chunk_resolver(registry, db_name)
+        )
+        await database_handler.ensure_indexes()
+        return database_handler
+
+    return await registry.get_async(
+        "database_handler", make_database_handler, db_name)
+
+
+@typechecked
+async def get_retriever_pipeline(
+    registry: ComponentRegistry,
+    db_name: str
+) -> BaseRetrieverPipeline:
+    """
+    Return the retrieval pipeline of a tenant, shared by the requests
+    """
+    async def make_retriever_pipeline() -> BaseRetrieverPipeline:
+        database_handler = await get_database_handler(registry, db_name)
+        vector_collection = database_handler.vector_collection
+        # filters on the metadata of the vectors unless they are normalized
+        chunk_resolver = get_chunk_resolver(registry, db_name) \
+            if VECTOR_LAYOUT == "normalized" else None
+        vector_indexes = await get_vector_indexes(registry, db_name)
+        retriever: BaseDenseRetriever = NNRetriever(
+            vector_collection=vector_collection,
+            embedding_format=EMBEDDING_FORMAT,
+            chunk_resolver=chunk_resolver
+        )
+        if vector_indexes:
+            retriever = IndexRetriever(
+                vector_collection=vector_collection,
+                vector_index=vector_indexes[0],
+                chunk_resolver=chunk_resolver
+            )
+        embedder = get_query_embedder(registry)
+        reranker = get_reranker(registry)
+        sparse_indexes = await get_sparse_indexes(registry, db_name)
+        if sparse_indexes:
+            return HybridRetrieverPipeline(
+                embedder=embedder,
+                retriever=HybridRetriever(
+                    dense_retriever=retriever,
+                    sparse_retriever=BM25Retriever(
+                        vector_collection=vector_collection,
+                        bm25_index=sparse_indexes[0],
+                        chunk_resolver=chunk_resolver
+                    )
+                ),
+                reranker=reranker,
+                rerank_timeout=RERANK_TIMEOUT
+            )
+        return RetrieverPipeline(
+            embedder=embedder,
+            retriever=retriever,
+            reranker=reranker,
+            rerank_timeout=RERANK_TIMEOUT
+        )
+
+    return await registry.get_async(
+        "retriever_pipeline", make_retriever_pipeline, db_name)
+
+
+@typechecked
+def make_chunker() -> BaseChunker:
+    if CHUNKER == "sentence":
+        return SentenceChunker(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            count_tokens=load_token_counter(CHUNK_TOKENIZER)
+            if CHUNK_TOKENIZER else None
+        )
+    return ApproximateChunkerWithOverlap(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+
+
+@typechecked
+def get_chunker(registry: ComponentRegistry) -> BaseChunker:
+    """
+    Return the app-wide chunker, so that the tokenizer of CHUNK_TOKENIZER
+    is loaded once
+    """
+    return registry.get("chunker", make_chunker)
+
+
+@typechecked
+async def make_pdf_indexer(
+    registry: ComponentRegistry,
+    db_name: str
+) -> BaseIndexer:
+    chunker = get_chunker(registry)
+    database_handler = await get_database_handler(registry, db_name)
+    if STREAMING_INGESTION and VECTOR_LAYOUT != "normalized":
+        return StreamingPDFIndexer(
+            parser=StreamingPDFParser(),
+            chunker=chunker,
+            embedder=get_document_embedder(registry),
+            database_handler=database_handler,
+            embed_batch_size=EMBED_BATCH_SIZE
+        )
+    return PDFIndexer(
+        parser=get_parser(registry),
+        chunker=chunker,
+        embedder=get_document_embedder(registry),
+        database_handler=database_handler
+    )
+
+
+@typechecked
+async def run_ingestion_job(registry: ComponentRegistry, job: Job) -> str:
+    """
+    Index the file of a background upload, reporting its progress
+    """
+    pdf_indexer = await make_pdf_indexer(registry, job.status.db_name)
+    return await pdf_indexer.index_document(
+        job.upload_file(), progress=job.report)
+
+
 @typechecked
 @app.post("/upload/")
 async def upload_pdf(
     files: List[UploadFile],
-    db_name: str
+    db_name: str,
+    background: bool = False,
+    registry: ComponentRegistry = Depends(get_registry)
 ) -> List[UploadResponse]:
-    responses = []
-    try:
-        async def process_file(file: UploadFile) -> UploadResponse:
-            pdf_indexer = PDFIndexer(
-                parser=AdvancedPDFParser(),
-                chunker=ApproximateChunkerWithOverlap(
-                    chunk_size=512,
-                    chunk_overlap=128
-                ),
-                embedder=CohereDenseEmbedder(
-                    api_key=os.getenv("COHERE_API_KEY", "")
-                ),
-                database_handler=MongoDBHandler(
-                    client=app.state.mongodb_client,
-                    db_name=db_name,
-                    vector_collection_name="vectors",
-                    doc_collection_name="documents"
-                )
-            )
-            parent_document_id: str = await pdf_indexer.index_document(file)
-            return UploadResponse(
-                message="PDF uploaded successfully",
-                document_id=parent_document_id
+    """
+    Index the files, or with background=true queue them and return the
+    ids of their jobs at once
+    """
+    if background:
+        try:
+            statuses = [
+                await get_job_queue(registry).submit(db_name, file)
+                for file in files
+            ]
+        except QueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        return [
+            UploadResponse(
+                message="PDF queued for indexing",
+                job_id=status.job_id
             )
+            for status in statuses
+        ]
 
-        responses = await asyncio.gather(
-            *(process_file(file) for file in files))
-        return responses
-    except Exception as e:
-        logging.error("An error occurred:\n%s", traceback.format_exc())
-        raise HTTPException(status_code=500, detail=str(e))
+    semaphore = get_upload_semaphore(registry)
+    unparsed: List[UploadFile] = []
+
+    async def process_file(file: UploadFile) -> UploadResponse:
+        async with semaphore:
+            try:
+                pdf_indexer = await make_pdf_indexer(registry, db_name)
+                parent_document_id: str = await pdf_indexer.index_document(
+                    file)
+            except ParserError as e:
+                logging.error("Could not parse %s: %s", file.filename, e)
+                unparsed.append(file)
+                return UploadResponse(
+                    message="PDF could not be parsed", error=str(e))
+            except Exception as e:
+                logging.error(
+                    "An error occurred while indexing %s:\n%s",
+                    file.filename, traceback.format_exc()
+                )
+                return UploadResponse(
+                    message="PDF could not be indexed", error=str(e))
+        return UploadResponse(
+            message="PDF uploaded successfully",
+            document_id=parent_document_id
+        )
+
+    responses = await asyncio.gather(
+        *(process_file(file) for file in files))
+    if files and all(response.error is not None for response in responses):
+        # nothing was indexed, so the request failed as a whole
+        status_code = 422 if len(unparsed) == len(files) else 500
+        raise HTTPException(
+            status_code=status_code,
+            detail="; ".join(str(response.error) for response in responses)
+        )
+    return list(responses)
+
+
+@typechecked
+@app.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    registry: ComponentRegistry = Depends(get_registry)
+) -> JobStatus:
+    """
+    Stage, number of chunks and error of a background upload
+    """
+    status = get_job_queue(registry).get_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
 
 
 # delete endpoint
 @typechecked
 @app.delete("/delete/")
-async def delete_document(request: DeleteRequest) -> DeleteResponse:
+async def delete_document(
+    request: DeleteRequest,
+    registry: ComponentRegistry = Depends(get_registry)
+) -> DeleteResponse:
     try:
-        database_handler = MongoDBHandler(
-            app.state.mongodb_client,
-            db_name=request.db_name,
-            vector_collection_name="vectors",
-            doc_collection_name="documents"
-        )
-        await database_handler.delete_document(ObjectId(request.document_id))
+        database_handler = await get_database_handler(
+            registry, request.db_name)
+        document_id = ObjectId(request.document_id)
+        await database_handler.delete_document(document_id)
         return DeleteResponse(
             message="Document deleted"
         )
@@ -111,38 +804,226 @@ async def delete_document(request: DeleteRequest) -> DeleteResponse:
 
 
 @typechecked
-@app.post("/generate/")
-async def generate_answer(request: GenerateRequest) -> GenerateResponse:
+@app.delete("/delete/bulk/")
+async def delete_documents(
+    request: BulkDeleteRequest,
+    registry: ComponentRegistry = Depends(get_registry)
+) -> BulkDeleteResponse:
+    """
+    Delete many documents, or with all_documents=true all the documents of
+    the database, in batches of DELETE_BATCH_SIZE documents
+    """
+    if (request.document_ids is None) == (not request.all_documents):
+        raise HTTPException(
+            status_code=400,
+            detail="Give either document_ids or all_documents=true")
+    document_ids = []
+    for document_id in request.document_ids or []:
+        if not ObjectId.is_valid(document_id):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid document id: {document_id}")
+        document_ids.append(ObjectId(document_id))
     try:
-        mongo_handler = MongoDBHandler(
-            client=app.state.mongodb_client,
-            db_name=request.db_name,
-            vector_collection_name="vectors",
-            doc_collection_name="documents"
+        database_handler = await get_database_handler(
+            registry, request.db_name)
+        if request.all_documents:
+            deleted = await database_handler.delete_all_documents()
+        else:
+            deleted = await database_handler.delete_documents(document_ids)
+        return BulkDeleteResponse(
+            message="Documents deleted",
+            deleted_documents=deleted
         )
-        agent = RAGAgent(
-            retriever_pipeline=RetrieverPipeline(
-                embedder=CohereDenseEmbedder(
-                    api_key=os.getenv("COHERE_API_KEY", "")
-                ),
-                retriever=NNRetriever(
-                    vector_collection=mongo_handler.vector_collection,
-                ),
-                reranker=Reranker(
-                    cohere_api_key=os.getenv("COHERE_API_KEY", "")
-                )
-            ),
-            mistral_api_key=os.getenv("MISTRAL_API_KEY", ""),
-            model="mistral-large-latest"
+    except Exception as e:
+        logging.error("An error occurred:\n%s", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@typechecked
+@app.post("/reindex/")
+async def reindex(
+    request: ReindexRequest,
+    registry: ComponentRegistry = Depends(get_registry)
+) -> ReindexResponse:
+    """
+    Re-chunk the stored text of a document, or of all the documents of a
+    database, and embed only the chunks that changed
+    """
+    document_ids = None
+    if request.document_id is not None:
+        if not ObjectId.is_valid(request.document_id):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid document id: {request.document_id}")
+        document_ids = [ObjectId(request.document_id)]
+    try:
+        reindexer = Reindexer(
+            chunker=get_chunker(registry),
+            embedder=get_document_embedder(registry),
+            database_handler=await get_database_handler(
+                registry, request.db_name)
         )
+        return await reindexer.reindex(document_ids)
+    except Exception as e:
+        logging.error("An error occurred:\n%s", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@typechecked
+async def make_rag_agent(
+    registry: ComponentRegistry,
+    request: GenerateRequest
+) -> RAGAgent:
+    # the agent holds the filter of the request, and is cheap to create
+    # around the shared pipeline and client
+    return RAGAgent(
+        retriever_pipeline=await get_retriever_pipeline(
+            registry, request.db_name),
+        mistral_api_key=os.getenv("MISTRAL_API_KEY", ""),
+        model="mistral-large-latest",
+        search_filter=request.filter,
+        client=get_mistral_client(registry),
+        max_concurrent_tool_calls=AGENT_TOOL_CONCURRENCY,
+        max_context_tokens=AGENT_CONTEXT_TOKENS or None
+    )
+
+
+@typechecked
+@app.post("/generate/")
+async def generate_answer(
+    request: GenerateRequest,
+    registry: ComponentRegistry = Depends(get_registry)
+) -> GenerateResponse:
+    try:
+        answer_cache = await get_synced_answer_cache(
+            registry, request.db_name)
+        version = 0
+        if answer_cache is not None:
+            cached = await answer_cache.lookup(
+                request.query, scope=answer_scope(request))
+            if cached is not None:
+                # no prompt was sent to answer this request
+                return cached.model_copy(update={"prompt_tokens": 0})
+            version = answer_cache.version
+        agent = await make_rag_agent(registry, request)
         response: GenerateResponse = await agent.chat(
             query=request.query,
         )
+        if answer_cache is not None:
+            await cache_answer(registry, request, response, version)
         return response
     except Exception as e:
         logging.error("An error occurred:\n%s", traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@typechecked
+def format_event(event: GenerateEvent) -> str:
+    """
+    Server-sent event of a step of the agent
+    """
+    data = event.model_dump_json(exclude_none=True)
+    return f"event: {event.event}\ndata: {data}\n\n"
+
+
+@typechecked
+@app.post("/generate/stream/")
+async def generate_answer_stream(
+    request: GenerateRequest,
+    registry: ComponentRegistry = Depends(get_registry)
+) -> StreamingResponse:
+    """
+    Stream the steps of the agent as server-sent events: its queries to
+    the knowledge base and the ids they retrieved, then the answer token
+    by token, and finally the whole response with its queries
+    """
+    try:
+        answer_cache = await get_synced_answer_cache(
+            registry, request.db_name)
+        cached: Optional[GenerateResponse] = None
+        version = 0
+        if answer_cache is not None:
+            cached = await answer_cache.lookup(
+                request.query, scope=answer_scope(request))
+            if cached is not None:
+                cached = cached.model_copy(update={"prompt_tokens": 0})
+            version = answer_cache.version
+        agent = await make_rag_agent(registry, request) \
+            if cached is None else None
+    except Exception as e:
+        logging.error("An error occurred:\n%s", traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events() -> AsyncIterator[str]:
+        if agent is None:
+            assert cached is not None
+            # the whole answer as a single token, so that clients that
+            # only read the tokens get it too
+            yield format_event(
+                GenerateEvent(event="token", token=cached.response))
+            yield format_event(GenerateEvent(event="done", response=cached))
+            return
+        try:
+            async for event in agent.chat_stream(request.query):
+                yield format_event(event)
+                if event.response is not None and answer_cache is not None:
+                    await cache_answer(
+                        registry, request, event.response, version)
+        except Exception as e:
+            # the status was already sent with the first event
+            logging.error("An error occurred:\n%s", traceback.format_exc())
+            yield format_event(GenerateEvent(event="error", error=str(e)))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@typechecked
+@app.get("/stats/")
+async def get_stats(
+    registry: ComponentRegistry = Depends(get_registry)
+) -> Dict[str, Dict[str, Union[int, float]]]:
+    """
+    Hit and miss counters of the caches of this process, and counters of
+    the embedding calls of uploads
+    """
+    stats: Dict[str, Dict[str, Union[int, float]]] = {}
+    for kind, name in [
+        ("query_embedder", "query_embedding_cache"),
+        ("reranker", "rerank_cache"),
+        ("document_embedder", "document_embedding"),
+        ("chunk_embedding_cache", "chunk_embedding_cache"),
+    ]:
+        component = registry.find(kind)
+        if component is not None:
+            stats[name] = component.stats()
+    answer_cache_stats = [
+        answer_cache.stats()
+        for answer_cache in registry.find_all("answer_cache").values()
+    ]
+    if answer_cache_stats:
+        stats["answer_cache"] = {
+            key: sum(counters[key] for counters in answer_cache_stats)
+            for key in answer_cache_stats[0]
+        }
+    resolver_stats = [
+        resolver.stats()
+        for resolver in registry.find_all("chunk_resolver").values()
+    ]
+    if resolver_stats:
+        stats["parent_document_cache"] = {
+            key: sum(counters[key] for counters in resolver_stats)
+            for key in resolver_stats[0]
+        }
+    stats["ingestion_jobs"] = {**get_job_queue(registry).stats()}
+    stats["index_compaction"] = {**get_index_compactor(registry).stats()}
+    stats["registry"] = {**registry.stats()}
+    return stats
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
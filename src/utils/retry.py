@@ -0,0 +1,91 @@
+# retry of calls to external APIs with exponential backoff and jitter
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, Optional, TypeVar
+import httpx
+from typeguard import typechecked
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# rate limited or temporarily unavailable
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+@typechecked
+def get_status_code(error: BaseException) -> Optional[int]:
+    """
+    HTTP status code of an error raised by an API client, if any
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(
+            getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+@typechecked
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """
+    Delay in seconds requested by the Retry-After header of an error
+    """
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+@typechecked
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    return get_status_code(error) in RETRYABLE_STATUS_CODES
+
+
+@typechecked
+async def retry_async(
+    call: Callable[[], Awaitable[T]],
+    max_retries: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    should_retry: Callable[[BaseException], bool] = is_retryable
+) -> T:
+    """
+    Await call() until it succeeds, retrying errors for which should_retry
+    is true. The delay before the n-th retry is drawn uniformly between 0
+    and base_delay * 2**n ("full jitter"), so that clients that were rate
+    limited together do not retry together, and is at least the delay
+    requested by a Retry-After header.
+
+    Args:
+        call (Callable[[], Awaitable[T]]): Coroutine function to call.
+        max_retries (int): Maximum number of retries.
+        base_delay (float): Upper bound of the first delay in seconds.
+        max_delay (float): Upper bound of all the delays in seconds.
+        should_retry (Callable[[BaseException], bool]): Whether an error
+            is transient.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            if attempt >= max_retries or not should_retry(e):
+                raise
+            delay = random.uniform(
+                0, min(max_delay, base_delay * 2 ** attempt))
+            retry_after = get_retry_after(e)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, max_delay))
+            logger.warning(
+                "Retrying after error (attempt %d/%d, %.2fs): %s",
+                attempt + 1, max_retries, delay, e
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,318 @@
+# in-process BM25 inverted index of the chunks of a tenant
+import heapq
+import math
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from typeguard import typechecked
+from src.embedders.sparse_embedder import (
+    BaseSparseEmbedder, BM25SparseEmbedder
+)
+from src.models import Vector
+from src.vector_indexes.index_storage import IndexStorage
+from src.vector_indexes.vector_index import BaseIndex
+
+
+@typechecked
+class BM25Index(BaseIndex):
+    build_projection = {"_id": 0, "vector_embedding": 0}
+
+    def __init__(
+        self,
+        path: str,
+        embedder: Optional[BaseSparseEmbedder] = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        max_segments: int = 16
+    ):
+        """
+        BM25 inverted index. The term statistics (document frequencies,
+        document lengths and average length) are updated incrementally as
+        chunks are added and removed.
+
+        The index is persisted as JSON segments: each save writes a segment
+        with the chunks added since the previous save, and the ids of the
+        removed chunks are kept in the manifest until the segments are
+        merged.
+
+        Args:
+            path (str): Directory where the index is persisted.
+            embedder (Optional[BaseSparseEmbedder]): Tokenizer of the chunks
+                and queries.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+            max_segments (int): Maximum number of segments before merging.
+        """
+        self.storage = IndexStorage(path)
+        self.embedder = embedder or BM25SparseEmbedder()
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        self.clear()
+        self._replace = False
+
+    def clear(self) -> None:
+        with self._lock:
+            # forward index: vector_id -> term frequencies
+            self._documents: Dict[str, Dict[str, int]] = {}
+            self._parents: Dict[str, str] = {}
+            self._parent_vectors: Dict[str, Set[str]] = {}
+            # inverted index: term -> {vector_id: term frequency}
+            self._postings: Dict[str, Dict[str, int]] = {}
+            self._lengths: Dict[str, int] = {}
+            self._total_length = 0
+            self._segments: List[str] = []
+            # vector ids added since the last save
+            self._pending: Dict[str, None] = {}
+            # vector ids removed from the saved segments
+            self._deleted: Set[str] = set()
+            # vector ids and documents removed since the last save, also
+            # removed from the segments saved in the meantime by other
+            # workers
+            self._removed: Set[str] = set()
+            self._removed_parents: Set[str] = set()
+            # the next save replaces the snapshot of the other workers
+            # instead of merging with it
+            self._replace = True
+            self._dirty = False
+            self._manifest_mtime: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, vectors: List[Vector]) -> None:
+        with self._lock:
+            for vector in vectors:
+                self._index(
+                    vector.vector_id,
+                    vector.parent_id,
+                    self.embedder.embed_document(vector.text)
+                )
+                self._pending[vector.vector_id] = None
+                # a re-added chunk is saved again in the next segment
+                self._deleted.discard(vector.vector_id)
+                self._removed.discard(vector.vector_id)
+            self._dirty = self._dirty or bool(vectors)
+
+    def remove_document(self, parent_id: str) -> None:
+        with self._lock:
+            for vector_id in list(self._parent_vectors.get(parent_id, ())):
+                self._unindex(vector_id)
+                if vector_id in self._pending:
+                    del self._pending[vector_id]
+                else:
+                    self._deleted.add(vector_id)
+                    self._removed.add(vector_id)
+            self._removed_parents.add(parent_id)
+            self._dirty = True
+
+    def num_deleted(self) -> int:
+        return len(self._deleted)
+
+    def compact(self) -> None:
+        """
+        Merge the segments, dropping the removed chunks
+        """
+        with self._lock, self.storage.lock():
+            self._rebase()
+            if not self._deleted:
+                return
+            self._segments = [self.storage.write_json(
+                "segment", self._segment_data(list(self._documents)))]
+            self._deleted = set()
+            self._pending = {}
+            self._dirty = True
+            self.save()
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        candidate_ids: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Return (vector_id, BM25 score) of the top k chunks.
+        If candidate_ids is given, only those chunks are scored.
+        """
+        self._maybe_reload()
+        with self._lock:
+            n = len(self._documents)
+            if n == 0:
+                return []
+            average_length = self._total_length / n
+            scores: Dict[str, float] = {}
+            for term in self.embedder.embed_query(query):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                matches: Iterable[Tuple[str, int]] = postings.items()
+                if candidate_ids is not None and \
+                        len(candidate_ids) < len(postings):
+                    # look up the few candidates instead of the postings
+                    matches = [
+                        (v, postings[v]) for v in candidate_ids
+                        if v in postings
+                    ]
+                elif candidate_ids is not None:
+                    matches = [
+                        (v, tf) for v, tf in matches if v in candidate_ids
+                    ]
+                for vector_id, tf in matches:
+                    length_norm = 1 - self.b + \
+                        self.b * self._lengths[vector_id] / average_length
+                    scores[vector_id] = scores.get(vector_id, 0.0) + \
+                        idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(vector_id, float(score)) for vector_id, score in best]
+
+    def save(self) -> None:
+        with self._lock, self.storage.lock():
+            if not self._dirty and self._manifest_mtime is not None:
+                return
+            replaced = self._rebase()
+            if len(self._segments) >= self.max_segments or \
+                    len(self._deleted) > len(self._documents):
+                # merge all the segments and drop the removed chunks
+                self._segments = [self.storage.write_json(
+                    "segment", self._segment_data(list(self._documents)))]
+                self._deleted = set()
+            elif self._pending:
+                self._segments.append(self.storage.write_json(
+                    "segment", self._segment_data(list(self._pending))))
+            self.storage.write_manifest({
+                "type": "bm25",
+                "count": len(self._documents),
+                "segments": self._segments,
+                "deleted": sorted(self._deleted),
+            })
+            self.storage.remove_unreferenced(self._segments, replaced)
+            self._pending = {}
+            self._removed = set()
+            self._removed_parents = set()
+            self._replace = False
+            self._manifest_mtime = self.storage.manifest_mtime()
+            self._dirty = False
+
+    def load(self) -> bool:
+        manifest_mtime = self.storage.manifest_mtime()
+        manifest = self.storage.read_manifest()
+        if manifest is None or manifest.get("type") != "bm25":
+            return False
+        with self._lock:
+            self._load_manifest(manifest, manifest_mtime)
+        return True
+
+    def _load_manifest(
+        self,
+        manifest: Dict[str, Any],
+        manifest_mtime: Optional[int]
+    ) -> None:
+        segments: List[str] = manifest["segments"]
+        if not set(self._segments).issubset(segments):
+            # the segments were merged, so everything is reloaded
+            self.clear()
+        for file_name in segments:
+            if file_name not in self._segments:
+                self._load_segment(file_name)
+        self._deleted = set(manifest["deleted"])
+        for vector_id in self._deleted:
+            if vector_id in self._documents:
+                self._unindex(vector_id)
+        self._segments = list(segments)
+        self._replace = False
+        self._manifest_mtime = manifest_mtime
+
+    def _rebase(self) -> List[str]:
+        """
+        Load the segments saved by other workers since this process last
+        loaded or saved the index, and re-apply the changes of this process
+        to them. Returns the files of the snapshot on disk.
+        Called with the storage lock held.
+        """
+        manifest_mtime = self.storage.manifest_mtime()
+        manifest = self.storage.read_manifest()
+        if manifest is None or manifest.get("type") != "bm25":
+            return []
+        replaced: List[str] = list(manifest["segments"])
+        if self._replace or manifest_mtime == self._manifest_mtime:
+            return replaced
+        pending = self._segment_data(list(self._pending))
+        for vector_id in pending:
+            self._unindex(vector_id)
+        removed = self._removed
+        removed_parents = self._removed_parents
+        self._load_manifest(manifest, manifest_mtime)
+        for vector_id in removed:
+            if vector_id in self._documents:
+                self._unindex(vector_id)
+        for parent_id in removed_parents:
+            for vector_id in list(self._parent_vectors.get(parent_id, ())):
+                self._unindex(vector_id)
+                removed.add(vector_id)
+        self._deleted |= removed
+        self._removed = removed
+        self._removed_parents = removed_parents
+        for vector_id, document in pending.items():
+            self._index(vector_id, document["parent_id"], document["terms"])
+        self._pending = dict.fromkeys(pending)
+        self._dirty = True
+        return replaced
+
+    def _maybe_reload(self) -> None:
+        """
+        Pick up segments saved by another worker process, unless this
+        process has changes that have not been saved yet
+        """
+        if self._dirty:
+            return
+        manifest_mtime = self.storage.manifest_mtime()
+        if manifest_mtime is not None and \
+                manifest_mtime != self._manifest_mtime:
+            self.load()
+
+    def _index(
+        self,
+        vector_id: str,
+        parent_id: str,
+        terms: Dict[str, int]
+    ) -> None:
+        if vector_id in self._documents:
+            self._unindex(vector_id)
+        self._documents[vector_id] = terms
+        self._parents[vector_id] = parent_id
+        self._parent_vectors.setdefault(parent_id, set()).add(vector_id)
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[vector_id] = tf
+        length = sum(terms.values())
+        self._lengths[vector_id] = length
+        self._total_length += length
+
+    def _unindex(self, vector_id: str) -> None:
+        terms = self._documents.pop(vector_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[vector_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(vector_id)
+        parent_id = self._parents.pop(vector_id)
+        parent_vectors = self._parent_vectors[parent_id]
+        parent_vectors.discard(vector_id)
+        if not parent_vectors:
+            del self._parent_vectors[parent_id]
+
+    def _segment_data(self, vector_ids: List[str]) -> Dict[str, Any]:
+        return {
+            vector_id: {
+                "parent_id": self._parents[vector_id],
+                "terms": self._documents[vector_id],
+            }
+            for vector_id in vector_ids if vector_id in self._documents
+        }
+
+    def _load_segment(self, file_name: str) -> None:
+        data: Dict[str, Any] = self.storage.load_json(file_name)
+        for vector_id, document in data.items():
+            self._index(vector_id, document["parent_id"], document["terms"])
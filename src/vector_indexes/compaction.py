@@ -0,0 +1,74 @@
+# background compaction of the vectors removed from the in-process indexes
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+from typeguard import typechecked
+from src.vector_indexes.vector_index import BaseIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+@typechecked
+class IndexCompactor:
+    def __init__(
+        self,
+        get_indexes: Callable[[], List[BaseIndex]],
+        interval: float = 60.0,
+        min_deleted_fraction: float = 0.1
+    ):
+        """
+        Periodically compacts the in-process indexes, whose removed vectors
+        are only masked, so that deletes never rewrite an index.
+
+        Args:
+            get_indexes (Callable[[], List[BaseIndex]]): Indexes of all the
+                tenants loaded by this process.
+            interval (float): Seconds between two checks.
+            min_deleted_fraction (float): Fraction of the vectors of an
+                index that must be masked for it to be compacted.
+        """
+        self.get_indexes = get_indexes
+        self.interval = interval
+        self.min_deleted_fraction = min_deleted_fraction
+        self.compactions = 0
+        self._task: Optional[asyncio.Task[Any]] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def compact_once(self) -> int:
+        """
+        Compact the indexes with enough masked vectors, in a thread.
+        Returns the number of compacted indexes.
+        """
+        compacted = 0
+        for index in self.get_indexes():
+            deleted = index.num_deleted()
+            if deleted and deleted >= \
+                    self.min_deleted_fraction * (len(index) + deleted):
+                await asyncio.to_thread(index.compact)
+                compacted += 1
+        self.compactions += compacted
+        return compacted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "compactions": self.compactions,
+            "deleted": sum(
+                index.num_deleted() for index in self.get_indexes()),
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.compact_once()
+            except Exception:
+                logger.error("Index compaction failed", exc_info=True)
@@ -0,0 +1,145 @@
+# recall of the approximate and compressed indexes against exact search
+# usage: python -m src.vector_indexes.evaluation tenant1 --settings int8 pq
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Dict, List, Union
+import numpy as np
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from typeguard import typechecked
+from src.database_handlers.embedding_codec import decode_embedding
+from src.vector_indexes.quantized_index import QuantizedIndex
+from src.vector_indexes.quantizers import get_quantizer
+from src.vector_indexes.vector_index import (
+    BaseVectorIndex, FlatIndex, IVFIndex
+)
+
+
+load_dotenv()
+
+
+@typechecked
+def recall_at_k(
+    index: BaseVectorIndex,
+    reference_index: BaseVectorIndex,
+    queries: np.ndarray,
+    k: int = 10
+) -> float:
+    """
+    Average fraction of the top k vectors of the reference index
+    that are also in the top k vectors of the index
+    """
+    recalls = []
+    for query in queries:
+        expected = {v for v, _ in reference_index.search(query.tolist(), k)}
+        if not expected:
+            continue
+        found = {v for v, _ in index.search(query.tolist(), k)}
+        recalls.append(len(expected & found) / len(expected))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+@typechecked
+def mean_latency_ms(
+    index: BaseVectorIndex,
+    queries: np.ndarray,
+    k: int = 10
+) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query.tolist(), k)
+    return 1000 * (time.perf_counter() - start) / max(1, len(queries))
+
+
+@typechecked
+def make_index(setting: str, path: str) -> BaseVectorIndex:
+    """
+    Index for an evaluated setting: "ivf", "ivf:<nprobe>" or a codec name
+    """
+    if setting.startswith("ivf"):
+        _, _, nprobe = setting.partition(":")
+        return IVFIndex(
+            path=path, nprobe=int(nprobe or 8), exact_search_threshold=0)
+    return QuantizedIndex(path=path, quantizer=get_quantizer(setting))
+
+
+@typechecked
+async def evaluate_settings(
+    vector_collection: AsyncIOMotorCollection,
+    settings: List[str],
+    k: int = 10,
+    num_queries: int = 100
+) -> List[Dict[str, Union[str, float]]]:
+    """
+    Report recall@k and latency of each setting against exact search,
+    using a random sample of the stored vectors as queries
+    """
+    docs = vector_collection.aggregate([
+        {"$sample": {"size": num_queries}},
+        {"$project": {"vector_embedding": 1}}
+    ])
+    queries = np.asarray([
+        decode_embedding(doc["vector_embedding"]) async for doc in docs
+    ], dtype=np.float32)
+
+    reports: List[Dict[str, Union[str, float]]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        exact_index = FlatIndex(path=os.path.join(directory, "exact"))
+        await exact_index.build_from_collection(vector_collection)
+        reports.append({
+            "setting": "exact",
+            "recall": 1.0,
+            "latency_ms": mean_latency_ms(exact_index, queries, k),
+        })
+        for setting in settings:
+            index = make_index(setting, os.path.join(directory, setting))
+            await index.build_from_collection(vector_collection)
+            report: Dict[str, Union[str, float]] = {
+                "setting": setting,
+                "recall": recall_at_k(index, exact_index, queries, k),
+                "latency_ms": mean_latency_ms(index, queries, k),
+            }
+            if isinstance(index, QuantizedIndex):
+                usage = index.memory_usage()
+                report["compression"] = \
+                    usage["embeddings"] / max(1, usage["codes"])
+            reports.append(report)
+    return reports
+
+
+async def main(
+    db_name: str,
+    settings: List[str],
+    k: int,
+    num_queries: int
+) -> None:
+    client: AsyncIOMotorClient = AsyncIOMotorClient(os.getenv("MONGO_URI"))
+    try:
+        reports = await evaluate_settings(
+            client[db_name]["vectors"], settings, k, num_queries)
+    finally:
+        client.close()
+    print(f"{'setting':<12}{f'recall@{k}':>12}{'latency ms':>12}"
+          f"{'compression':>13}")
+    for report in reports:
+        compression = report.get("compression")
+        print(
+            f"{report['setting']:<12}{report['recall']:>12.3f}"
+            f"{report['latency_ms']:>12.2f}"
+            f"{f'{compression:.1f}x' if compression else '-':>13}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare vector index settings against exact search")
+    parser.add_argument("db_name")
+    parser.add_argument(
+        "--settings", nargs="+", default=["int8", "pq", "ivf"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--num-queries", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.db_name, args.settings, args.k, args.num_queries))
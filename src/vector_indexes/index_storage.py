@@ -0,0 +1,147 @@
+# on-disk storage for in-process indexes
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, Iterable, Iterator, Optional, Set, TextIO
+import numpy as np
+from typeguard import typechecked
+
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".lock"
+
+
+@typechecked
+class IndexStorage:
+    """
+    Stores the arrays of an index as immutable .npy files plus a
+    manifest.json that lists the files of the current snapshot.
+
+    Files are never modified once written: a new snapshot writes new files
+    and then atomically replaces the manifest, so readers in other worker
+    processes always see a consistent snapshot. Writers hold lock() while
+    they read, merge and replace the manifest, so that the snapshots of
+    several worker processes do not overwrite each other.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # files written by this process that may still be referenced
+        self._written: Set[str] = set()
+        self._thread_lock = threading.RLock()
+        self._lock_file: Optional[TextIO] = None
+        self._lock_depth = 0
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.path, MANIFEST_NAME)
+
+    def manifest_mtime(self) -> Optional[int]:
+        """
+        Modification time of the manifest in ns, or None if there is none
+        """
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest: Dict[str, Any] = json.load(f)
+                return manifest
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        """
+        Exclusive lock of the index across the worker processes of a host,
+        reentrant within this process
+        """
+        with self._thread_lock:
+            if self._lock_depth == 0:
+                os.makedirs(self.path, exist_ok=True)
+                lock_file = open(os.path.join(self.path, LOCK_NAME), "a")
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                except BaseException:
+                    lock_file.close()
+                    raise
+                self._lock_file = lock_file
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def write_manifest(self, manifest: Dict[str, Any]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def write_array(self, name: str, array: np.ndarray) -> str:
+        """
+        Write an array to a new uniquely named file and return the file name
+        """
+        os.makedirs(self.path, exist_ok=True)
+        file_name = f"{name}-{uuid.uuid4().hex}.npy"
+        np.save(os.path.join(self.path, file_name), array, allow_pickle=False)
+        self._written.add(file_name)
+        return file_name
+
+    def write_json(self, name: str, data: Any) -> str:
+        """
+        Write JSON data to a new uniquely named file and return the file name
+        """
+        os.makedirs(self.path, exist_ok=True)
+        file_name = f"{name}-{uuid.uuid4().hex}.json"
+        with open(os.path.join(self.path, file_name), "w") as f:
+            json.dump(data, f)
+        self._written.add(file_name)
+        return file_name
+
+    def load_json(self, file_name: str) -> Any:
+        with open(os.path.join(self.path, file_name), "r") as f:
+            return json.load(f)
+
+    def load_array(self, file_name: str, mmap: bool = False) -> np.ndarray:
+        array: np.ndarray = np.load(
+            os.path.join(self.path, file_name),
+            mmap_mode="r" if mmap else None,
+            allow_pickle=False
+        )
+        return array
+
+    def remove_unreferenced(
+        self,
+        keep: Iterable[str],
+        replaced: Iterable[str] = ()
+    ) -> None:
+        """
+        Remove the files written by this process, and the files of the
+        replaced snapshot, that are not part of the current snapshot.
+        Files written by other workers are only removed once a snapshot
+        that listed them is replaced, so that a snapshot being written by
+        another worker keeps its files.
+        Workers that still have an old file memory-mapped keep reading it
+        until they reload, since unlinking does not invalidate the mapping.
+        """
+        keep_set = set(keep)
+        for file_name in (self._written | set(replaced)) - keep_set:
+            try:
+                os.remove(os.path.join(self.path, file_name))
+            except FileNotFoundError:
+                pass
+        self._written &= keep_set
@@ -0,0 +1,137 @@
+# flat index searched on compressed codes and rescored at full precision
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from typeguard import typechecked
+from src.vector_indexes.quantizers import BaseQuantizer
+from src.vector_indexes.vector_index import (
+    FlatIndex, normalize_rows, top_k_indices
+)
+
+
+@typechecked
+class QuantizedIndex(FlatIndex):
+    def __init__(
+        self,
+        path: str,
+        quantizer: BaseQuantizer,
+        rescore_factor: int = 4,
+        min_train_size: int = 1000,
+        train_sample_size: int = 20000,
+        retrain_growth_factor: float = 4.0,
+        max_segments: int = 16,
+        seed: int = 0
+    ):
+        """
+        Index that keeps compressed codes of the embeddings in memory.
+        A query scores the codes, and the rescore_factor * k best candidates
+        are rescored against the full-precision embeddings, which stay in
+        memory-mapped segments on disk.
+
+        Args:
+            path (str): Directory where the index is persisted.
+            quantizer (BaseQuantizer): Codec used to compress the embeddings.
+            rescore_factor (int): Number of candidates rescored per result.
+            min_train_size (int): Below this number of vectors the index is
+                not compressed and queries use exact search.
+            train_sample_size (int): Number of vectors used for training.
+            retrain_growth_factor (float): Re-train the quantizer once the
+                index grows by this factor since the last training.
+            max_segments (int): Maximum number of segments before merging.
+            seed (int): Seed for sampling the training vectors.
+        """
+        self.quantizer = quantizer
+        self.index_type = f"quantized-{quantizer.name}"
+        self.rescore_factor = rescore_factor
+        self.min_train_size = min_train_size
+        self.train_sample_size = train_sample_size
+        self.retrain_growth_factor = retrain_growth_factor
+        self.seed = seed
+        self._trained_size = 0
+        self._quantizer_files: Dict[str, str] = {}
+        super().__init__(path, max_segments=max_segments)
+
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int = 10,
+        candidate_ids: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        segments = self._searchable_segments(candidate_ids)
+        if not segments:
+            return []
+        query = normalize_rows(np.asarray(query_embedding))
+        # approximate scores from the codes, exact scores for the segments
+        # that are not compressed yet
+        scores = np.concatenate([
+            self.quantizer.score(s.codes, query) if s.codes is not None
+            else s.embeddings @ query
+            for s in segments
+        ])
+        candidates = top_k_indices(scores, self._mask_deleted(
+            segments, scores, k * self.rescore_factor))
+        locate = self._locator(segments)
+        rescored = []
+        for i in candidates:
+            segment, row = locate(int(i))
+            rescored.append((
+                segment.vector_ids[row],
+                float(segment.embeddings[row] @ query)
+            ))
+        rescored.sort(key=lambda hit: -hit[1])
+        return rescored[:k]
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes of the codes kept in memory and of the full-precision
+        embeddings kept on disk
+        """
+        return {
+            "codes": sum(
+                s.codes.nbytes for s in self._segments if s.codes is not None),
+            "embeddings": sum(
+                np.asarray(s.embeddings).nbytes for s in self._segments),
+        }
+
+    def _before_save(self) -> None:
+        n = len(self)
+        if n < self.min_train_size:
+            return
+        if not self.quantizer.is_trained or \
+                n > self.retrain_growth_factor * self._trained_size:
+            self._train()
+            self._segments = [s.with_codes(None) for s in self._segments]
+        self._segments = [
+            s.with_codes(self.quantizer.encode(np.asarray(s.embeddings)))
+            if s.codes is None and len(s) > 0 else s
+            for s in self._segments
+        ]
+
+    def _train(self) -> None:
+        self.quantizer.train(
+            self._sample_rows(self.train_sample_size, self.seed))
+        self._trained_size = len(self)
+        self._quantizer_files = {}
+
+    def _extra_manifest(self) -> Dict[str, Any]:
+        if not self.quantizer.is_trained:
+            return {}
+        if not self._quantizer_files:
+            self._quantizer_files = {
+                key: self.storage.write_array(f"quantizer_{key}", array)
+                for key, array in self.quantizer.get_state().items()
+            }
+        return {
+            "trained_size": self._trained_size,
+            "extra_files": self._quantizer_files,
+        }
+
+    def _load_extra_manifest(self, manifest: Dict[str, Any]) -> None:
+        files: Dict[str, str] = manifest.get("extra_files", {})
+        if not files or files == self._quantizer_files:
+            return
+        self.quantizer.set_state({
+            key: self.storage.load_array(file_name)
+            for key, file_name in files.items()
+        })
+        self._quantizer_files = files
+        self._trained_size = manifest["trained_size"]
@@ -0,0 +1,233 @@
+# vector compression codecs for the in-process indexes
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+import numpy as np
+from typeguard import typechecked
+
+
+# number of rows decoded at a time when scoring codes,
+# to bound the temporary memory used by a query
+SCORE_BLOCK_SIZE = 16384
+
+
+@typechecked
+def kmeans(
+    data: np.ndarray,
+    n_clusters: int,
+    iterations: int = 10,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    Euclidean k-means. Returns the (n_clusters, dim) centroids.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)]
+    for _ in range(iterations):
+        assignments = assign_to_centroids(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # keep the previous centroid for empty clusters
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+    return centroids
+
+
+@typechecked
+def assign_to_centroids(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Index of the closest centroid of each row:
+    argmin ||x - c||^2 = argmax (x.c - ||c||^2 / 2)
+    """
+    half_norms = 0.5 * np.sum(centroids * centroids, axis=1)
+    assignments: np.ndarray = np.argmax(
+        data @ centroids.T - half_norms, axis=1)
+    return assignments
+
+
+@typechecked
+class BaseQuantizer(ABC):
+    name: str
+
+    @property
+    @abstractmethod
+    def is_trained(self) -> bool:
+        pass
+
+    @abstractmethod
+    def train(self, embeddings: np.ndarray) -> None:
+        """Learn the codec parameters from a sample of embeddings"""
+        pass
+
+    @abstractmethod
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """Compress the embeddings into codes"""
+        pass
+
+    @abstractmethod
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate dot product between the query and each code"""
+        pass
+
+    @abstractmethod
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to persist the trained codec"""
+        pass
+
+    @abstractmethod
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        pass
+
+    @abstractmethod
+    def code_size(self, dimension: int) -> int:
+        """Number of bytes of the code of one vector"""
+        pass
+
+
+@typechecked
+class ScalarQuantizer(BaseQuantizer):
+    """
+    int8 scalar quantization with one scale per dimension.
+    Codes are 4x smaller than float32 embeddings.
+    """
+    name = "int8"
+
+    def __init__(self) -> None:
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.scale is not None
+
+    def train(self, embeddings: np.ndarray) -> None:
+        max_abs = np.abs(np.asarray(embeddings, dtype=np.float32)).max(axis=0)
+        self.scale = np.maximum(max_abs, 1e-12) / 127
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        assert self.scale is not None
+        codes: np.ndarray = np.clip(
+            np.rint(embeddings / self.scale), -127, 127).astype(np.int8)
+        return codes
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        assert self.scale is not None
+        scaled_query = (query * self.scale).astype(np.float32)
+        return np.concatenate([
+            codes[i:i + SCORE_BLOCK_SIZE].astype(np.float32) @ scaled_query
+            for i in range(0, len(codes), SCORE_BLOCK_SIZE)
+        ] or [np.zeros(0, dtype=np.float32)])
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        assert self.scale is not None
+        return {"scale": self.scale}
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.scale = state["scale"]
+
+    def code_size(self, dimension: int) -> int:
+        return dimension
+
+
+@typechecked
+class ProductQuantizer(BaseQuantizer):
+    """
+    Product quantization: the embedding is split into num_subspaces
+    sub-vectors, and each one is replaced by the 1-byte index of its
+    closest centroid. With the default of 8 dimensions per subspace the
+    codes are 32x smaller than float32 embeddings.
+    """
+    name = "pq"
+
+    def __init__(
+        self,
+        num_subspaces: Optional[int] = None,
+        kmeans_iterations: int = 10,
+        seed: int = 0
+    ):
+        """
+        Args:
+            num_subspaces (Optional[int]): Number of sub-vectors. Must divide
+                the dimension. Defaults to dimension / 8.
+            kmeans_iterations (int): Number of k-means iterations.
+            seed (int): Seed for the k-means initialization.
+        """
+        self.num_subspaces = num_subspaces
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        # (num_subspaces, num_centroids, subspace dimension)
+        self.codebooks: Optional[np.ndarray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.codebooks is not None
+
+    def train(self, embeddings: np.ndarray) -> None:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        n, dimension = embeddings.shape
+        num_subspaces = self.num_subspaces or max(1, dimension // 8)
+        if dimension % num_subspaces != 0:
+            raise ValueError(
+                f"{num_subspaces} subspaces do not divide "
+                f"dimension {dimension}"
+            )
+        num_centroids = min(256, n)
+        subvectors = embeddings.reshape(n, num_subspaces, -1)
+        self.codebooks = np.stack([
+            kmeans(
+                subvectors[:, j],
+                num_centroids,
+                iterations=self.kmeans_iterations,
+                seed=self.seed + j
+            )
+            for j in range(num_subspaces)
+        ])
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        assert self.codebooks is not None
+        num_subspaces = len(self.codebooks)
+        subvectors = np.asarray(embeddings, dtype=np.float32).reshape(
+            len(embeddings), num_subspaces, -1)
+        codes = np.stack([
+            assign_to_centroids(subvectors[:, j], self.codebooks[j])
+            for j in range(num_subspaces)
+        ], axis=1)
+        return codes.astype(np.uint8)
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        assert self.codebooks is not None
+        num_subspaces = len(self.codebooks)
+        # lookup table of the dot products between each sub-query
+        # and the centroids of its subspace
+        lookup = np.einsum(
+            "jcd,jd->jc",
+            self.codebooks,
+            query.reshape(num_subspaces, -1)
+        ).astype(np.float32)
+        subspaces = np.arange(num_subspaces)
+        return np.concatenate([
+            lookup[subspaces, codes[i:i + SCORE_BLOCK_SIZE]].sum(axis=1)
+            for i in range(0, len(codes), SCORE_BLOCK_SIZE)
+        ] or [np.zeros(0, dtype=np.float32)])
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        assert self.codebooks is not None
+        return {"codebooks": self.codebooks}
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.codebooks = state["codebooks"]
+
+    def code_size(self, dimension: int) -> int:
+        return self.num_subspaces or max(1, dimension // 8)
+
+
+@typechecked
+def get_quantizer(codec: str) -> BaseQuantizer:
+    """
+    Quantizer for a codec name: "int8" or "pq"
+    """
+    if codec == ScalarQuantizer.name:
+        return ScalarQuantizer()
+    if codec == ProductQuantizer.name:
+        return ProductQuantizer()
+    raise ValueError(f"Unknown vector codec: {codec}")
@@ -0,0 +1,839 @@
+# in-process vector indexes that mirror the vectors collection of a tenant
+from abc import ABC, abstractmethod
+import asyncio
+import threading
+from typing import (
+    Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+)
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorCollection
+from typeguard import typechecked
+from src.models import Vector
+from src.database_handlers.chunk_resolver import ChunkResolver
+from src.database_handlers.embedding_codec import vector_from_document
+from src.vector_indexes.index_storage import IndexStorage
+
+
+@typechecked
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize the rows of a matrix so that cosine similarity
+    becomes a dot product. Zero rows are left as zeros.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    normalized: np.ndarray = matrix / norms
+    return normalized
+
+
+@typechecked
+def rows_of(row_of: Dict[str, int], vector_ids: Set[str]) -> np.ndarray:
+    """
+    Sorted rows of the vector ids found in a vector_id -> row mapping,
+    iterating over the smaller of the two
+    """
+    if len(vector_ids) < len(row_of):
+        rows = [row_of[v] for v in vector_ids if v in row_of]
+    else:
+        rows = [row for v, row in row_of.items() if v in vector_ids]
+    return np.array(sorted(rows), dtype=np.int64)
+
+
+@typechecked
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, sorted by decreasing score
+    """
+    if k <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    order: np.ndarray = candidates[np.argsort(-scores[candidates])]
+    return order
+
+
+@typechecked
+class BaseIndex(ABC):
+    """
+    In-process index derived from the vector collection of a tenant,
+    kept in sync by the database handler
+    """
+    # fields of the vector collection needed to build the index
+    build_projection: Dict[str, int] = {"_id": 0}
+
+    @abstractmethod
+    def add(self, vectors: List[Vector]) -> None:
+        """Add vectors to the index"""
+        pass
+
+    @abstractmethod
+    def remove_document(self, parent_id: str) -> None:
+        """Remove all the vectors of a parent document"""
+        pass
+
+    def remove_documents(self, parent_ids: List[str]) -> None:
+        """Remove all the vectors of the parent documents"""
+        for parent_id in parent_ids:
+            self.remove_document(parent_id)
+
+    def num_deleted(self) -> int:
+        """
+        Number of removed vectors that are only masked, until the index
+        is compacted. Indexes that remove vectors at once have none.
+        """
+        return 0
+
+    def compact(self) -> None:
+        """
+        Drop the masked vectors from the index and save it. Indexes that
+        remove vectors at once have nothing to do.
+        """
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove all the vectors from the index"""
+        pass
+
+    @abstractmethod
+    def save(self) -> None:
+        """Persist the index to disk"""
+        pass
+
+    @abstractmethod
+    def load(self) -> bool:
+        """Load the index from disk. Returns False if there is none."""
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    async def build_from_collection(
+        self,
+        vector_collection: AsyncIOMotorCollection,
+        batch_size: int = 1000,
+        chunk_resolver: Optional[ChunkResolver] = None
+    ) -> None:
+        """
+        Rebuild the index from all the vectors stored in the collection.
+        The chunks of normalized vectors are resolved by chunk_resolver.
+        """
+        self.clear()
+        batch: List[Mapping[str, Any]] = []
+
+        async def add_batch() -> None:
+            docs = batch
+            if chunk_resolver is not None:
+                docs = await chunk_resolver.resolve(docs)
+            self.add([vector_from_document(doc) for doc in docs])
+
+        cursor = vector_collection.find({}, self.build_projection)
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await add_batch()
+                batch = []
+        if batch:
+            await add_batch()
+        await asyncio.to_thread(self.save)
+
+    async def sync_with_collection(
+        self,
+        vector_collection: AsyncIOMotorCollection,
+        chunk_resolver: Optional[ChunkResolver] = None
+    ) -> None:
+        """
+        Load the persisted index, rebuilding it from the collection
+        if it does not exist yet or is out of date
+        """
+        loaded = await asyncio.to_thread(self.load)
+        count = await vector_collection.count_documents({})
+        if loaded and len(self) == count:
+            return
+        await self.build_from_collection(
+            vector_collection, chunk_resolver=chunk_resolver)
+
+
+@typechecked
+class BaseVectorIndex(BaseIndex):
+    @abstractmethod
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int = 10,
+        candidate_ids: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Return (vector_id, cosine similarity) of the top k vectors.
+        If candidate_ids is given, only those vectors are scored.
+        """
+        pass
+
+
+@typechecked
+class _Segment:
+    """
+    Immutable block of vectors stored in its own .npy files, with optional
+    codes of its embeddings: compressed codes, or the clusters of its rows.
+    The vectors removed since the segment was written are masked by alive
+    until the index is compacted. The mask is saved in its own file, listed
+    under "alive" in files, since masking the rows of a document by its
+    parent_id would also mask the vectors it gets when it is re-indexed.
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        vector_ids: List[str],
+        parent_ids: List[str],
+        files: Dict[str, str],
+        codes: Optional[np.ndarray] = None
+    ):
+        self.embeddings = embeddings
+        self.vector_ids = vector_ids
+        self.parent_ids = parent_ids
+        self.files = files
+        self.codes = codes
+        self.alive: Optional[np.ndarray] = None
+        self._row_of: Optional[Dict[str, int]] = None
+        self._parent_rows: Optional[Dict[str, List[int]]] = None
+        self._code_lists: Optional[List[np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self.vector_ids)
+
+    def num_alive(self) -> int:
+        return len(self) if self.alive is None else int(self.alive.sum())
+
+    def rows_of(self, vector_ids: Set[str]) -> np.ndarray:
+        if self._row_of is None:
+            self._row_of = {v: i for i, v in enumerate(self.vector_ids)}
+        rows = rows_of(self._row_of, vector_ids)
+        if self.alive is not None:
+            rows = rows[self.alive[rows]]
+        return rows
+
+    def delete_parent(self, parent_id: str) -> bool:
+        """
+        Mask the rows of a document. Returns False if it has none left.
+        """
+        if self._parent_rows is None:
+            parent_rows: Dict[str, List[int]] = {}
+            for row, p in enumerate(self.parent_ids):
+                parent_rows.setdefault(p, []).append(row)
+            self._parent_rows = parent_rows
+        rows = self._parent_rows.get(parent_id)
+        if not rows:
+            return False
+        alive = self.alive if self.alive is not None \
+            else np.ones(len(self), dtype=bool)
+        if not alive[rows].any():
+            return False
+        # a new mask, so that searches in progress keep a consistent one
+        alive = alive.copy()
+        alive[rows] = False
+        self.alive = alive
+        # the saved mask is out of date
+        self.files = {
+            key: file_name for key, file_name in self.files.items()
+            if key != "alive"
+        }
+        return True
+
+    def code_lists(self, num_codes: int) -> List[np.ndarray]:
+        """
+        Rows of the segment with each code, for codes that are clusters
+        """
+        if self._code_lists is None:
+            assert self.codes is not None
+            order = np.argsort(self.codes, kind="stable")
+            counts = np.bincount(self.codes, minlength=num_codes)
+            self._code_lists = np.split(order, np.cumsum(counts)[:-1])
+        return self._code_lists
+
+    def with_codes(self, codes: Optional[np.ndarray]) -> "_Segment":
+        """
+        Unsaved copy of the segment with new codes, and the same masked rows
+        """
+        copy = _Segment(
+            embeddings=self.embeddings,
+            vector_ids=self.vector_ids,
+            parent_ids=self.parent_ids,
+            files={},
+            codes=codes
+        )
+        copy.alive = self.alive
+        return copy
+
+    def take(self, rows: np.ndarray) -> "_Segment":
+        """
+        New unsaved segment with the given rows
+        """
+        return _Segment(
+            embeddings=np.asarray(self.embeddings[rows]),
+            vector_ids=[self.vector_ids[row] for row in rows],
+            parent_ids=[self.parent_ids[row] for row in rows],
+            files={},
+            codes=self.codes[rows] if self.codes is not None else None
+        )
+
+    def select(self, keep: np.ndarray) -> "_Segment":
+        """
+        New unsaved segment with the rows where keep is True
+        """
+        return _Segment(
+            embeddings=np.asarray(self.embeddings[keep]),
+            vector_ids=[v for v, k in zip(self.vector_ids, keep) if k],
+            parent_ids=[p for p, k in zip(self.parent_ids, keep) if k],
+            files={},
+            codes=self.codes[keep] if self.codes is not None else None
+        )
+
+
+@typechecked
+class FlatIndex(BaseVectorIndex):
+    index_type = "flat"
+
+    def __init__(self, path: str, max_segments: int = 16):
+        """
+        Exact index: the embeddings of a tenant are kept as contiguous
+        float32 matrices and a query is a matrix-vector product followed
+        by argpartition.
+
+        The matrices are stored as memory-mapped .npy segments, so all the
+        worker processes of a host share one page-cache copy of them. Each
+        save appends a segment with the vectors added since the previous
+        save, and segments are merged once there are more than max_segments.
+
+        Args:
+            path (str): Directory where the index is persisted.
+            max_segments (int): Maximum number of segments before merging.
+        """
+        self.storage = IndexStorage(path)
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        self.clear()
+        self._replace = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._segments: List[_Segment] = []
+            self._pending: List[Vector] = []
+            # documents removed since the last save, also removed from the
+            # segments saved in the meantime by other workers
+            self._removed_parents: Set[str] = set()
+            self._removed_segments = False
+            # the next save replaces the snapshot of the other workers
+            # instead of merging with it
+            self._replace = True
+            self._manifest_mtime: Optional[int] = None
+
+    def __len__(self) -> int:
+        return sum(s.num_alive() for s in self._segments) + \
+            len(self._pending)
+
+    def num_deleted(self) -> int:
+        return sum(len(s) - s.num_alive() for s in self._segments)
+
+    @property
+    def _dirty(self) -> bool:
+        return bool(self._pending) or bool(self._removed_parents) or \
+            self._removed_segments
+
+    def add(self, vectors: List[Vector]) -> None:
+        with self._lock:
+            self._pending.extend(vectors)
+
+    def remove_document(self, parent_id: str) -> None:
+        """
+        Mask the rows of the document in the saved segments, which are
+        only rewritten when the index is compacted
+        """
+        with self._lock:
+            self._pending = [
+                v for v in self._pending if v.parent_id != parent_id]
+            self._removed_parents.add(parent_id)
+            for segment in self._segments:
+                segment.delete_parent(parent_id)
+
+    def compact(self) -> None:
+        with self._lock, self.storage.lock():
+            self._rebase()
+            if not self.num_deleted():
+                return
+            self._segments = [
+                segment.select(segment.alive)
+                if segment.alive is not None else segment
+                for segment in self._segments
+                if segment.num_alive() > 0
+            ]
+            self._removed_segments = True
+            self.save()
+
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int = 10,
+        candidate_ids: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        segments = self._searchable_segments(candidate_ids)
+        if not segments:
+            return []
+        query = normalize_rows(np.asarray(query_embedding))
+        scores = np.concatenate([s.embeddings @ query for s in segments])
+        best = top_k_indices(scores, self._mask_deleted(segments, scores, k))
+        locate = self._locator(segments)
+        results = []
+        for i in best:
+            segment, row = locate(int(i))
+            results.append((segment.vector_ids[row], float(scores[i])))
+        return results
+
+    def save(self) -> None:
+        with self._lock, self.storage.lock():
+            if not self._dirty and self._manifest_mtime is not None:
+                return
+            replaced = self._rebase()
+            if self._pending:
+                self._segments.append(self._pending_segment())
+                self._pending = []
+            if len(self._segments) > self.max_segments:
+                self._segments = [self._merge(self._segments)]
+            self._before_save()
+            segments = []
+            for segment in self._segments:
+                if not segment.files:
+                    # re-open the new segment memory-mapped
+                    segment = self._load_segment(
+                        self._write_segment(segment))
+                elif segment.alive is not None and \
+                        "alive" not in segment.files:
+                    segment.files = {
+                        **segment.files,
+                        "alive": self.storage.write_array(
+                            "alive", segment.alive),
+                    }
+                segments.append(segment)
+            self._segments = segments
+            extra_manifest = self._extra_manifest()
+            self.storage.write_manifest({
+                "type": self.index_type,
+                "count": len(self),
+                "segments": [segment.files for segment in self._segments],
+                **extra_manifest
+            })
+            self.storage.remove_unreferenced(
+                [f for s in self._segments for f in s.files.values()] +
+                list(extra_manifest.get("extra_files", {}).values()),
+                replaced
+            )
+            self._manifest_mtime = self.storage.manifest_mtime()
+            self._removed_parents = set()
+            self._removed_segments = False
+            self._replace = False
+
+    def load(self) -> bool:
+        manifest_mtime = self.storage.manifest_mtime()
+        manifest = self.storage.read_manifest()
+        if manifest is None or manifest.get("type") != self.index_type:
+            return False
+        with self._lock:
+            # only open the segments this process has not mapped yet
+            loaded = {s.files["embeddings"]: s for s in self._segments}
+            self.clear()
+            self._load_extra_manifest(manifest)
+            segments = []
+            for files in manifest["segments"]:
+                segment = loaded.get(files["embeddings"])
+                if segment is None:
+                    segment = self._load_segment(files)
+                elif segment.files != files:
+                    # rows were removed by another worker
+                    segment.alive = self.storage.load_array(files["alive"]) \
+                        if "alive" in files else None
+                    segment.files = files
+                segments.append(segment)
+            self._segments = segments
+            self._replace = False
+            self._manifest_mtime = manifest_mtime
+        return True
+
+    def _rebase(self) -> List[str]:
+        """
+        Merge the segments and the masks saved by other workers since this
+        process last loaded or saved the index, and return the files of
+        the snapshot on disk. Called with the storage lock held.
+        """
+        manifest_mtime = self.storage.manifest_mtime()
+        manifest = self.storage.read_manifest()
+        if manifest is None or manifest.get("type") != self.index_type:
+            return []
+        replaced = [
+            f for files in manifest["segments"] for f in files.values()
+        ] + list(manifest.get("extra_files", {}).values())
+        if self._replace or manifest_mtime == self._manifest_mtime:
+            return replaced
+        self._load_extra_manifest(manifest)
+        ours = {s.files["embeddings"]: s for s in self._segments if s.files}
+        segments = []
+        for files in manifest["segments"]:
+            segment = ours.get(files["embeddings"])
+            if segment is None:
+                segment = self._load_segment(files)
+                for parent_id in self._removed_parents:
+                    segment.delete_parent(parent_id)
+            elif "alive" in files and \
+                    files["alive"] != segment.files.get("alive"):
+                # rows removed by another worker, and maybe by this one
+                theirs = self.storage.load_array(files["alive"])
+                alive = theirs if segment.alive is None \
+                    else theirs & segment.alive
+                segment.alive = alive
+                segment.files = files if np.array_equal(alive, theirs) else {
+                    key: file_name for key, file_name in files.items()
+                    if key != "alive"
+                }
+            segments.append(segment)
+        # the segments of this process that are not on disk anymore were
+        # merged by another worker, which saved the rows they had left
+        self._segments = segments
+        self._manifest_mtime = manifest_mtime
+        return replaced
+
+    def _maybe_reload(self) -> None:
+        """
+        Pick up segments saved by another worker process, unless this
+        process has changes that have not been saved yet
+        """
+        if self._dirty:
+            return
+        manifest_mtime = self.storage.manifest_mtime()
+        if manifest_mtime is not None and \
+                manifest_mtime != self._manifest_mtime:
+            self.load()
+
+    def _searchable_segments(
+        self,
+        candidate_ids: Optional[Set[str]] = None
+    ) -> List[_Segment]:
+        """
+        Saved segments plus a temporary segment with the unsaved vectors.
+        If candidate_ids is given, the segments only keep those vectors.
+        """
+        self._maybe_reload()
+        with self._lock:
+            segments = list(self._segments)
+            if self._pending:
+                segments.append(self._pending_segment())
+        if candidate_ids is not None:
+            segments = [s.take(s.rows_of(candidate_ids)) for s in segments]
+        return [s for s in segments if len(s) > 0]
+
+    @staticmethod
+    def _locator(
+        segments: List[_Segment]
+    ) -> Callable[[int], Tuple[_Segment, int]]:
+        """
+        Map a row of the concatenated segments to (segment, row in segment)
+        """
+        offsets = np.cumsum([0] + [len(s) for s in segments])
+
+        def locate(i: int) -> Tuple[_Segment, int]:
+            segment_index = int(np.searchsorted(offsets, i, side="right")) - 1
+            return segments[segment_index], int(i - offsets[segment_index])
+        return locate
+
+    @staticmethod
+    def _mask_deleted(
+        segments: List[_Segment],
+        scores: np.ndarray,
+        k: int
+    ) -> int:
+        """
+        Set the scores of the masked rows of the concatenated segments to
+        -inf, and return the number of results that can be returned
+        """
+        if all(s.alive is None for s in segments):
+            return k
+        alive = np.concatenate([
+            s.alive if s.alive is not None else np.ones(len(s), dtype=bool)
+            for s in segments
+        ])
+        scores[~alive] = -np.inf
+        return min(k, int(alive.sum()))
+
+    def _sample_rows(self, sample_size: int, seed: int) -> np.ndarray:
+        """
+        Embeddings of a random sample of the rows of the segments that are
+        not masked, to train on
+        """
+        live_rows = np.flatnonzero(np.concatenate([
+            s.alive if s.alive is not None else np.ones(len(s), dtype=bool)
+            for s in self._segments
+        ]))
+        rng = np.random.default_rng(seed)
+        sample = live_rows[np.sort(rng.choice(
+            len(live_rows), min(len(live_rows), sample_size), replace=False))]
+        offsets = np.cumsum([0] + [len(s) for s in self._segments])
+        bounds = np.searchsorted(sample, offsets)
+        return np.vstack([
+            np.asarray(
+                segment.embeddings[sample[start:end] - offset],
+                dtype=np.float32)
+            for segment, offset, start, end in zip(
+                self._segments, offsets, bounds[:-1], bounds[1:])
+        ])
+
+    def _before_save(self) -> None:
+        """Hook for subclasses, called before the segments are written"""
+        pass
+
+    def _extra_manifest(self) -> Dict[str, Any]:
+        """
+        Hook for subclasses to persist state besides the segments.
+        Files listed under "extra_files" are kept on disk.
+        """
+        return {}
+
+    def _load_extra_manifest(self, manifest: Dict[str, Any]) -> None:
+        """Hook for subclasses to load the state of _extra_manifest"""
+        pass
+
+    def _pending_segment(self) -> _Segment:
+        return _Segment(
+            embeddings=normalize_rows(
+                np.asarray([v.vector_embedding for v in self._pending])),
+            vector_ids=[v.vector_id for v in self._pending],
+            parent_ids=[v.parent_id for v in self._pending],
+            files={}
+        )
+
+    def _merge(self, segments: List[_Segment]) -> _Segment:
+        segments = [
+            s.select(s.alive) if s.alive is not None else s
+            for s in segments if s.num_alive() > 0
+        ]
+        if not segments:
+            return _Segment(np.zeros((0, 0), dtype=np.float32), [], [], {})
+        codes = None
+        if all(s.codes is not None for s in segments):
+            codes = np.concatenate([s.codes for s in segments])
+        return _Segment(
+            embeddings=np.vstack([s.embeddings for s in segments]),
+            vector_ids=[v for s in segments for v in s.vector_ids],
+            parent_ids=[p for s in segments for p in s.parent_ids],
+            files={},
+            codes=codes
+        )
+
+    def _write_segment(self, segment: _Segment) -> Dict[str, str]:
+        files = {
+            "embeddings": self.storage.write_array(
+                "embeddings", np.asarray(segment.embeddings)),
+            "vector_ids": self.storage.write_array(
+                "vector_ids", np.array(segment.vector_ids, dtype=str)),
+            "parent_ids": self.storage.write_array(
+                "parent_ids", np.array(segment.parent_ids, dtype=str)),
+        }
+        if segment.codes is not None:
+            files["codes"] = self.storage.write_array("codes", segment.codes)
+        if segment.alive is not None:
+            files["alive"] = self.storage.write_array("alive", segment.alive)
+        return files
+
+    def _load_segment(self, files: Dict[str, str]) -> _Segment:
+        segment = _Segment(
+            embeddings=self.storage.load_array(
+                files["embeddings"], mmap=True),
+            vector_ids=self.storage.load_array(
+                files["vector_ids"]).tolist(),
+            parent_ids=self.storage.load_array(
+                files["parent_ids"]).tolist(),
+            files=files,
+            # codes are small and kept in memory
+            codes=self.storage.load_array(files["codes"])
+            if "codes" in files else None
+        )
+        if "alive" in files:
+            segment.alive = self.storage.load_array(files["alive"])
+        return segment
+
+
+@typechecked
+class IVFIndex(FlatIndex):
+    index_type = "ivf"
+
+    def __init__(
+        self,
+        path: str,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        exact_search_threshold: int = 5000,
+        kmeans_iterations: int = 10,
+        retrain_growth_factor: float = 4.0,
+        max_segments: int = 16,
+        seed: int = 0
+    ):
+        """
+        Inverted file index: vectors are clustered with k-means and a query
+        only scores the vectors of the nprobe closest clusters.
+
+        The vectors are stored in the segments of FlatIndex, with the
+        cluster of each row as its codes, so that a save only writes the
+        vectors added since the previous one. The clusters are trained
+        when the index is saved or compacted, never by a query, and the
+        vectors that are not assigned to a cluster yet are scored exactly.
+
+        Args:
+            path (str): Directory where the index is persisted.
+            nlist (Optional[int]): Number of clusters. Defaults to
+                sqrt(number of vectors).
+            nprobe (int): Number of clusters scored per query. Higher values
+                increase recall at the cost of latency.
+            exact_search_threshold (int): Below this number of vectors the
+                index is not clustered and queries use exact search.
+            kmeans_iterations (int): Number of k-means iterations.
+            retrain_growth_factor (float): Re-cluster once the index grows
+                by this factor since the last training.
+            max_segments (int): Maximum number of segments before merging.
+            seed (int): Seed for the k-means initialization.
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.exact_search_threshold = exact_search_threshold
+        self.kmeans_iterations = kmeans_iterations
+        self.retrain_growth_factor = retrain_growth_factor
+        self.seed = seed
+        super().__init__(path, max_segments=max_segments)
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            self._centroids: Optional[np.ndarray] = None
+            self._centroid_files: Dict[str, str] = {}
+            self._trained_size = 0
+
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int = 10,
+        candidate_ids: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        with self._lock:
+            # the clusters of the segments are those of the centroids
+            segments = self._searchable_segments(candidate_ids)
+            centroids = self._centroids
+        if not segments:
+            return []
+        query = normalize_rows(np.asarray(query_embedding))
+        probe = None
+        if candidate_ids is None and centroids is not None and \
+                len(self) >= self.exact_search_threshold:
+            probe = top_k_indices(centroids @ query, self.nprobe)
+            nlist = len(centroids)
+        hits: List[Tuple[str, float]] = []
+        for segment in segments:
+            if probe is None or segment.codes is None:
+                # exact search over the vectors matching a filter, the
+                # vectors of a small tenant or the unassigned vectors
+                rows = np.arange(len(segment))
+                scores = segment.embeddings @ query
+                if segment.alive is not None:
+                    rows = rows[segment.alive]
+                    scores = scores[segment.alive]
+            else:
+                lists = segment.code_lists(nlist)
+                rows = np.concatenate([lists[c] for c in probe])
+                if segment.alive is not None:
+                    rows = rows[segment.alive[rows]]
+                scores = segment.embeddings[rows] @ query
+            hits.extend(
+                (segment.vector_ids[rows[i]], float(scores[i]))
+                for i in top_k_indices(scores, k)
+            )
+        hits.sort(key=lambda hit: -hit[1])
+        return hits[:k]
+
+    def load(self) -> bool:
+        manifest = self.storage.read_manifest()
+        if manifest is not None and "files" in manifest:
+            # a snapshot of an earlier version, without segments, which is
+            # rebuilt from the collection
+            return False
+        return super().load()
+
+    def _rebase(self) -> List[str]:
+        manifest = self.storage.read_manifest()
+        if manifest is not None and "files" in manifest:
+            return list(manifest["files"].values())
+        return super()._rebase()
+
+    def _before_save(self) -> None:
+        n = len(self)
+        if n == 0 or \
+                self._centroids is None and n < self.exact_search_threshold:
+            return
+        if self._centroids is None or \
+                n > self.retrain_growth_factor * self._trained_size:
+            self._train()
+            self._segments = [s.with_codes(None) for s in self._segments]
+        self._segments = [
+            s.with_codes(self._assign(np.asarray(s.embeddings)))
+            if s.codes is None and len(s) > 0 else s
+            for s in self._segments
+        ]
+
+    def _train(self) -> None:
+        n = len(self)
+        nlist = min(self.nlist or max(1, int(np.sqrt(n))), n)
+        # train on a sample of the vectors to bound the training cost
+        sample = self._sample_rows(nlist * 64, self.seed)
+        rng = np.random.default_rng(self.seed)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(self.kmeans_iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            # keep the previous centroid for empty clusters
+            sums[counts == 0] = centroids[counts == 0]
+            centroids = normalize_rows(sums)
+        self._centroids = centroids
+        self._centroid_files = {}
+        self._trained_size = n
+
+    def _assign(self, rows: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+        assert self._centroids is not None
+        assignments = [
+            np.argmax(rows[i:i + batch_size] @ self._centroids.T, axis=1)
+            for i in range(0, len(rows), batch_size)
+        ]
+        if not assignments:
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate(assignments).astype(np.int32)
+
+    def _extra_manifest(self) -> Dict[str, Any]:
+        if self._centroids is None:
+            return {}
+        if not self._centroid_files:
+            self._centroid_files = {
+                "centroids": self.storage.write_array(
+                    "centroids", self._centroids)
+            }
+        return {
+            "trained_size": self._trained_size,
+            "extra_files": self._centroid_files,
+        }
+
+    def _load_extra_manifest(self, manifest: Dict[str, Any]) -> None:
+        files: Dict[str, str] = manifest.get("extra_files", {})
+        if files == self._centroid_files:
+            return
+        self._centroids = self.storage.load_array(files["centroids"]) \
+            if files else None
+        self._centroid_files = files
+        self._trained_size = manifest.get("trained_size", 0)
@@ -0,0 +1,150 @@
+import asyncio
+import json
+from typing import List, Optional
+import pytest
+from mistralai import Mistral
+from mistralai.models import (
+    CompletionChunk, CompletionEvent, CompletionResponseStreamChoice,
+    DeltaMessage, FunctionCall, ToolCall
+)
+from src.agents.agent import RAGAgent
+from src.models import Metadata, SearchFilter, Vector
+from src.retrievers.retriever_pipeline import BaseRetrieverPipeline
+
+
+class StaticPipeline(BaseRetrieverPipeline):
+    async def retrieve(
+        self,
+        query: str,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Vector]:
+        return [
+            Vector(
+                vector_embedding=[1.0],
+                vector_id=f"{query}-id",
+                text=f"{query}-text",
+                metadata=Metadata(
+                    title="test",
+                    author="test",
+                    description="test",
+                    keywords=["test"],
+                    created_at=""
+                ),
+                parent_id="parent"
+            )
+        ]
+
+
+class FakeStream:
+    def __init__(self, deltas: List[DeltaMessage]):
+        self.deltas = deltas
+        # number of deltas generated so far
+        self.sent = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    async def __aiter__(self):
+        for delta in self.deltas:
+            await asyncio.sleep(0)
+            self.sent += 1
+            yield CompletionEvent(
+                data=CompletionChunk(
+                    id="id",
+                    model="model",
+                    choices=[
+                        CompletionResponseStreamChoice(
+                            index=0, delta=delta, finish_reason=None)
+                    ]
+                )
+            )
+
+
+def tool_call_delta(query: str) -> DeltaMessage:
+    return DeltaMessage(
+        tool_calls=[
+            ToolCall(
+                id="0",
+                function=FunctionCall(
+                    name="query_knowledge_base",
+                    arguments=json.dumps({"rewritten_query": query})
+                )
+            )
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_rag_agent_streams_progress_and_answer_tokens() -> None:
+    client = Mistral(api_key="test")
+    turns = iter([
+        [tool_call_delta("revenue")],
+        [DeltaMessage(content=token) for token in ["It ", "was ", "$3M."]],
+    ])
+
+    async def stream_async(**kwargs):
+        return FakeStream(next(turns))
+
+    client.chat.stream_async = stream_async
+    agent = RAGAgent(
+        retriever_pipeline=StaticPipeline(),
+        mistral_api_key="test",
+        client=client
+    )
+    events = [event async for event in agent.chat_stream("question")]
+    assert [event.event for event in events] == [
+        "tool_call", "retrieved", "token", "token", "token", "done"]
+    assert events[0].query == "revenue"
+    assert events[1].retrieved_ids == ["revenue-id"]
+    assert "".join(event.token or "" for event in events) == "It was $3M."
+    response = events[-1].response
+    assert response is not None
+    assert response.response == "It was $3M."
+    assert [query.query for query in response.queries] == ["revenue"]
+
+
+@pytest.mark.asyncio
+async def test_rag_agent_streams_only_the_final_answer() -> None:
+    client = Mistral(api_key="test")
+    turns = iter([
+        [DeltaMessage(content="Let me search."), tool_call_delta("revenue")],
+        [DeltaMessage(content=token) for token in ["It was ", "$3M."]],
+    ])
+
+    streams: List[FakeStream] = []
+
+    async def stream_async(**kwargs):
+        streams.append(FakeStream(next(turns)))
+        return streams[-1]
+
+    client.chat.stream_async = stream_async
+    agent = RAGAgent(
+        retriever_pipeline=StaticPipeline(),
+        mistral_api_key="test",
+        client=client
+    )
+    events = []
+    # the tokens with the number of deltas of their turn generated so far
+    received = []
+    async for event in agent.chat_stream("question"):
+        events.append(event)
+        if event.event == "token":
+            received.append((event.token, streams[-1].sent))
+    # each token is sent as soon as the model generates it
+    assert received == [("Let me search.", 1), ("It was ", 1), ("$3M.", 2)]
+    assert [event.event for event in events] == [
+        "token", "discard", "tool_call", "retrieved", "token", "token",
+        "done"]
+    assert events[0].token == "Let me search."
+    # the content of the turn that called a tool is not part of the answer
+    last_discard = max(
+        i for i, event in enumerate(events) if event.event == "discard")
+    assert "".join(
+        event.token or "" for event in events[last_discard:]
+    ) == "It was $3M."
+    response = events[-1].response
+    assert response is not None
+    assert response.response == "It was $3M."
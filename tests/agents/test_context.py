@@ -0,0 +1,77 @@
+from src.agents.context import AgentContext
+from src.chunkers.chunker import chunk_header
+from src.models import Metadata, Vector
+
+
+METADATA = Metadata(
+    title="Handbook",
+    author="HR",
+    description="Policies",
+    keywords=["hr"],
+    created_at=""
+)
+
+
+def make_vector(vector_id: str, body: str, parent_id: str = "doc1") -> Vector:
+    return Vector(
+        vector_embedding=[1.0],
+        vector_id=vector_id,
+        text=chunk_header(METADATA) + body,
+        metadata=METADATA,
+        parent_id=parent_id
+    )
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def test_context_shows_each_chunk_and_header_once() -> None:
+    context = AgentContext()
+    assert context.add_turn([
+        [make_vector("a", "pto days"), make_vector("b", "sick days")],
+        [make_vector("a", "pto days")],
+    ]) == 2
+    assert context.add_turn([
+        [make_vector("b", "sick days"), make_vector("c", "travel", "doc2")],
+    ]) == 1
+    first, second = context.render()
+    header = chunk_header(METADATA)
+    assert first == header + "pto days\n\nsick days"
+    # doc2 has the same metadata, but its header is given before its chunk
+    assert second == header + "travel"
+    assert context.kept_ids() == ["a", "b", "c"]
+
+
+def test_context_drops_the_lowest_scored_chunks_over_budget() -> None:
+    header_tokens = count_words(chunk_header(METADATA))
+    context = AgentContext(
+        max_tokens=header_tokens + 6, count_tokens=count_words)
+    context.add_turn([[
+        make_vector("a", "one two"),
+        make_vector("b", "three four"),
+        make_vector("c", "five six"),
+    ]])
+    assert context.kept_ids() == ["a", "b", "c"]
+    # the best chunk of a new query outranks the last chunk of the first
+    context.add_turn([[make_vector("d", "seven eight")]])
+    assert context.kept_ids() == ["a", "b", "d"]
+    assert context.num_tokens() == header_tokens + 6
+
+
+def test_context_fits_many_chunks_in_one_pass() -> None:
+    calls = []
+
+    def count(text: str) -> int:
+        calls.append(text)
+        return count_words(text)
+
+    header_tokens = count_words(chunk_header(METADATA))
+    context = AgentContext(max_tokens=header_tokens + 10, count_tokens=count)
+    context.add_turn([[
+        make_vector(str(i), f"word{i} other{i}") for i in range(200)
+    ]])
+    assert context.kept_ids() == [str(i) for i in range(5)]
+    assert context.num_tokens() == header_tokens + 10
+    # each text is counted once
+    assert len(calls) == len(set(calls))
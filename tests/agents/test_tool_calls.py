@@ -0,0 +1,143 @@
+import asyncio
+import json
+import time
+from typing import List, Optional
+import pytest
+from mistralai import Mistral
+from mistralai.models import (
+    AssistantMessage, ChatCompletionChoice, ChatCompletionResponse,
+    FunctionCall, ToolCall, UsageInfo
+)
+from src.agents.agent import RAGAgent
+from src.models import Metadata, SearchFilter, Vector
+from src.retrievers.retriever_pipeline import BaseRetrieverPipeline
+
+
+class SlowPipeline(BaseRetrieverPipeline):
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.queries: List[str] = []
+
+    async def retrieve(
+        self,
+        query: str,
+        search_filter: Optional[SearchFilter] = None
+    ) -> List[Vector]:
+        self.queries.append(query)
+        await asyncio.sleep(self.latency)
+        return [
+            Vector(
+                vector_embedding=[1.0],
+                vector_id=f"{query}-id",
+                text=f"{query}-text",
+                metadata=Metadata(
+                    title="test",
+                    author="test",
+                    description="test",
+                    keywords=["test"],
+                    created_at=""
+                ),
+                parent_id="parent"
+            )
+        ]
+
+
+def completion(
+    content: str,
+    queries: List[str],
+    prompt_tokens: int = 0
+) -> ChatCompletionResponse:
+    return ChatCompletionResponse(
+        id="id",
+        object="chat.completion",
+        model="model",
+        created=0,
+        usage=UsageInfo(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=0,
+            total_tokens=prompt_tokens
+        ),
+        choices=[
+            ChatCompletionChoice(
+                index=0,
+                finish_reason="tool_calls" if queries else "stop",
+                message=AssistantMessage(
+                    content=content,
+                    tool_calls=[
+                        ToolCall(
+                            id=str(i),
+                            function=FunctionCall(
+                                name="query_knowledge_base",
+                                arguments=json.dumps(
+                                    {"rewritten_query": query})
+                            )
+                        )
+                        for i, query in enumerate(queries)
+                    ] or None
+                )
+            )
+        ]
+    )
+
+
+def make_agent(pipeline, turns, prompts=None) -> RAGAgent:
+    client = Mistral(api_key="test")
+    responses = iter(turns)
+
+    async def complete_async(**kwargs):
+        if prompts is not None:
+            prompts.append(
+                " ".join(message.content for message in kwargs["messages"]))
+        return next(responses)
+
+    client.chat.complete_async = complete_async
+    return RAGAgent(
+        retriever_pipeline=pipeline,
+        mistral_api_key="test",
+        client=client
+    )
+
+
+@pytest.mark.asyncio
+async def test_rag_agent_runs_the_tool_calls_of_a_turn_concurrently() -> None:
+    pipeline = SlowPipeline(latency=0.2)
+    agent = make_agent(pipeline, [
+        completion("", ["a", "b", "c", "d"]),
+        completion("answer", []),
+    ])
+    start = time.perf_counter()
+    response = await agent.chat("question")
+    assert time.perf_counter() - start < 0.6
+    assert response.response == "answer"
+    assert [query.query for query in response.queries] == \
+        ["a", "b", "c", "d"]
+    assert [query.retrieved_ids for query in response.queries] == \
+        [["a-id"], ["b-id"], ["c-id"], ["d-id"]]
+
+
+@pytest.mark.asyncio
+async def test_rag_agent_makes_a_repeated_query_once() -> None:
+    pipeline = SlowPipeline(latency=0)
+    agent = make_agent(pipeline, [
+        completion("", ["a", "b", "a"]),
+        completion("", ["b", "c"]),
+        completion("answer", []),
+    ])
+    response = await agent.chat("question")
+    assert sorted(pipeline.queries) == ["a", "b", "c"]
+    assert [query.query for query in response.queries] == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_rag_agent_sends_each_chunk_once_and_counts_tokens() -> None:
+    pipeline = SlowPipeline(latency=0)
+    prompts: List[str] = []
+    agent = make_agent(pipeline, [
+        completion("", ["a"], prompt_tokens=100),
+        completion("", ["a", "b"], prompt_tokens=150),
+        completion("answer", [], prompt_tokens=200),
+    ], prompts)
+    response = await agent.chat("question")
+    assert response.prompt_tokens == 450
+    assert prompts[-1].count("a-text") == 1
+    assert prompts[-1].count("b-text") == 1
@@ -0,0 +1,125 @@
+from typing import Dict, List
+import pytest
+from src.caches.answer_cache import SemanticAnswerCache
+from src.embedders.dense_embedder import BaseDenseEmbedder
+from src.models import GenerateResponse, Query
+
+
+class TableEmbedder(BaseDenseEmbedder):
+    model = "test-model"
+
+    def __init__(self, embeddings: Dict[str, List[float]]):
+        self.embeddings = embeddings
+
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        return self.embeddings[text]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return [await self.embed_text(text) for text in texts]
+
+
+EMBEDDINGS = {
+    "what is the PTO policy?": [1.0, 0.0, 0.0],
+    "what's the PTO policy": [0.99, 0.1, 0.0],
+    "how much was spent on R&D?": [0.0, 1.0, 0.0],
+    "who is the CEO?": [0.0, 0.0, 1.0],
+}
+
+
+def answer(text: str) -> GenerateResponse:
+    return GenerateResponse(
+        response=text,
+        queries=[Query(query=text, retrieved_ids=["v1"])]
+    )
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_returns_answers_of_similar_queries() -> None:
+    cache = SemanticAnswerCache(
+        TableEmbedder(EMBEDDINGS), similarity_threshold=0.95)
+    assert await cache.lookup("what is the PTO policy?") is None
+    await cache.store("what is the PTO policy?", answer("pto"), ["doc1"])
+
+    cached = await cache.lookup("what's the PTO policy")
+    assert cached is not None and cached.response == "pto"
+    assert await cache.lookup("how much was spent on R&D?") is None
+    # answers are not shared across filters
+    assert await cache.lookup("what's the PTO policy", scope="f") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_invalidates_answers_citing_documents() -> None:
+    cache = SemanticAnswerCache(TableEmbedder(EMBEDDINGS))
+    await cache.store("what is the PTO policy?", answer("pto"), ["doc1"])
+    await cache.store(
+        "how much was spent on R&D?", answer("rd"), ["doc1", "doc2"])
+    await cache.store("who is the CEO?", answer("ceo"), ["doc3"])
+
+    assert cache.invalidate(["doc1"]) == 2
+    assert await cache.lookup("what is the PTO policy?") is None
+    assert await cache.lookup("how much was spent on R&D?") is None
+    assert await cache.lookup("who is the CEO?") is not None
+
+    # an answer computed before an invalidation is not stored
+    version = cache.version
+    cache.invalidate(["doc3"])
+    assert not await cache.store(
+        "what is the PTO policy?", answer("pto"), ["doc1"], version=version)
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_syncs_changes_of_other_workers() -> None:
+    cache = SemanticAnswerCache(TableEmbedder(EMBEDDINGS))
+    cache.sync(3, [["doc9"]])
+    await cache.store("what is the PTO policy?", answer("pto"), ["doc1"])
+    await cache.store("who is the CEO?", answer("ceo"), ["doc2"])
+    await cache.store("how much was spent on R&D?", answer("rd"), ["doc3"])
+
+    # nothing changed since the last sync
+    cache.sync(3, [["doc9"]])
+    assert len(cache) == 3
+    # another worker deleted or re-indexed doc1 and doc2
+    cache.sync(5, [["doc9"], ["doc1"], ["doc2"]])
+    assert await cache.lookup("what is the PTO policy?") is None
+    assert await cache.lookup("who is the CEO?") is None
+    assert await cache.lookup("how much was spent on R&D?") is not None
+
+    # the ids of some of the changes since the last sync are not known
+    cache.sync(8, [["doc4"], ["doc5"]])
+    assert len(cache) == 0
+    await cache.store("who is the CEO?", answer("ceo"), ["doc2"])
+    # all the documents changed
+    cache.sync(9, [["doc5"], None])
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_evicts_by_size_ttl_and_memory() -> None:
+    now = [0.0]
+    cache = SemanticAnswerCache(
+        TableEmbedder(EMBEDDINGS), max_size=2, ttl_seconds=10,
+        clock=lambda: now[0])
+    await cache.store("what is the PTO policy?", answer("pto"), ["doc1"])
+    await cache.store("how much was spent on R&D?", answer("rd"), ["doc2"])
+    assert await cache.lookup("what is the PTO policy?") is not None
+    await cache.store("who is the CEO?", answer("ceo"), ["doc3"])
+    # the least recently used answer was evicted
+    assert await cache.lookup("how much was spent on R&D?") is None
+    assert await cache.lookup("what is the PTO policy?") is not None
+
+    now[0] = 11.0
+    assert await cache.lookup("who is the CEO?") is None
+
+    small = SemanticAnswerCache(
+        TableEmbedder(EMBEDDINGS), max_memory_bytes=150)
+    await small.store("what is the PTO policy?", answer("pto"), ["doc1"])
+    await small.store("who is the CEO?", answer("ceo"), ["doc3"])
+    assert len(small) == 1
+    assert small.stats()["memory_bytes"] <= 150
@@ -0,0 +1,48 @@
+import pytest
+from src.caches.cache import LRUCache, SQLiteCacheBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1}
+
+
+def test_lru_cache_expires_entries() -> None:
+    clock = FakeClock()
+    cache = LRUCache(max_size=2, ttl_seconds=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_sqlite_cache_backend_persists_entries(tmp_path) -> None:
+    path = str(tmp_path / "cache.sqlite")
+    backend = SQLiteCacheBackend(path)
+    await backend.set_many({"a": [1.0, 2.0], "b": [3.0]})
+    assert await backend.get("a") == [1.0, 2.0]
+    backend.close()
+
+    backend = SQLiteCacheBackend(path)
+    assert await backend.get_many(["a", "b", "c"]) == {
+        "a": [1.0, 2.0], "b": [3.0]}
+    assert await backend.get("c") is None
+    backend.close()
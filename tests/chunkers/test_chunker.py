@@ -1,4 +1,7 @@
-from src.chunkers.chunker import ApproximateChunkerWithOverlap
+from src.chunkers.chunker import (
+    ApproximateChunkerWithOverlap, SentenceChunker, chunk_header,
+    chunks_from_spans
+)
 from src.models import Metadata
 import pytest
 
@@ -40,3 +43,107 @@ async def test_approximate_chunker_with_overlap_short_text():
     )
     chunks = await chunker.chunk_text(text, metadata)
     assert len(chunks) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(16, 4), (512, 128)])
+async def test_approximate_chunker_stream_matches_chunk_text(
+    chunk_size, chunk_overlap
+):
+    chunker = ApproximateChunkerWithOverlap(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+    metadata = Metadata(
+        title="Test Title",
+        author="Test Author",
+        description="Test Subject",
+        keywords=["test", "chunker"],
+        created_at="2024-01-01"
+    )
+    # pages cut words in two and end with or without whitespace
+    pages = ["one two thr", "ee four\n", "five", "  six\tseven ", ""] * 200
+
+    async def stream():
+        for page in pages:
+            yield page
+
+    chunks = [
+        chunk async for chunk in chunker.chunk_stream(stream(), metadata)
+    ]
+    assert chunks == await chunker.chunk_text("".join(pages), metadata)
+
+
+@pytest.mark.asyncio
+async def test_approximate_chunker_spans_match_chunk_text():
+    chunker = ApproximateChunkerWithOverlap(chunk_size=16, chunk_overlap=4)
+    metadata = Metadata(
+        title="Test Title",
+        author="Test Author",
+        description="Test Subject",
+        keywords=["test", "chunker"],
+        created_at="2024-01-01"
+    )
+    text = "\n".join(f"line {i}:  some words\there" for i in range(40))
+    spans = chunker.chunk_spans(text)
+    chunks = await chunker.chunk_text(text, metadata)
+    # both vector layouts store the same chunks, which keep the whitespace
+    # of the text between the words
+    assert chunks_from_spans(text, metadata, spans) == chunks
+    assert "some words\there" in chunks[0]
+    assert all(not text[start:end][0].isspace() for start, end in spans)
+
+
+@pytest.mark.asyncio
+async def test_sentence_chunker_keeps_sentences_whole():
+    chunker = SentenceChunker(chunk_size=12, chunk_overlap=6)
+    text = (
+        "First sentence here. Second one is a bit longer! Third?\n\n"
+        "New paragraph starts. Then it goes on. And ends here."
+    )
+    spans = chunker.chunk_spans(text)
+    chunks = [text[start:end] for start, end in spans]
+    assert chunks == [
+        "First sentence here. Second one is a bit longer!",
+        "Third?\n\nNew paragraph starts. Then it goes on.",
+        "Then it goes on. And ends here.",
+    ]
+    metadata = Metadata(
+        title="Test Title",
+        author="Test Author",
+        description="Test Subject",
+        keywords=["test", "chunker"],
+        created_at="2024-01-01"
+    )
+    assert await chunker.chunk_text(text, metadata) == [
+        chunk_header(metadata) + chunk for chunk in chunks]
+
+
+def test_sentence_chunker_splits_long_sentences():
+    chunker = SentenceChunker(chunk_size=8, chunk_overlap=0)
+    text = "Short one. " + " ".join(f"w{i}" for i in range(20)) + ". End."
+    chunks = [text[start:end] for start, end in chunker.chunk_spans(text)]
+    assert chunks[0] == "Short one."
+    assert chunks[1] == "w0 w1 w2 w3 w4 w5"
+    assert chunks[-1] == "End."
+    # every word is in a chunk
+    assert " ".join(chunks[1:-1]).split() == text[11:-5].split()
+
+
+def test_sentence_chunker_uses_token_counter():
+    chunker = SentenceChunker(
+        chunk_size=10, count_tokens=lambda sentence: len(sentence))
+    text = "Aaaa. Bbbb. Cccccccc."
+    chunks = [text[start:end] for start, end in chunker.chunk_spans(text)]
+    # 5 + 5 characters fit in a chunk, 5 + 5 + 9 do not
+    assert chunks == ["Aaaa. Bbbb.", "Cccccccc."]
+
+
+def test_sentence_chunker_splits_long_sentences_with_token_counter():
+    # one token per character
+    chunker = SentenceChunker(
+        chunk_size=12, chunk_overlap=4, count_tokens=len)
+    text = "aaaa bbbb cccc dddd eeee ffff"
+    chunks = [text[start:end] for start, end in chunker.chunk_spans(text)]
+    assert chunks == ["aaaa bbbb cccc", "cccc dddd eeee", "eeee ffff"]
+    assert all(len(chunk.replace(" ", "")) <= 12 for chunk in chunks)
@@ -0,0 +1,26 @@
+import uuid
+import pytest
+from src.models import Metadata, Vector
+
+
+@pytest.fixture
+def make_vectors():
+    # vectors of a parent document with the given embeddings
+    def make(embeddings, parent_id="parent"):
+        return [
+            Vector(
+                vector_embedding=embedding.tolist(),
+                vector_id=str(uuid.uuid4()),
+                text=f"test {i}",
+                metadata=Metadata(
+                    title="test",
+                    author="test",
+                    description="test",
+                    keywords=["test"],
+                    created_at=""
+                ),
+                parent_id=parent_id
+            )
+            for i, embedding in enumerate(embeddings)
+        ]
+    return make
@@ -0,0 +1,33 @@
+import numpy as np
+from bson import BSON
+from src.database_handlers.embedding_codec import (
+    decode_embedding, encode_embedding
+)
+
+
+def test_encode_embedding_is_normalized_float32() -> None:
+    embedding = [3.0, 4.0, 0.0, 0.0]
+    encoded = encode_embedding(embedding)
+    assert len(encoded) == 4 * len(embedding)
+    decoded = decode_embedding(encoded)
+    assert decoded.dtype == np.float32
+    assert np.allclose(decoded, [0.6, 0.8, 0.0, 0.0])
+
+
+def test_binary_embedding_is_smaller_than_array() -> None:
+    embedding = np.random.rand(1024).tolist()
+    array_size = len(BSON.encode({"vector_embedding": embedding}))
+    binary_size = len(
+        BSON.encode({"vector_embedding": encode_embedding(embedding)}))
+    assert binary_size < array_size / 2
+
+
+def test_decode_embedding_does_not_copy() -> None:
+    encoded = encode_embedding([1.0, 2.0, 3.0])
+    decoded = decode_embedding(encoded)
+    assert not decoded.flags.owndata
+
+
+def test_decode_array_embedding() -> None:
+    decoded = decode_embedding([1.0, 2.0])
+    assert np.allclose(decoded, [1.0, 2.0])
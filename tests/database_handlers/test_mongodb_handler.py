@@ -2,7 +2,9 @@ from src.database_handlers.database_handler import MongoDBHandler
 import motor.motor_asyncio
 import os
 import pytest
-from src.models import Document, Metadata
+from bson import ObjectId
+from src.chunkers.chunker import chunk_header
+from src.models import Document, Metadata, Vector
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -81,3 +83,173 @@ async def test_mongodb_handler_delete_document(mongodb_handler):
     # assert that the document was deleted
     number_of_documents = await mongodb_handler.get_number_of_documents()
     assert number_of_documents == 0
+
+
+@pytest.mark.asyncio
+async def test_mongodb_handler_upload_document_with_vectors(mongodb_handler):
+    await mongodb_handler.doc_collection.delete_many({})
+    await mongodb_handler.vector_collection.delete_many({})
+    mongodb_handler.vector_batch_size = 2
+    metadata = Metadata(
+        title="test",
+        author="test",
+        description="test",
+        keywords=["test"],
+        created_at="2024-01-01"
+    )
+    document_id = ObjectId()
+    vectors = [
+        Vector(
+            vector_embedding=[float(i), 1.0],
+            vector_id=f"vector{i}",
+            text=f"chunk {i}",
+            metadata=metadata,
+            parent_id=str(document_id)
+        )
+        for i in range(5)
+    ]
+    inserted_id = await mongodb_handler.upload_document_with_vectors(
+        Document(text="test", metadata=metadata), vectors, document_id)
+    assert inserted_id == document_id
+    assert await mongodb_handler.get_number_of_documents() == 1
+    assert await mongodb_handler.vector_collection.count_documents(
+        {"parent_id": str(document_id)}) == 5
+    await mongodb_handler.delete_document(document_id)
+    assert await mongodb_handler.vector_collection.count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_mongodb_handler_find_document_by_file_hash(mongodb_handler):
+    await mongodb_handler.doc_collection.delete_many({})
+    document = Document(
+        text="test",
+        metadata=Metadata(
+            title="test",
+            author="test",
+            description="test",
+            keywords=["test"],
+            created_at="2024-01-01"
+        ),
+        file_hash="abc"
+    )
+    inserted_id = await mongodb_handler.upload_document(document)
+    assert await mongodb_handler.find_document_by_file_hash("abc") \
+        == inserted_id
+    assert await mongodb_handler.find_document_by_file_hash("def") is None
+    await mongodb_handler.doc_collection.delete_many({})
+
+
+@pytest.mark.asyncio
+async def test_mongodb_handler_normalized_vectors(mongodb_handler):
+    await mongodb_handler.doc_collection.delete_many({})
+    await mongodb_handler.vector_collection.delete_many({})
+    mongodb_handler.vector_layout = "normalized"
+    metadata = Metadata(
+        title="test",
+        author="test",
+        description="test",
+        keywords=["test"],
+        created_at="2024-01-01"
+    )
+    text = "first chunk. second chunk."
+    document_id = ObjectId()
+    spans = [(0, 12), (13, 26)]
+    vectors = [
+        Vector(
+            vector_embedding=[float(i), 1.0],
+            vector_id=f"vector{i}",
+            text=chunk_header(metadata) + text[start:end],
+            metadata=metadata,
+            parent_id=str(document_id),
+            span=(start, end)
+        )
+        for i, (start, end) in enumerate(spans)
+    ]
+    await mongodb_handler.upload_document_with_vectors(
+        Document(text=text, metadata=metadata), vectors, document_id)
+    # only the span of the chunks is stored
+    stored = await mongodb_handler.vector_collection.find_one(
+        {"vector_id": "vector0"}, {"_id": 0})
+    assert set(stored) == {
+        "vector_id", "parent_id", "span", "vector_embedding"}
+    assert await mongodb_handler.get_document_vectors(document_id) == vectors
+    await mongodb_handler.delete_document(document_id)
+
+
+@pytest.mark.asyncio
+async def test_mongodb_handler_delete_documents(mongodb_handler):
+    await mongodb_handler.doc_collection.delete_many({})
+    await mongodb_handler.vector_collection.delete_many({})
+    mongodb_handler.delete_batch_size = 2
+    metadata = Metadata(
+        title="test",
+        author="test",
+        description="test",
+        keywords=["test"],
+        created_at="2024-01-01"
+    )
+    document_ids = []
+    for i in range(5):
+        document_id = ObjectId()
+        await mongodb_handler.upload_document_with_vectors(
+            Document(text="test", metadata=metadata),
+            [Vector(
+                vector_embedding=[1.0, 0.0],
+                vector_id=f"vector{i}",
+                text="test",
+                metadata=metadata,
+                parent_id=str(document_id)
+            )],
+            document_id
+        )
+        document_ids.append(document_id)
+    assert await mongodb_handler.delete_documents(document_ids[:3]) == 3
+    assert await mongodb_handler.get_number_of_documents() == 2
+    assert await mongodb_handler.vector_collection.count_documents({}) == 2
+    assert await mongodb_handler.delete_all_documents() == 2
+    assert await mongodb_handler.get_number_of_documents() == 0
+    assert await mongodb_handler.vector_collection.count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_mongodb_handler_find_parent_ids(mongodb_handler):
+    await mongodb_handler.vector_collection.delete_many({})
+    metadata = Metadata(
+        title="test",
+        author="test",
+        description="test",
+        keywords=["test"],
+        created_at="2024-01-01"
+    )
+    await mongodb_handler.upload_vectors([
+        Vector(
+            vector_embedding=[1.0, 0.0],
+            vector_id=f"vector{i}",
+            text="test",
+            metadata=metadata,
+            parent_id=f"parent{i % 2}"
+        )
+        for i in range(4)
+    ])
+    assert sorted(await mongodb_handler.find_parent_ids(
+        ["vector0", "vector1", "vector2"])) == ["parent0", "parent1"]
+    assert await mongodb_handler.find_parent_ids(["missing"]) == []
+
+
+@pytest.mark.asyncio
+async def test_mongodb_handler_records_changes(mongodb_handler):
+    await mongodb_handler.change_collection.delete_many({})
+    assert await mongodb_handler.get_changes() == (0, [])
+    document_ids = [ObjectId() for _ in range(3)]
+    await mongodb_handler.delete_document(document_ids[0])
+    await mongodb_handler.delete_documents(document_ids[1:])
+    await mongodb_handler.replace_document_vectors(document_ids[0], [], [])
+    await mongodb_handler.delete_all_documents()
+    count, latest = await mongodb_handler.get_changes()
+    assert count == 4
+    assert latest == [
+        [str(document_ids[0])],
+        [str(document_id) for document_id in document_ids[1:]],
+        [str(document_ids[0])],
+        None
+    ]
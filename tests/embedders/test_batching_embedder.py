@@ -0,0 +1,93 @@
+import asyncio
+from typing import List
+import pytest
+from src.embedders.batching_embedder import (
+    BatchingDenseEmbedder, estimate_tokens, split_batches
+)
+from src.embedders.dense_embedder import BaseDenseEmbedder
+
+
+class ApiError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class FlakyEmbedder(BaseDenseEmbedder):
+    model = "test-model"
+    max_batch_size = 3
+
+    def __init__(self, failing_batches: int = 0):
+        self.batches: List[List[str]] = []
+        self.failing_batches = failing_batches
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        return [float(text)]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # later batches finish first
+            await asyncio.sleep(0.01 / (len(self.batches) + 1))
+            if self.failing_batches:
+                self.failing_batches -= 1
+                raise ApiError(503)
+            self.batches.append(texts)
+            return [await self.embed_text(text) for text in texts]
+        finally:
+            self.in_flight -= 1
+
+
+def test_split_batches_bounds_size_and_tokens() -> None:
+    texts = ["a b c", "d", "e f", "g h i j k l", "m"]
+    assert split_batches(texts, 2) == [
+        ["a b c", "d"], ["e f", "g h i j k l"], ["m"]]
+    tokens = [estimate_tokens(text) for text in texts]
+    assert tokens == [4, 2, 3, 8, 2]
+    # a text over the token limit gets a batch of its own
+    assert split_batches(texts, 10, max_batch_tokens=6) == [
+        ["a b c", "d"], ["e f"], ["g h i j k l"], ["m"]]
+
+
+@pytest.mark.asyncio
+async def test_batching_embedder_keeps_order() -> None:
+    inner = FlakyEmbedder()
+    embedder = BatchingDenseEmbedder(inner, max_batch_size=10,
+                                     max_concurrency=2)
+    texts = [str(i) for i in range(10)]
+    embeddings = await embedder.embed_batch(texts)
+    assert embeddings == [[float(i)] for i in range(10)]
+    # the limit of the provider wins over the configured batch size
+    assert sorted(len(batch) for batch in inner.batches) == [1, 3, 3, 3]
+    assert inner.max_in_flight == 2
+    stats = embedder.stats()
+    assert stats["batches"] == 4
+    assert stats["texts"] == 10
+    assert stats["retries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_batching_embedder_retries_sub_batches() -> None:
+    inner = FlakyEmbedder(failing_batches=2)
+    embedder = BatchingDenseEmbedder(inner, max_concurrency=1,
+                                     base_delay=0.001)
+    embeddings = await embedder.embed_batch([str(i) for i in range(6)])
+    assert embeddings == [[float(i)] for i in range(6)]
+    assert embedder.stats()["retries"] == 2
+    assert embedder.stats()["failures"] == 0
+
+
+@pytest.mark.asyncio
+async def test_batching_embedder_gives_up() -> None:
+    inner = FlakyEmbedder(failing_batches=10)
+    embedder = BatchingDenseEmbedder(inner, max_retries=1, base_delay=0.001)
+    with pytest.raises(ApiError):
+        await embedder.embed_batch(["1"])
+    assert embedder.stats()["failures"] == 1
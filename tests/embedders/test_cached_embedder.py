@@ -0,0 +1,94 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+import pytest
+from src.caches.cache import BaseCacheBackend
+from src.embedders.cached_embedder import (
+    CachedDenseEmbedder, ContentCachedDenseEmbedder
+)
+from src.embedders.dense_embedder import BaseDenseEmbedder
+
+
+class CountingEmbedder(BaseDenseEmbedder):
+    model = "test-model"
+
+    def __init__(self):
+        self.calls: List[str] = []
+
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        self.calls.append(text)
+        await asyncio.sleep(0)
+        return [float(len(text)), 1.0 if input_type == "search_query" else 0.]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return [await self.embed_text(text) for text in texts]
+
+
+class DictBackend(BaseCacheBackend):
+    def __init__(self):
+        self.entries: Dict[str, Any] = {}
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self.entries.get(key)
+
+    async def set(self, key: str, value: Any) -> None:
+        self.entries[key] = value
+
+
+@pytest.mark.asyncio
+async def test_cached_embedder_reuses_embeddings() -> None:
+    embedder = CountingEmbedder()
+    cached = CachedDenseEmbedder(embedder)
+    first = await cached.embed_text("what is  covered?", "search_query")
+    second = await cached.embed_text(" what is covered? ", "search_query")
+    assert first == second
+    assert len(embedder.calls) == 1
+    # the input type is part of the key
+    document = await cached.embed_text("what is covered?")
+    assert document != first
+    assert len(embedder.calls) == 2
+    assert cached.stats() == {
+        "size": 2, "hits": 1, "misses": 2, "backend_hits": 0}
+
+
+@pytest.mark.asyncio
+async def test_cached_embedder_shares_concurrent_calls() -> None:
+    embedder = CountingEmbedder()
+    cached = CachedDenseEmbedder(embedder)
+    results = await asyncio.gather(
+        *(cached.embed_text("query", "search_query") for _ in range(5)))
+    assert all(result == results[0] for result in results)
+    assert len(embedder.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_embedder_shared_backend() -> None:
+    backend = DictBackend()
+    embedder = CountingEmbedder()
+    replica1 = CachedDenseEmbedder(embedder, backend=backend)
+    replica2 = CachedDenseEmbedder(embedder, backend=backend)
+    await replica1.embed_text("query", "search_query")
+    await replica2.embed_text("query", "search_query")
+    assert len(embedder.calls) == 1
+    assert replica2.stats()["backend_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_content_cached_embedder_embeds_missing_chunks_once() -> None:
+    embedder = CountingEmbedder()
+    backend = DictBackend()
+    cached = ContentCachedDenseEmbedder(embedder, backend)
+    assert await cached.embed_batch(["a", "bb", "a"]) == [
+        [1.0, 0.0], [2.0, 0.0], [1.0, 0.0]]
+    assert embedder.calls == ["a", "bb"]
+
+    # a new instance reads the persistent backend
+    cached = ContentCachedDenseEmbedder(embedder, backend)
+    assert await cached.embed_batch(["bb", "ccc"]) == [
+        [2.0, 0.0], [3.0, 0.0]]
+    assert embedder.calls == ["a", "bb", "ccc"]
+    assert cached.stats() == {"hits": 1, "misses": 1, "embedded": 1}
+    assert cached.cache_key("a").startswith("test-model:")
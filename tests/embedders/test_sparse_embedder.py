@@ -0,0 +1,20 @@
+from src.embedders.sparse_embedder import BM25SparseEmbedder
+
+
+def test_tokenize_removes_stopwords() -> None:
+    embedder = BM25SparseEmbedder()
+    assert embedder.tokenize("The Policy of the Company") == [
+        "policy", "company"]
+
+
+def test_tokenize_keeps_codes() -> None:
+    embedder = BM25SparseEmbedder()
+    tokens = embedder.tokenize("Refer to POL-2024.17 for details")
+    assert "pol-2024.17" in tokens
+    assert {"pol", "2024", "17"} <= set(tokens)
+
+
+def test_embed_document_and_query() -> None:
+    embedder = BM25SparseEmbedder()
+    assert embedder.embed_document("cat dog cat") == {"cat": 2, "dog": 1}
+    assert embedder.embed_query("cat dog cat") == ["cat", "dog"]
@@ -0,0 +1,194 @@
+from collections import Counter
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import pytest
+from bson import ObjectId
+from src.chunkers.chunker import (
+    ApproximateChunkerWithOverlap, chunk_header
+)
+from src.database_handlers.database_handler import BaseDatabaseHandler
+from src.embedders.dense_embedder import BaseDenseEmbedder
+from src.indexers.reindexer import Reindexer
+from src.models import Document, Metadata, Vector
+
+
+class RecordingEmbedder(BaseDenseEmbedder):
+    model = "test-model"
+
+    def __init__(self):
+        self.embedded: List[str] = []
+
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        return [float(len(text)), 1.0]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [await self.embed_text(text) for text in texts]
+
+
+class InMemoryHandler(BaseDatabaseHandler):
+    def __init__(self, vector_layout: str = "embedded"):
+        self.vector_layout = vector_layout
+        self.documents: Dict[ObjectId, Document] = {}
+        self.vectors: List[Vector] = []
+        self.flushes = 0
+
+    async def upload_document(self, document: Document) -> ObjectId:
+        document_id = ObjectId()
+        self.documents[document_id] = document
+        return document_id
+
+    async def delete_document(self, document_id: ObjectId) -> None:
+        pass
+
+    async def upload_vector(self, vector: Vector) -> ObjectId:
+        self.vectors.append(vector)
+        return ObjectId()
+
+    async def delete_vector(self, vector_id: ObjectId) -> None:
+        pass
+
+    async def delete_all_documents(self) -> int:
+        count = len(self.documents)
+        self.documents = {}
+        self.vectors = []
+        return count
+
+    async def find_parent_ids(self, vector_ids: List[str]) -> List[str]:
+        return list({
+            v.parent_id for v in self.vectors if v.vector_id in vector_ids})
+
+    async def flush(self) -> None:
+        self.flushes += 1
+
+    async def iter_documents(
+        self,
+        document_ids: Optional[List[ObjectId]] = None
+    ) -> AsyncIterator[Tuple[ObjectId, Document]]:
+        for document_id, document in self.documents.items():
+            if document_ids is None or document_id in document_ids:
+                yield document_id, document
+
+    async def get_document_vectors(
+        self,
+        document_id: ObjectId
+    ) -> List[Vector]:
+        return [v for v in self.vectors if v.parent_id == str(document_id)]
+
+    async def replace_document_vectors(
+        self,
+        document_id: ObjectId,
+        added: List[Vector],
+        removed_vector_ids: List[str]
+    ) -> None:
+        self.vectors = [
+            v for v in self.vectors if v.vector_id not in removed_vector_ids
+        ] + added
+
+
+@pytest.fixture
+def metadata() -> Metadata:
+    return Metadata(
+        title="Test Title",
+        author="Test Author",
+        description="Test Subject",
+        keywords=["test"],
+        created_at="2024-01-01"
+    )
+
+
+async def index(
+    handler: InMemoryHandler,
+    reindexer: Reindexer,
+    document: Document
+) -> ObjectId:
+    document_id = await handler.upload_document(document)
+    chunks = await reindexer.chunker.chunk_text(
+        document.text, document.metadata)
+    await handler.upload_vectors([
+        Vector(
+            vector_embedding=[0.0, 1.0],
+            vector_id=str(ObjectId()),
+            text=chunk,
+            metadata=document.metadata,
+            parent_id=str(document_id)
+        )
+        for chunk in chunks
+    ])
+    return document_id
+
+
+@pytest.mark.asyncio
+async def test_reindex_unchanged_chunking_embeds_nothing(metadata) -> None:
+    handler = InMemoryHandler()
+    embedder = RecordingEmbedder()
+    reindexer = Reindexer(
+        ApproximateChunkerWithOverlap(chunk_size=16, chunk_overlap=4),
+        embedder, handler)
+    text = " ".join(f"word{i}" for i in range(100))
+    await index(handler, reindexer, Document(text=text, metadata=metadata))
+    vectors = list(handler.vectors)
+
+    response = await reindexer.reindex()
+    assert response.documents == 1
+    assert response.changed_documents == 0
+    assert response.unchanged_chunks == len(vectors)
+    assert embedder.embedded == []
+    assert handler.vectors == vectors
+    assert handler.flushes == 1
+
+
+@pytest.mark.asyncio
+async def test_reindex_embeds_only_changed_chunks(metadata) -> None:
+    handler = InMemoryHandler()
+    embedder = RecordingEmbedder()
+    old_chunker = ApproximateChunkerWithOverlap(chunk_size=16, chunk_overlap=4)
+    reindexer = Reindexer(old_chunker, embedder, handler)
+    # a repeated text gives repeated chunks
+    text = " ".join(f"word{i % 27}" for i in range(108))
+    document_id = await index(
+        handler, reindexer, Document(text=text, metadata=metadata))
+    other_id = await index(
+        handler, reindexer, Document(text="short text", metadata=metadata))
+
+    new_chunker = ApproximateChunkerWithOverlap(chunk_size=16, chunk_overlap=0)
+    reindexer = Reindexer(new_chunker, embedder, handler)
+    response = await reindexer.reindex([document_id])
+
+    old_chunks = await old_chunker.chunk_text(text, metadata)
+    new_chunks = await new_chunker.chunk_text(text, metadata)
+    assert response.documents == 1
+    assert response.changed_documents == 1
+    assert Counter(embedder.embedded) == Counter(new_chunks) - Counter(
+        old_chunks)
+    assert response.added_chunks == len(embedder.embedded)
+    assert response.unchanged_chunks == len(new_chunks) - len(
+        embedder.embedded)
+    assert Counter(
+        v.text for v in await handler.get_document_vectors(document_id)
+    ) == Counter(new_chunks)
+    assert len(await handler.get_document_vectors(other_id)) == 1
+
+
+@pytest.mark.asyncio
+async def test_reindex_normalized_vectors_get_spans(metadata) -> None:
+    handler = InMemoryHandler(vector_layout="normalized")
+    embedder = RecordingEmbedder()
+    reindexer = Reindexer(
+        ApproximateChunkerWithOverlap(chunk_size=16, chunk_overlap=4),
+        embedder, handler)
+    text = "\n".join(f"word{i}  word{i + 1}" for i in range(50))
+    document_id = await handler.upload_document(
+        Document(text=text, metadata=metadata))
+
+    response = await reindexer.reindex()
+    vectors = await handler.get_document_vectors(document_id)
+    assert response.added_chunks == len(vectors) > 1
+    header = chunk_header(metadata)
+    for vector in vectors:
+        assert vector.span is not None
+        start, end = vector.span
+        assert vector.text == header + text[start:end]
@@ -0,0 +1,191 @@
+from io import BytesIO
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import pytest
+from bson import ObjectId
+from starlette.datastructures import UploadFile
+from src.chunkers.chunker import ApproximateChunkerWithOverlap
+from src.database_handlers.database_handler import BaseDatabaseHandler
+from src.embedders.dense_embedder import BaseDenseEmbedder
+from src.indexers.pdf_indexer import PDFIndexer, StreamingPDFIndexer
+from src.models import Document, Vector
+from src.parsers.parser import AdvancedPDFParser, StreamingPDFParser
+
+
+class LengthEmbedder(BaseDenseEmbedder):
+    model = "test-model"
+
+    def __init__(self, fail_after: Optional[int] = None):
+        self.batch_sizes: List[int] = []
+        self.fail_after = fail_after
+
+    async def embed_text(
+        self,
+        text: str,
+        input_type: str = "search_document"
+    ) -> List[float]:
+        return [float(len(text)), 1.0]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if self.fail_after is not None \
+                and len(self.batch_sizes) >= self.fail_after:
+            raise RuntimeError("embedding failed")
+        self.batch_sizes.append(len(texts))
+        return [await self.embed_text(text) for text in texts]
+
+
+class InMemoryHandler(BaseDatabaseHandler):
+    def __init__(self):
+        self.documents: Dict[ObjectId, Document] = {}
+        self.vectors: List[Vector] = []
+
+    async def upload_document(self, document: Document) -> ObjectId:
+        document_id = ObjectId()
+        self.documents[document_id] = document
+        return document_id
+
+    async def upload_document_with_vectors(
+        self,
+        document: Document,
+        vectors: List[Vector],
+        document_id: Optional[ObjectId] = None
+    ) -> ObjectId:
+        document_id = document_id or ObjectId()
+        self.documents[document_id] = document
+        self.vectors.extend(vectors)
+        return document_id
+
+    async def delete_document(self, document_id: ObjectId) -> None:
+        self.documents.pop(document_id, None)
+        self.vectors = [
+            vector for vector in self.vectors
+            if vector.parent_id != str(document_id)
+        ]
+
+    async def upload_vector(self, vector: Vector) -> ObjectId:
+        self.vectors.append(vector)
+        return ObjectId()
+
+    async def delete_vector(self, vector_id: ObjectId) -> None:
+        pass
+
+    async def delete_all_documents(self) -> int:
+        count = len(self.documents)
+        self.documents = {}
+        self.vectors = []
+        return count
+
+    async def find_parent_ids(self, vector_ids: List[str]) -> List[str]:
+        return list({
+            v.parent_id for v in self.vectors if v.vector_id in vector_ids})
+
+    async def iter_documents(
+        self,
+        document_ids: Optional[List[ObjectId]] = None
+    ) -> AsyncIterator[Tuple[ObjectId, Document]]:
+        for document_id, document in self.documents.items():
+            if document_ids is None or document_id in document_ids:
+                yield document_id, document
+
+    async def get_document_vectors(
+        self,
+        document_id: ObjectId
+    ) -> List[Vector]:
+        return [v for v in self.vectors if v.parent_id == str(document_id)]
+
+    async def replace_document_vectors(
+        self,
+        document_id: ObjectId,
+        added: List[Vector],
+        removed_vector_ids: List[str]
+    ) -> None:
+        self.vectors = [
+            v for v in self.vectors if v.vector_id not in removed_vector_ids
+        ] + added
+
+    async def find_document_by_file_hash(
+        self,
+        file_hash: str
+    ) -> Optional[ObjectId]:
+        for document_id, document in self.documents.items():
+            if document.file_hash == file_hash:
+                return document_id
+        return None
+
+
+@pytest.fixture
+def sample_pdf() -> bytes:
+    with open("examples/pdfs/Employee Handbook 2013-14.pdf", "rb") as file:
+        return file.read()
+
+
+def make_indexer(
+    embedder: BaseDenseEmbedder,
+    handler: BaseDatabaseHandler
+) -> StreamingPDFIndexer:
+    return StreamingPDFIndexer(
+        parser=StreamingPDFParser(),
+        chunker=ApproximateChunkerWithOverlap(
+            chunk_size=128, chunk_overlap=32),
+        embedder=embedder,
+        database_handler=handler,
+        embed_batch_size=8,
+        max_concurrent_batches=2,
+        queue_size=1
+    )
+
+
+@pytest.mark.asyncio
+async def test_streaming_indexer_matches_batch_indexing(
+    sample_pdf: bytes
+) -> None:
+    embedder = LengthEmbedder()
+    handler = InMemoryHandler()
+    indexer = make_indexer(embedder, handler)
+    document_id = await indexer.index_document(
+        UploadFile(filename="handbook.pdf", file=BytesIO(sample_pdf)))
+
+    text, metadata = await AdvancedPDFParser().parse(BytesIO(sample_pdf))
+    chunks = await indexer.chunker.chunk_text(text, metadata)
+    document = handler.documents[ObjectId(document_id)]
+    assert document.text == text
+    assert document.metadata == metadata
+    assert [vector.text for vector in handler.vectors] == chunks
+    assert all(
+        vector.parent_id == document_id for vector in handler.vectors)
+    assert max(embedder.batch_sizes) == 8
+    assert sum(embedder.batch_sizes) == len(chunks)
+
+
+@pytest.mark.asyncio
+async def test_identical_upload_is_short_circuited(sample_pdf: bytes) -> None:
+    embedder = LengthEmbedder()
+    handler = InMemoryHandler()
+    streaming_indexer = make_indexer(embedder, handler)
+    document_id = await streaming_indexer.index_document(
+        UploadFile(filename="handbook.pdf", file=BytesIO(sample_pdf)))
+    calls = len(embedder.batch_sizes)
+
+    pdf_indexer = PDFIndexer(
+        parser=AdvancedPDFParser(),
+        chunker=streaming_indexer.chunker,
+        embedder=embedder,
+        database_handler=handler
+    )
+    for indexer in (streaming_indexer, pdf_indexer):
+        assert await indexer.index_document(UploadFile(
+            filename="copy.pdf", file=BytesIO(sample_pdf))) == document_id
+    assert len(embedder.batch_sizes) == calls
+    assert len(handler.documents) == 1
+
+
+@pytest.mark.asyncio
+async def test_streaming_indexer_deletes_vectors_on_failure(
+    sample_pdf: bytes
+) -> None:
+    handler = InMemoryHandler()
+    indexer = make_indexer(LengthEmbedder(fail_after=3), handler)
+    with pytest.raises(RuntimeError):
+        await indexer.index_document(
+            UploadFile(filename="handbook.pdf", file=BytesIO(sample_pdf)))
+    assert handler.documents == {}
+    assert handler.vectors == []
@@ -0,0 +1,81 @@
+import asyncio
+from io import BytesIO
+from typing import List
+import pytest
+from starlette.datastructures import UploadFile
+from src.jobs.job_queue import FairJobQueue, Job, QueueFullError
+
+
+def upload(name: str) -> UploadFile:
+    return UploadFile(filename=name, file=BytesIO(name.encode()))
+
+
+async def wait_until_idle(queue: FairJobQueue, job_ids: List[str]) -> None:
+    while any(
+        queue.get_status(job_id).stage not in ("done", "failed")
+        for job_id in job_ids
+    ):
+        await asyncio.sleep(0.001)
+
+
+@pytest.mark.asyncio
+async def test_job_queue_serves_tenants_in_turn() -> None:
+    processed: List[str] = []
+
+    async def runner(job: Job) -> str:
+        content = await job.upload_file().read()
+        processed.append(content.decode())
+        job.report("writing", 3)
+        return f"id-{content.decode()}"
+
+    queue = FairJobQueue(runner, num_workers=1)
+    statuses = [await queue.submit("tenant_a", upload(f"a{i}"))
+                for i in range(3)]
+    statuses.append(await queue.submit("tenant_b", upload("b0")))
+    assert all(status.stage == "queued" for status in statuses)
+
+    queue.start()
+    await wait_until_idle(queue, [status.job_id for status in statuses])
+    await queue.stop()
+    assert processed == ["a0", "b0", "a1", "a2"]
+    status = queue.get_status(statuses[-1].job_id)
+    assert status.stage == "done"
+    assert status.document_id == "id-b0"
+    assert status.num_chunks == 3
+
+
+@pytest.mark.asyncio
+async def test_job_queue_isolates_failures() -> None:
+    async def runner(job: Job) -> str:
+        if job.status.filename == "broken.pdf":
+            raise ValueError("cannot parse")
+        return "id"
+
+    queue = FairJobQueue(runner, num_workers=2)
+    queue.start()
+    broken = await queue.submit("tenant", upload("broken.pdf"))
+    valid = await queue.submit("tenant", upload("valid.pdf"))
+    await wait_until_idle(queue, [broken.job_id, valid.job_id])
+    await queue.stop()
+    assert queue.get_status(broken.job_id).stage == "failed"
+    assert queue.get_status(broken.job_id).error == "cannot parse"
+    assert queue.get_status(valid.job_id).stage == "done"
+
+
+@pytest.mark.asyncio
+async def test_job_queue_bounds_pending_and_finished_jobs() -> None:
+    async def runner(job: Job) -> str:
+        return "id"
+
+    queue = FairJobQueue(runner, num_workers=1, max_pending=2,
+                         max_finished=1)
+    first = await queue.submit("tenant", upload("a"))
+    second = await queue.submit("tenant", upload("b"))
+    with pytest.raises(QueueFullError):
+        await queue.submit("tenant", upload("c"))
+
+    queue.start()
+    await wait_until_idle(queue, [second.job_id])
+    await queue.stop()
+    assert queue.get_status(first.job_id) is None
+    assert queue.get_status(second.job_id).stage == "done"
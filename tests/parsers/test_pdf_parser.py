@@ -1,7 +1,15 @@
+import asyncio
+import hashlib
+import signal
+import time
 import pytest
 from starlette.datastructures import UploadFile
 from io import BytesIO
-from src.parsers.parser import AdvancedPDFParser
+import src.parsers.parser as parser_module
+from src.parsers.parser import (
+    AdvancedPDFParser, ParserError, ParserTimeoutError, ProcessPoolPDFParser,
+    StreamingPDFParser
+)
 from src.models import Metadata
 
 
@@ -54,3 +62,97 @@ async def test_advanced_pdf_parser_3(sample_pdf_3: BytesIO) -> None:
     metadata = await parser.extract_metadata(bytes_io)
     assert isinstance(text, str)
     assert isinstance(metadata, Metadata)
+
+
+@pytest.mark.asyncio
+async def test_parse_matches_separate_extraction(
+    sample_pdf_2: BytesIO
+) -> None:
+    parser = AdvancedPDFParser()
+    text, metadata = await parser.parse(sample_pdf_2)
+    assert text == await parser.extract_text(sample_pdf_2)
+    assert metadata == await parser.extract_metadata(sample_pdf_2)
+
+
+@pytest.mark.asyncio
+async def test_process_pool_parser(sample_pdf_2: BytesIO) -> None:
+    parser = ProcessPoolPDFParser(max_workers=1, timeout=30.0)
+    try:
+        text, metadata = await parser.parse(sample_pdf_2)
+    finally:
+        parser.shutdown()
+    expected_text, expected_metadata = await AdvancedPDFParser().parse(
+        sample_pdf_2)
+    assert text == expected_text
+    assert metadata == expected_metadata
+
+
+@pytest.mark.asyncio
+async def test_process_pool_parser_invalid_pdf() -> None:
+    parser = ProcessPoolPDFParser(max_workers=1, timeout=30.0)
+    try:
+        with pytest.raises(ParserError):
+            await parser.parse(BytesIO(b"not a pdf"))
+    finally:
+        parser.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_advanced_pdf_parser_invalid_pdf() -> None:
+    with pytest.raises(ParserError):
+        await AdvancedPDFParser().parse(BytesIO(b"not a pdf"))
+
+
+@pytest.mark.asyncio
+async def test_process_pool_parser_replaces_stuck_pool(
+    sample_pdf_2: BytesIO
+) -> None:
+    # the backstop fires before the spawned worker has even started
+    parser = ProcessPoolPDFParser(max_workers=1, timeout=0.01)
+    executor = parser._executor
+    try:
+        parse = asyncio.ensure_future(parser.parse(sample_pdf_2))
+        await asyncio.sleep(0)
+        processes = list(executor._processes.values())
+        assert processes
+        with pytest.raises(ParserTimeoutError):
+            await parse
+        assert parser._executor is not executor
+        for process in processes:
+            process.join(timeout=10)
+            assert not process.is_alive()
+        parser.timeout = 30.0
+        text, _ = await parser.parse(sample_pdf_2)
+        assert text
+    finally:
+        parser.shutdown()
+
+
+def test_parse_in_worker_times_out(
+    sample_pdf_3: BytesIO,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def slow_parse(data: bytes) -> None:
+        time.sleep(5)
+
+    monkeypatch.setattr(parser_module, "parse_pdf", slow_parse)
+    handler = signal.getsignal(signal.SIGALRM)
+    parser_module._init_parser_worker(None)
+    try:
+        with pytest.raises(ParserTimeoutError):
+            parser_module._parse_pdf_in_worker(sample_pdf_3.getvalue(), 0.1)
+    finally:
+        signal.signal(signal.SIGALRM, handler)
+
+
+@pytest.mark.asyncio
+async def test_streaming_parser_reads_pages(sample_pdf_2: BytesIO) -> None:
+    expected_text, expected_metadata = await AdvancedPDFParser().parse(
+        sample_pdf_2)
+    parser = StreamingPDFParser(read_size=4096)
+    upload = UploadFile(filename="acme_earnings.pdf", file=sample_pdf_2)
+    async with parser.open_pages(upload) as (file_hash, metadata, pages):
+        text = "".join([page async for page in pages])
+    assert file_hash == hashlib.sha256(sample_pdf_2.getvalue()).hexdigest()
+    assert text == expected_text
+    assert metadata == expected_metadata
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from src.registry.component_registry import ComponentRegistry
+
+
+def test_get_creates_a_component_once_per_key() -> None:
+    registry = ComponentRegistry()
+    first = registry.get("handler", dict, key="tenant1")
+    assert registry.get("handler", dict, key="tenant1") is first
+    assert registry.get("handler", dict, key="tenant2") is not first
+    assert registry.find("handler", "tenant3") is None
+    assert set(registry.find_all("handler")) == {"tenant1", "tenant2"}
+    assert registry.stats() == {"components": 2, "created": 2, "reused": 1}
+
+
+@pytest.mark.asyncio
+async def test_get_async_creates_a_component_once_under_concurrency() -> None:
+    registry = ComponentRegistry()
+    calls = 0
+
+    async def factory() -> object:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return object()
+
+    components = await asyncio.gather(*(
+        registry.get_async("pipeline", factory, key="tenant1")
+        for _ in range(10)
+    ))
+    assert calls == 1
+    assert all(component is components[0] for component in components)
+    assert registry.stats()["reused"] == 9
+
+
+@pytest.mark.asyncio
+async def test_aclose_releases_components_in_reverse_order() -> None:
+    registry = ComponentRegistry()
+    closed = []
+
+    async def close_client() -> None:
+        closed.append("client")
+
+    def close_broken() -> None:
+        raise RuntimeError("already closed")
+
+    registry.get("client", object)
+    registry.on_close(close_client)
+    registry.on_close(close_broken)
+    registry.on_close(lambda: closed.append("parser"))
+    await registry.aclose()
+    assert closed == ["parser", "client"]
+    assert registry.find("client") is None
@@ -0,0 +1,17 @@
+import pytest
+from src.retrievers.hybrid_retriever import reciprocal_rank_fusion
+
+
+def test_reciprocal_rank_fusion() -> None:
+    dense = [("a", 0.9), ("b", 0.8), ("c", 0.7)]
+    sparse = [("c", 12.0), ("d", 3.0)]
+    fused = reciprocal_rank_fusion([dense, sparse], k=3, rrf_k=60)
+    # "c" is found by both searches
+    assert [vector_id for vector_id, _ in fused] == ["c", "a", "b"]
+    assert fused[0][1] == pytest.approx(1 / 63 + 1 / 61)
+
+
+def test_reciprocal_rank_fusion_empty_ranking() -> None:
+    dense = [("a", 0.9), ("b", 0.8)]
+    assert reciprocal_rank_fusion([dense, []], k=5) == [
+        ("a", pytest.approx(1 / 61)), ("b", pytest.approx(1 / 62))]
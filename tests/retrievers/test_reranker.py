@@ -0,0 +1,68 @@
+import asyncio
+from typing import List
+import pytest
+from src.models import Metadata, Vector
+from src.retrievers.reranker import (
+    BaseReranker, CachedReranker, rerank_with_deadline
+)
+
+
+def make_responses(n: int) -> List[Vector]:
+    return [
+        Vector(
+            vector_id=str(i),
+            text=f"text {i}",
+            metadata=Metadata(
+                title="test",
+                author="test",
+                description="test",
+                keywords=["test"],
+                created_at=""
+            ),
+            parent_id="parent",
+            score=1.0 - i / n
+        )
+        for i in range(n)
+    ]
+
+
+class ReversingReranker(BaseReranker):
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def rerank_responses(
+        self,
+        query: str,
+        responses: List[Vector],
+        num_responses: int = 3
+    ) -> List[Vector]:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return responses[::-1][:num_responses]
+
+
+@pytest.mark.asyncio
+async def test_cached_reranker() -> None:
+    reranker = ReversingReranker()
+    cached = CachedReranker(reranker)
+    responses = make_responses(5)
+    first = await cached.rerank_responses("query", responses)
+    second = await cached.rerank_responses("query", make_responses(5))
+    assert [v.vector_id for v in first] == ["4", "3", "2"]
+    assert [v.vector_id for v in second] == ["4", "3", "2"]
+    assert reranker.calls == 1
+    # other candidates are reranked again
+    await cached.rerank_responses("query", responses[:4])
+    assert reranker.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_rerank_with_deadline_falls_back_to_score_order() -> None:
+    responses = make_responses(5)
+    reranked = await rerank_with_deadline(
+        ReversingReranker(delay=1.0), "query", responses, timeout=0.01)
+    assert [v.vector_id for v in reranked] == ["0", "1", "2"]
+    reranked = await rerank_with_deadline(
+        ReversingReranker(), "query", responses, timeout=1.0)
+    assert [v.vector_id for v in reranked] == ["4", "3", "2"]
@@ -1,6 +1,7 @@
 # test knn retriever
 import pytest
-from src.retrievers.dense_retriever import NNRetriever
+from src.retrievers.dense_retriever import NNRetriever, IndexRetriever
+from src.vector_indexes.vector_index import IVFIndex
 import motor
 from src.database_handlers.database_handler import MongoDBHandler
 import os
@@ -106,3 +107,122 @@ async def test_cosine_similarity(vector_collection, nn_retriever) -> None:
     query_embedding = np.array([0, 0, 1, 0]).tolist()
     results = await nn_retriever.retrieve(query_embedding)
     assert results[0].text == "test 2"  # parallel to query embedding
+    assert results[0].score == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_nn_retriever_ids_only(vector_collection, nn_retriever) -> None:
+    await vector_collection.delete_many({})
+    for i in range(4):
+        vector = Vector(
+            vector_embedding=np.random.rand(8).tolist(),
+            vector_id=str(i),
+            text=f"test {i}",
+            metadata=Metadata(
+                title=f"test {i}",
+                author=f"test {i}",
+                description=f"test {i}",
+                keywords=[f"test {i}"],
+                created_at=""
+            ),
+            parent_id=""
+        )
+        await vector_collection.insert_one(vector.model_dump())
+
+    query_embedding = np.random.rand(8).tolist()
+    hits = await nn_retriever.retrieve_ids(query_embedding, k=3)
+    assert len(hits) == 3
+    assert hits[0][1] >= hits[1][1] >= hits[2][1]
+
+    # embeddings are not fetched unless requested
+    results = await nn_retriever.retrieve(query_embedding, k=3)
+    assert [result.vector_id for result in results] == [
+        vector_id for vector_id, _ in hits]
+    assert all(result.vector_embedding is None for result in results)
+
+    await vector_collection.delete_many({})
+
+
+@pytest.fixture
+def index_retriever(vector_collection, tmp_path):
+    return IndexRetriever(
+        vector_collection=vector_collection,
+        vector_index=IVFIndex(path=str(tmp_path))
+    )
+
+
+@pytest.mark.asyncio
+async def test_index_retriever(vector_collection, index_retriever) -> None:
+    await vector_collection.delete_many({})
+
+    embeddings = [
+        np.array([1, 0, 0, 0]).tolist(),
+        np.array([0, 1, 0, 0]).tolist(),
+        np.array([0, 0, 1, 0]).tolist(),
+        np.array([0, 0, 0, 1]).tolist()
+    ]
+    for i in range(4):
+        vector = Vector(
+            vector_embedding=embeddings[i],
+            vector_id=str(uuid.uuid4()),
+            text=f"test {i}",
+            metadata=Metadata(
+                title=f"test {i}",
+                author=f"test {i}",
+                description=f"test {i}",
+                keywords=[f"test {i}"],
+                created_at=""
+            ),
+            parent_id=""
+        )
+        await vector_collection.insert_one(vector.model_dump())
+
+    await index_retriever.vector_index.sync_with_collection(vector_collection)
+    query_embedding = np.array([0, 0, 1, 0]).tolist()
+    results = await index_retriever.retrieve(query_embedding, k=2)
+    assert len(results) == 2
+    assert results[0].text == "test 2"
+
+    await vector_collection.delete_many({})
+
+
+@pytest.mark.asyncio
+async def test_nn_retriever_binary_embeddings(mongodb_handler) -> None:
+    await mongodb_handler.vector_collection.delete_many({})
+    mongodb_handler.embedding_format = "binary"
+    binary_retriever = NNRetriever(
+        mongodb_handler.vector_collection,
+        embedding_format="binary",
+        batch_size=2
+    )
+
+    embeddings = [
+        np.array([1, 0, 0, 0]).tolist(),
+        np.array([0, 1, 0, 0]).tolist(),
+        np.array([0, 0, 2, 0]).tolist(),
+        np.array([0, 0, 0, 1]).tolist()
+    ]
+    for i in range(4):
+        vector = Vector(
+            vector_embedding=embeddings[i],
+            vector_id=str(uuid.uuid4()),
+            text=f"test {i}",
+            metadata=Metadata(
+                title=f"test {i}",
+                author=f"test {i}",
+                description=f"test {i}",
+                keywords=[f"test {i}"],
+                created_at=""
+            ),
+            parent_id=""
+        )
+        await mongodb_handler.upload_vector(vector)
+
+    query_embedding = np.array([0, 0, 1, 0]).tolist()
+    results = await binary_retriever.retrieve(
+        query_embedding, k=2, include_embedding=True)
+    assert len(results) == 2
+    assert results[0].text == "test 2"
+    assert results[0].vector_embedding == [0.0, 0.0, 1.0, 0.0]
+
+    await mongodb_handler.vector_collection.delete_many({})
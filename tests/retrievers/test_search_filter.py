@@ -0,0 +1,34 @@
+from src.models import SearchFilter
+from src.retrievers.search_filter import to_mongo_filter, to_pdf_date
+
+
+def test_to_pdf_date() -> None:
+    assert to_pdf_date("2024-01-31") == "D:20240131"
+
+
+def test_to_mongo_filter_empty() -> None:
+    assert to_mongo_filter(SearchFilter()) == {}
+
+
+def test_to_mongo_filter() -> None:
+    search_filter = SearchFilter(
+        parent_ids=["a", "b"],
+        author="Jane Doe",
+        keywords=["insurance"],
+    )
+    assert to_mongo_filter(search_filter) == {"$and": [
+        {"parent_id": {"$in": ["a", "b"]}},
+        {"metadata.author": "Jane Doe"},
+        {"metadata.keywords": {"$in": ["insurance"]}},
+    ]}
+
+
+def test_to_mongo_filter_date_range() -> None:
+    query = to_mongo_filter(SearchFilter(
+        created_from="2024-01-01", created_to="2024-01-31"))
+    iso_range, pdf_range = [
+        condition["metadata.created_at"] for condition in query["$or"]]
+    # the end date is inclusive in both formats
+    assert iso_range["$gte"] <= "2024-01-31T23:59:59" <= iso_range["$lte"]
+    assert pdf_range["$gte"] <= "D:20240131235959+01'00'" <= pdf_range["$lte"]
+    assert not pdf_range["$gte"] <= "D:20240201000000" <= pdf_range["$lte"]
@@ -1,4 +1,5 @@
 # test service response
+import json
 import requests
 import pytest
 
@@ -57,6 +58,35 @@ async def test_upload_endpoint_single_file() -> None:
     assert len(response.json()) == 1
 
 
+@pytest.mark.asyncio
+async def test_upload_endpoint_reports_failed_files() -> None:
+    pdf_path = "examples/pdfs/ACME_Earnings.pdf"
+    files = [
+        (
+            "files",
+            (pdf_path.split("/")[-1], open(pdf_path, "rb"), "application/pdf")
+        ),
+        ("files", ("broken.pdf", b"not a pdf", "application/pdf"))
+    ]
+    response = requests.post(
+        "http://0.0.0.0:8000/upload/",
+        files=files,
+        params={"db_name": "test"}
+    )
+    assert response.status_code == 200
+    indexed, broken = response.json()
+    assert indexed["document_id"] is not None
+    assert broken["document_id"] is None
+    assert broken["error"]
+    # the upload fails as a whole when no file could be indexed
+    response = requests.post(
+        "http://0.0.0.0:8000/upload/",
+        files=[("files", ("broken.pdf", b"not a pdf", "application/pdf"))],
+        params={"db_name": "test"}
+    )
+    assert response.status_code == 422
+
+
 @pytest.mark.asyncio
 async def test_delete_endpoint() -> None:
     response = requests.delete(
@@ -66,6 +96,22 @@ async def test_delete_endpoint() -> None:
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_bulk_delete_endpoint() -> None:
+    response = requests.delete(
+        "http://0.0.0.0:8000/delete/bulk/",
+        json={"document_ids": ["666666666666666666666666"], "db_name": "test"}
+    )
+    assert response.status_code == 200
+    assert response.json()["deleted_documents"] == 0
+    # either document ids or all_documents must be given
+    response = requests.delete(
+        "http://0.0.0.0:8000/delete/bulk/",
+        json={"db_name": "test"}
+    )
+    assert response.status_code == 400
+
+
 @pytest.mark.asyncio
 async def test_generate_endpoint() -> None:
     response = requests.post(
@@ -75,3 +121,31 @@ async def test_generate_endpoint() -> None:
     assert response.status_code == 200
     assert "paris" in response.json()["response"].lower()
     print(response.json())
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_endpoint() -> None:
+    response = requests.post(
+        "http://0.0.0.0:8000/generate/stream/",
+        json={"query": "What is the capital of France?", "db_name": "test"},
+        stream=True
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        json.loads(line[len("data: "):])
+        for line in response.iter_lines(decode_unicode=True)
+        if line.startswith("data: ")
+    ]
+    assert any(event["event"] == "token" for event in events)
+    assert events[-1]["event"] == "done"
+    assert "paris" in events[-1]["response"]["response"].lower()
+
+
+@pytest.mark.asyncio
+async def test_reindex_endpoint_invalid_document_id() -> None:
+    response = requests.post(
+        "http://0.0.0.0:8000/reindex/",
+        json={"document_id": "not-an-id", "db_name": "test"}
+    )
+    assert response.status_code == 400
@@ -0,0 +1,59 @@
+import httpx
+import pytest
+from src.utils.retry import get_retry_after, is_retryable, retry_async
+
+
+class ApiError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_is_retryable() -> None:
+    assert is_retryable(ApiError(429))
+    assert is_retryable(ApiError(503))
+    assert is_retryable(httpx.ConnectError("connection refused"))
+    assert not is_retryable(ApiError(400))
+    assert not is_retryable(ValueError("invalid"))
+
+
+def test_get_retry_after() -> None:
+    assert get_retry_after(ApiError(429, {"retry-after": "2"})) == 2.0
+    assert get_retry_after(ApiError(429)) is None
+
+
+@pytest.mark.asyncio
+async def test_retry_async_retries_transient_errors() -> None:
+    errors = [ApiError(429), ApiError(502)]
+
+    async def call() -> str:
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert await retry_async(call, base_delay=0.001) == "ok"
+    assert errors == []
+
+
+@pytest.mark.asyncio
+async def test_retry_async_gives_up() -> None:
+    calls = []
+
+    async def call() -> str:
+        calls.append(1)
+        raise ApiError(500)
+
+    with pytest.raises(ApiError):
+        await retry_async(call, max_retries=2, base_delay=0.001)
+    assert len(calls) == 3
+
+    calls.clear()
+
+    async def bad_request() -> str:
+        calls.append(1)
+        raise ApiError(400)
+
+    with pytest.raises(ApiError):
+        await retry_async(bad_request, base_delay=0.001)
+    assert len(calls) == 1
@@ -0,0 +1,144 @@
+import uuid
+from src.models import Metadata, Vector
+from src.vector_indexes.bm25_index import BM25Index
+
+
+def make_text_vectors(texts, parent_id="parent"):
+    return [
+        Vector(
+            vector_id=str(uuid.uuid4()),
+            text=text,
+            metadata=Metadata(
+                title="test",
+                author="test",
+                description="test",
+                keywords=["test"],
+                created_at=""
+            ),
+            parent_id=parent_id
+        )
+        for text in texts
+    ]
+
+
+TEXTS = [
+    "the policy number POL-2024 covers fire damage",
+    "water damage is not covered by the policy",
+    "contact the insurance agent for a claim",
+    "fire fire fire safety regulations",
+]
+
+
+def test_bm25_index_search(tmp_path) -> None:
+    index = BM25Index(path=str(tmp_path))
+    vectors = make_text_vectors(TEXTS)
+    index.add(vectors)
+    results = index.search("POL-2024", k=3)
+    assert results[0][0] == vectors[0].vector_id
+    assert len(results) == 1
+    # the chunk with the highest term frequency ranks first
+    results = index.search("fire", k=3)
+    assert [v for v, _ in results] == [
+        vectors[3].vector_id, vectors[0].vector_id]
+    assert index.search("unknown words", k=3) == []
+
+
+def test_bm25_index_remove_document(tmp_path) -> None:
+    index = BM25Index(path=str(tmp_path))
+    kept = make_text_vectors(TEXTS[:2], parent_id="kept")
+    removed = make_text_vectors(TEXTS[2:], parent_id="removed")
+    index.add(kept + removed)
+    index.remove_document("removed")
+    assert len(index) == 2
+    assert index.search("claim", k=3) == []
+    assert [v for v, _ in index.search("fire", k=3)] == [kept[0].vector_id]
+
+
+def test_bm25_index_save_and_load(tmp_path) -> None:
+    index = BM25Index(path=str(tmp_path))
+    vectors = make_text_vectors(TEXTS[:2], parent_id="first")
+    index.add(vectors)
+    index.save()
+    more_vectors = make_text_vectors(TEXTS[2:], parent_id="second")
+    index.add(more_vectors)
+    index.remove_document("first")
+    index.save()
+
+    loaded = BM25Index(path=str(tmp_path))
+    assert loaded.load()
+    assert len(loaded) == 2
+    assert loaded.search("policy", k=3) == []
+    assert loaded.search("claim", k=3)[0][0] == more_vectors[0].vector_id
+    assert loaded.search("fire", k=3) == index.search("fire", k=3)
+
+
+def test_bm25_index_merges_segments(tmp_path) -> None:
+    index = BM25Index(path=str(tmp_path), max_segments=2)
+    for i, text in enumerate(TEXTS):
+        index.add(make_text_vectors([text], parent_id=str(i)))
+        index.save()
+    assert len(index.storage.read_manifest()["segments"]) <= 2
+
+    loaded = BM25Index(path=str(tmp_path))
+    assert loaded.load()
+    assert len(loaded) == len(TEXTS)
+
+
+def test_bm25_index_reloads_changes_of_other_workers(tmp_path) -> None:
+    writer = BM25Index(path=str(tmp_path))
+    reader = BM25Index(path=str(tmp_path))
+    writer.add(make_text_vectors(TEXTS[:1]))
+    writer.save()
+    assert len(reader.search("fire", k=3)) == 1
+    vectors = make_text_vectors(TEXTS[3:])
+    writer.add(vectors)
+    writer.save()
+    assert reader.search("fire", k=3)[0][0] == vectors[0].vector_id
+
+
+def test_bm25_index_search_candidate_ids(tmp_path) -> None:
+    index = BM25Index(path=str(tmp_path))
+    vectors = make_text_vectors(TEXTS)
+    index.add(vectors)
+    results = index.search(
+        "fire damage", k=3, candidate_ids={vectors[0].vector_id})
+    assert [v for v, _ in results] == [vectors[0].vector_id]
+    results = index.search(
+        "fire", k=3, candidate_ids={v.vector_id for v in vectors[1:]})
+    assert [v for v, _ in results] == [vectors[3].vector_id]
+
+
+def test_bm25_index_concurrent_writers(tmp_path) -> None:
+    first = BM25Index(path=str(tmp_path))
+    second = BM25Index(path=str(tmp_path))
+    first.add(make_text_vectors(TEXTS[:1], parent_id="a"))
+    second.add(make_text_vectors(TEXTS[1:2], parent_id="b"))
+    first.save()
+    second.save()
+    loaded = BM25Index(path=str(tmp_path))
+    assert loaded.load()
+    assert len(loaded) == 2
+
+    first.remove_document("b")
+    first.save()
+    assert loaded.load()
+    assert len(loaded) == 1
+    assert loaded.search("water", k=3) == []
+
+
+def test_bm25_index_re_added_chunks_survive_reload(tmp_path) -> None:
+    index = BM25Index(path=str(tmp_path))
+    vectors = make_text_vectors(TEXTS, parent_id="a")
+    index.add(vectors)
+    index.save()
+    # re-indexing a document removes its chunks and adds the current ones,
+    # including the unchanged chunks with the same vector ids
+    index.remove_document("a")
+    index.add(vectors[1:])
+    index.save()
+    assert index.num_deleted() == 1
+
+    loaded = BM25Index(path=str(tmp_path))
+    assert loaded.load()
+    assert len(loaded) == len(TEXTS) - 1
+    assert loaded.search("water", k=3)[0][0] == vectors[1].vector_id
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from src.vector_indexes.compaction import IndexCompactor
+from src.vector_indexes.vector_index import FlatIndex
+
+
+@pytest.mark.asyncio
+async def test_compactor_compacts_indexes_above_threshold(
+    tmp_path,
+    make_vectors
+) -> None:
+    index = FlatIndex(path=str(tmp_path))
+    for parent_id in ["a", "b", "c", "d"]:
+        index.add(make_vectors(np.eye(4), parent_id=parent_id))
+    index.save()
+    compactor = IndexCompactor(lambda: [index], min_deleted_fraction=0.5)
+
+    index.remove_document("a")
+    assert await compactor.compact_once() == 0
+    assert index.num_deleted() == 4
+
+    index.remove_document("b")
+    assert await compactor.compact_once() == 1
+    assert index.num_deleted() == 0
+    assert len(index) == 8
+    assert compactor.stats() == {"compactions": 1, "deleted": 0}
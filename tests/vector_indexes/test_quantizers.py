@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from src.vector_indexes.evaluation import recall_at_k
+from src.vector_indexes.quantized_index import QuantizedIndex
+from src.vector_indexes.quantizers import (
+    ProductQuantizer, ScalarQuantizer, get_quantizer
+)
+from src.vector_indexes.vector_index import FlatIndex, normalize_rows
+
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(30, 64))
+    return normalize_rows(np.vstack([
+        center + 0.3 * rng.normal(size=(40, 64)) for center in centers
+    ]))
+
+
+@pytest.mark.parametrize("quantizer", [ScalarQuantizer(), ProductQuantizer()])
+def test_quantizer_scores_approximate_dot_product(
+    quantizer, embeddings
+) -> None:
+    quantizer.train(embeddings)
+    codes = quantizer.encode(embeddings)
+    assert codes.shape[0] == len(embeddings)
+    assert codes.nbytes == len(embeddings) * quantizer.code_size(64)
+    query = embeddings[0]
+    approximate = quantizer.score(codes, query)
+    exact = embeddings @ query
+    assert np.corrcoef(approximate, exact)[0, 1] > 0.9
+
+
+def test_compression_ratio() -> None:
+    assert 4 * 1024 / ScalarQuantizer().code_size(1024) == 4
+    assert 4 * 1024 / ProductQuantizer().code_size(1024) == 32
+
+
+def test_get_quantizer() -> None:
+    assert isinstance(get_quantizer("int8"), ScalarQuantizer)
+    assert isinstance(get_quantizer("pq"), ProductQuantizer)
+    with pytest.raises(ValueError):
+        get_quantizer("unknown")
+
+
+@pytest.mark.parametrize("codec", ["int8", "pq"])
+def test_quantized_index_recall(
+    tmp_path,
+    embeddings,
+    codec,
+    make_vectors
+) -> None:
+    vectors = make_vectors(embeddings)
+    exact_index = FlatIndex(path=str(tmp_path / "exact"))
+    exact_index.add(vectors)
+    index = QuantizedIndex(
+        path=str(tmp_path / codec),
+        quantizer=get_quantizer(codec),
+        min_train_size=100
+    )
+    index.add(vectors)
+    index.save()
+    assert index.memory_usage()["codes"] > 0
+    recall = recall_at_k(index, exact_index, embeddings[::50], k=10)
+    assert recall > 0.9
+
+
+def test_quantized_index_save_and_load(
+    tmp_path,
+    embeddings,
+    make_vectors
+) -> None:
+    vectors = make_vectors(embeddings)
+    index = QuantizedIndex(
+        path=str(tmp_path),
+        quantizer=ProductQuantizer(),
+        min_train_size=100
+    )
+    index.add(vectors[:600])
+    index.save()
+    index.add(vectors[600:])
+    index.save()
+
+    loaded_index = QuantizedIndex(
+        path=str(tmp_path), quantizer=ProductQuantizer())
+    assert loaded_index.load()
+    assert loaded_index.quantizer.is_trained
+    assert all(s.codes is not None for s in loaded_index._segments)
+    query = embeddings[3].tolist()
+    assert loaded_index.search(query, k=5) == index.search(query, k=5)
+    # the rescored similarity is exact
+    assert loaded_index.search(query, k=1)[0][1] == pytest.approx(1.0)
+
+
+def test_quantized_index_search_candidate_ids(
+    tmp_path,
+    embeddings,
+    make_vectors
+) -> None:
+    vectors = make_vectors(embeddings)
+    index = QuantizedIndex(
+        path=str(tmp_path), quantizer=ScalarQuantizer(), min_train_size=100)
+    index.add(vectors)
+    index.save()
+    candidates = {v.vector_id for v in vectors[400:440]}
+    results = index.search(
+        embeddings[0].tolist(), k=3, candidate_ids=candidates)
+    assert len(results) == 3
+    assert all(vector_id in candidates for vector_id, _ in results)
+
+
+def test_quantized_index_keeps_masked_rows_when_encoding(
+    tmp_path,
+    embeddings,
+    make_vectors
+) -> None:
+    index = QuantizedIndex(
+        path=str(tmp_path), quantizer=ScalarQuantizer(), min_train_size=100)
+    removed = make_vectors(embeddings[:50], parent_id="removed")
+    index.add(removed)
+    index.add(make_vectors(embeddings[50:80], parent_id="kept"))
+    index.save()
+    index.remove_document("removed")
+    # the next save trains the quantizer and encodes the first segment
+    index.add(make_vectors(embeddings[80:200], parent_id="new"))
+    index.save()
+    assert index.quantizer.is_trained
+    assert len(index) == 150
+
+    loaded_index = QuantizedIndex(
+        path=str(tmp_path), quantizer=ScalarQuantizer())
+    assert loaded_index.load()
+    assert len(loaded_index) == 150
+    removed_ids = {v.vector_id for v in removed}
+    results = loaded_index.search(embeddings[0].tolist(), k=10)
+    assert not removed_ids & {vector_id for vector_id, _ in results}
@@ -0,0 +1,328 @@
+import os
+import numpy as np
+import pytest
+from src.vector_indexes.vector_index import FlatIndex, IVFIndex
+
+
+@pytest.fixture
+def clustered_embeddings():
+    # 20 well separated clusters of 50 vectors each
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 64))
+    return np.vstack([
+        center + 0.05 * rng.normal(size=(50, 64)) for center in centers
+    ])
+
+
+def test_ivf_index_exact_search(tmp_path, make_vectors) -> None:
+    index = IVFIndex(path=str(tmp_path), exact_search_threshold=100)
+    embeddings = np.eye(4)
+    vectors = make_vectors(embeddings)
+    index.add(vectors)
+    results = index.search([0.0, 0.0, 1.0, 0.0], k=2)
+    assert len(results) == 2
+    assert results[0][0] == vectors[2].vector_id
+    assert results[0][1] == pytest.approx(1.0)
+
+
+def test_ivf_index_approximate_search(
+    tmp_path,
+    clustered_embeddings,
+    make_vectors
+) -> None:
+    index = IVFIndex(
+        path=str(tmp_path), nlist=20, nprobe=2, exact_search_threshold=100)
+    vectors = make_vectors(clustered_embeddings)
+    index.add(vectors)
+    # the clusters are trained by the save
+    index.save()
+    query = clustered_embeddings[123]
+    results = index.search(query.tolist(), k=5)
+    assert len(results) == 5
+    assert results[0][0] == vectors[123].vector_id
+    # all the neighbours belong to the same cluster
+    cluster_ids = {v.vector_id for v in vectors[100:150]}
+    assert all(vector_id in cluster_ids for vector_id, _ in results)
+
+
+def test_ivf_index_remove_document(tmp_path, make_vectors) -> None:
+    index = IVFIndex(path=str(tmp_path))
+    index.add(make_vectors(np.eye(4), parent_id="a"))
+    index.add(make_vectors(np.eye(4), parent_id="b"))
+    assert len(index) == 8
+    index.remove_document("a")
+    assert len(index) == 4
+    assert len(index.search([1.0, 0.0, 0.0, 0.0], k=10)) == 4
+
+
+def test_ivf_index_trains_on_save_and_appends_segments(
+    tmp_path,
+    clustered_embeddings,
+    make_vectors
+) -> None:
+    index = IVFIndex(
+        path=str(tmp_path), nlist=20, nprobe=2, exact_search_threshold=100)
+    vectors = make_vectors(clustered_embeddings)
+    index.add(vectors[:500])
+    # a query never trains the index, the unsaved vectors are scored exactly
+    assert index.search(clustered_embeddings[0].tolist(), k=1)[0][0] == \
+        vectors[0].vector_id
+    assert index._centroids is None
+    index.save()
+    assert index._centroids is not None
+    first_segment = dict(index._segments[0].files)
+    assert "codes" in first_segment
+
+    index.add(vectors[500:600])
+    index.save()
+    # the saved segment is kept and the new vectors get their own segment
+    assert [s.files for s in index._segments][0] == first_segment
+    assert all("codes" in s.files for s in index._segments)
+    query = clustered_embeddings[523]
+    assert index.search(query.tolist(), k=1)[0][0] == vectors[523].vector_id
+
+
+def test_ivf_index_save_and_load(
+    tmp_path,
+    clustered_embeddings,
+    make_vectors
+) -> None:
+    index = IVFIndex(
+        path=str(tmp_path), nlist=20, nprobe=2, exact_search_threshold=100)
+    vectors = make_vectors(clustered_embeddings)
+    index.add(vectors)
+    index.save()
+
+    loaded_index = IVFIndex(path=str(tmp_path), nprobe=2)
+    assert loaded_index.load()
+    assert len(loaded_index) == len(vectors)
+    query = clustered_embeddings[7].tolist()
+    assert loaded_index.search(query, k=3) == index.search(query, k=3)
+
+
+def test_ivf_index_reloads_snapshot_saved_by_other_worker(
+    tmp_path,
+    make_vectors
+) -> None:
+    reader = IVFIndex(path=str(tmp_path))
+    assert not reader.load()
+    writer = IVFIndex(path=str(tmp_path))
+    writer.add(make_vectors(np.eye(4)))
+    writer.save()
+    assert len(reader.search([1.0, 0.0, 0.0, 0.0], k=10)) == 4
+
+
+def test_flat_index_search(
+    tmp_path,
+    clustered_embeddings,
+    make_vectors
+) -> None:
+    index = FlatIndex(path=str(tmp_path))
+    vectors = make_vectors(clustered_embeddings)
+    index.add(vectors)
+    query = clustered_embeddings[42]
+    results = index.search(query.tolist(), k=5)
+    expected = np.argsort(
+        -(clustered_embeddings / np.linalg.norm(
+            clustered_embeddings, axis=1, keepdims=True)) @ (
+            query / np.linalg.norm(query)))[:5]
+    assert [vector_id for vector_id, _ in results] == [
+        vectors[i].vector_id for i in expected]
+
+
+def test_flat_index_incremental_segments(tmp_path, make_vectors) -> None:
+    index = FlatIndex(path=str(tmp_path), max_segments=2)
+    for parent_id in ["a", "b", "c"]:
+        index.add(make_vectors(np.eye(4), parent_id=parent_id))
+        index.save()
+    # the third save merges the segments
+    assert len(index.storage.read_manifest()["segments"]) == 1
+    assert len(index) == 12
+
+    index.remove_document("b")
+    index.save()
+    loaded_index = FlatIndex(path=str(tmp_path))
+    assert loaded_index.load()
+    assert len(loaded_index) == 8
+    assert len(loaded_index.search([0.0, 1.0, 0.0, 0.0], k=20)) == 8
+
+
+def test_flat_index_shares_memory_mapped_segments(
+    tmp_path,
+    make_vectors
+) -> None:
+    writer = FlatIndex(path=str(tmp_path))
+    writer.add(make_vectors(np.eye(4), parent_id="a"))
+    writer.save()
+    reader = FlatIndex(path=str(tmp_path))
+    assert reader.load()
+    assert isinstance(reader._segments[0].embeddings, np.memmap)
+    first_segment = reader._segments[0]
+
+    writer.add(make_vectors(np.eye(4), parent_id="b"))
+    writer.save()
+    assert len(reader.search([1.0, 0.0, 0.0, 0.0], k=10)) == 8
+    # the segment that was already mapped is not opened again
+    assert reader._segments[0] is first_segment
+
+
+@pytest.mark.parametrize("index_class", [FlatIndex, IVFIndex])
+def test_search_candidate_ids(
+    tmp_path,
+    clustered_embeddings,
+    index_class,
+    make_vectors
+):
+    index = index_class(path=str(tmp_path))
+    if index_class is IVFIndex:
+        index = IVFIndex(
+            path=str(tmp_path), nlist=20, nprobe=1, exact_search_threshold=100)
+    vectors = make_vectors(clustered_embeddings)
+    index.add(vectors[:500])
+    index.save()
+    index.add(vectors[500:])
+    # candidates from another cluster than the query, in both segments
+    candidates = {v.vector_id for v in vectors[200:250] + vectors[900:950]}
+    results = index.search(
+        clustered_embeddings[0].tolist(), k=5, candidate_ids=candidates)
+    assert len(results) == 5
+    assert all(vector_id in candidates for vector_id, _ in results)
+    assert index.search(
+        clustered_embeddings[0].tolist(), k=5, candidate_ids=set()) == []
+
+
+@pytest.mark.parametrize("index_class", [FlatIndex, IVFIndex])
+def test_removed_vectors_are_masked_until_compaction(
+    tmp_path,
+    index_class,
+    make_vectors
+):
+    index = index_class(path=str(tmp_path))
+    for parent_id in ["a", "b", "c"]:
+        index.add(make_vectors(np.eye(4), parent_id=parent_id))
+    index.save()
+    index.remove_document("b")
+    index.save()
+    assert len(index) == 8
+    assert index.num_deleted() == 4
+    assert len(index.search([0.0, 1.0, 0.0, 0.0], k=20)) == 8
+
+    # the masked rows survive a reload
+    loaded_index = index_class(path=str(tmp_path))
+    assert loaded_index.load()
+    assert len(loaded_index) == 8
+    assert len(loaded_index.search([0.0, 1.0, 0.0, 0.0], k=20)) == 8
+
+    index.compact()
+    assert index.num_deleted() == 0
+    manifest = index.storage.read_manifest()
+    assert "alive" not in manifest.get("files", {})
+    assert all("alive" not in files for files in manifest.get("segments", []))
+    compacted_index = index_class(path=str(tmp_path))
+    assert compacted_index.load()
+    assert len(compacted_index) == 8
+    assert compacted_index.num_deleted() == 0
+
+
+@pytest.mark.parametrize("index_class", [FlatIndex, IVFIndex])
+def test_removing_a_document_only_saves_the_mask(
+    tmp_path,
+    index_class,
+    clustered_embeddings,
+    make_vectors
+):
+    index = index_class(path=str(tmp_path))
+    if index_class is IVFIndex:
+        index = IVFIndex(
+            path=str(tmp_path), nlist=20, exact_search_threshold=100)
+    for parent_id in ["a", "b"]:
+        index.add(make_vectors(clustered_embeddings, parent_id=parent_id))
+    index.save()
+    before = index.storage.read_manifest()
+    files_before = set(os.listdir(tmp_path))
+
+    index.remove_document("b")
+    index.save()
+    after = index.storage.read_manifest()
+    assert [
+        {key: f for key, f in files.items() if key != "alive"}
+        for files in after["segments"]
+    ] == before["segments"]
+    assert after.get("extra_files") == before.get("extra_files")
+    new_files = set(os.listdir(tmp_path)) - files_before
+    assert new_files and all(f.startswith("alive-") for f in new_files)
+
+
+@pytest.mark.parametrize("index_class", [FlatIndex, IVFIndex])
+def test_reindexed_document_survives_reload(
+    tmp_path,
+    index_class,
+    make_vectors
+):
+    index = index_class(path=str(tmp_path))
+    index.add(make_vectors(np.eye(4), parent_id="a"))
+    index.add(make_vectors(np.eye(4), parent_id="b"))
+    index.save()
+    # replace the vectors of a document with new ones of the same parent
+    index.remove_document("a")
+    new_vectors = make_vectors(np.eye(4)[:2], parent_id="a")
+    index.add(new_vectors)
+    index.save()
+    assert len(index) == 6
+
+    loaded_index = index_class(path=str(tmp_path))
+    assert loaded_index.load()
+    assert len(loaded_index) == 6
+    assert loaded_index.num_deleted() == 4
+    results = loaded_index.search([1.0, 0.0, 0.0, 0.0], k=10)
+    assert {v.vector_id for v in new_vectors} <= {
+        vector_id for vector_id, _ in results}
+
+
+@pytest.mark.parametrize("index_class", [FlatIndex, IVFIndex])
+def test_concurrent_writers_do_not_overwrite_each_other(
+    tmp_path,
+    index_class,
+    make_vectors
+):
+    first = index_class(path=str(tmp_path))
+    second = index_class(path=str(tmp_path))
+    first_vectors = make_vectors(np.eye(4)[:1], parent_id="a")
+    second_vectors = make_vectors(np.eye(4)[1:2], parent_id="b")
+    first.add(first_vectors)
+    second.add(second_vectors)
+    first.save()
+    second.save()
+
+    loaded_index = index_class(path=str(tmp_path))
+    assert loaded_index.load()
+    assert len(loaded_index) == 2
+    # every file on disk belongs to the snapshot
+    manifest = loaded_index.storage.read_manifest()
+    files = manifest["files"].values() if "files" in manifest else [
+        f for segment in manifest["segments"] for f in segment.values()]
+    assert {p.name for p in tmp_path.glob("*.npy")} == set(files)
+
+    # a document saved by one worker is removed by the other
+    first.remove_document("b")
+    first.save()
+    assert loaded_index.load()
+    assert len(loaded_index) == 1
+    assert loaded_index.search([1.0, 0.0, 0.0, 0.0], k=10)[0][0] == \
+        first_vectors[0].vector_id
+
+
+def test_flat_index_clear_replaces_the_saved_index(
+    tmp_path,
+    make_vectors
+) -> None:
+    writer = FlatIndex(path=str(tmp_path))
+    writer.add(make_vectors(np.eye(4)))
+    writer.save()
+    rebuilt = FlatIndex(path=str(tmp_path))
+    rebuilt.clear()
+    rebuilt.add(make_vectors(np.eye(4)[:1]))
+    rebuilt.save()
+    loaded_index = FlatIndex(path=str(tmp_path))
+    assert loaded_index.load()
+    assert len(loaded_index) == 1